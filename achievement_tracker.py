@@ -0,0 +1,83 @@
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, Set
+
+# Счётчики событий, по которым выдаются достижения (таблица
+# achievement_counters, миграция 10).
+# Сообщения считаются в users.total_message_count (пишет RewardFlusher).
+COUNTERS = ('purchases', 'transfers', 'donated', 'duel_wins')
+
+
+class AchievementTracker:
+    """Счётчики для достижений и кэш открытых достижений.
+
+    Счётчики увеличиваются в той же транзакции, что и само событие,
+    и возвращают новые значения, поэтому проверки не читают историю
+    transactions и duels. Открытые достижения пользователя загружаются
+    один раз и дальше проверяются по множеству в памяти.
+    """
+
+    def __init__(self, db, max_users: int = 10000):
+        self.db = db
+        self.max_users = max_users
+        self._unlocked: "OrderedDict[int, Set[str]]" = OrderedDict()
+
+    async def increment(self, conn, user_id: int, **deltas: int) -> Dict[str, int]:
+        """Увеличение счётчиков в транзакции вызывающей единицы записи.
+
+        Возвращает новые значения всех счётчиков пользователя.
+        """
+        columns = [name for name in deltas if name in COUNTERS]
+        if not columns:
+            raise ValueError(f"Неизвестные счётчики: {', '.join(deltas)}")
+
+        cursor = await conn.execute(f'''
+            INSERT INTO achievement_counters (user_id, {', '.join(columns)})
+            VALUES (?, {', '.join('?' * len(columns))})
+            ON CONFLICT(user_id) DO UPDATE SET
+                {', '.join(f'{name} = {name} + excluded.{name}' for name in columns)}
+            RETURNING {', '.join(COUNTERS)}
+        ''', (user_id, *(deltas[name] for name in columns)))
+        row = (await cursor.fetchall())[0]
+        return dict(zip(COUNTERS, row))
+
+    async def get_unlocked(self, user_id: int) -> Set[str]:
+        unlocked = self._unlocked.get(user_id)
+        if unlocked is not None:
+            self._unlocked.move_to_end(user_id)
+            return unlocked
+
+        rows = await self.db.fetchall(
+            'SELECT achievement_name FROM achievements WHERE user_id = ?',
+            (user_id,)
+        )
+        unlocked = {row[0] for row in rows}
+
+        self._unlocked[user_id] = unlocked
+        while len(self._unlocked) > self.max_users:
+            self._unlocked.popitem(last=False)
+        return unlocked
+
+    async def unlock(self, user_id: int, achievement_id: str) -> bool:
+        """Запись достижения; False, если оно уже открыто"""
+        unlocked = await self.get_unlocked(user_id)
+        if achievement_id in unlocked:
+            return False
+
+        # Отмечаем до записи, чтобы параллельная проверка не выдала его дважды
+        unlocked.add(achievement_id)
+        try:
+            # Уникальный индекс (user_id, achievement_name) отсекает повтор
+            # из другого процесса или устаревшего кэша
+            inserted = await self.db.execute_write('''
+                INSERT OR IGNORE INTO achievements (user_id, achievement_name, unlocked_at)
+                VALUES (?, ?, ?)
+            ''', (user_id, achievement_id, datetime.now().isoformat()))
+        except Exception:
+            unlocked.discard(achievement_id)
+            raise
+        return inserted > 0
+
+    def invalidate(self, *user_ids: int):
+        for user_id in user_ids:
+            self._unlocked.pop(user_id, None)
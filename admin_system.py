@@ -4,9 +4,7 @@ import zipfile
 from datetime import datetime, timedelta
 from pathlib import Path
 from typing import Optional, List, Tuple, Any
-import matplotlib.pyplot as plt
-import io
-import shutil
+import tempfile
 
 from telegram import (
     Update, 
@@ -15,69 +13,23 @@ from telegram import (
 )
 from telegram.ext import ContextTypes
 
+from charts import ChartRenderer, LineChart
+from database import to_epoch
+from economy_stats import EconomyStats
+from ledger import TX_TYPES
+from repository import UserRepository
+
 class AdminSystem:
-    def __init__(self, db_connection):
-        self.conn = db_connection
+    def __init__(self, db, user_cache=None, users: Optional[UserRepository] = None, leaderboards=None,
+                 economy_stats: Optional[EconomyStats] = None, charts: Optional[ChartRenderer] = None):
+        self.db = db
+        self.user_cache = user_cache
+        self.users = users or UserRepository(db, user_cache)
+        self.leaderboards = leaderboards
+        self.economy_stats = economy_stats or EconomyStats(db)
+        self.charts = charts or ChartRenderer()
         self.audit_log = []
     
-    async def init_admin_tables(self):
-        """Инициализация таблиц администрирования"""
-        await self.conn.execute('''
-            CREATE TABLE IF NOT EXISTS admin_logs (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                admin_id INTEGER,
-                action TEXT,
-                target_type TEXT,
-                target_id INTEGER,
-                old_value TEXT,
-                new_value TEXT,
-                timestamp TEXT,
-                reason TEXT
-            )
-        ''')
-        
-        await self.conn.execute('''
-            CREATE TABLE IF NOT EXISTS system_settings (
-                key TEXT PRIMARY KEY,
-                value TEXT,
-                description TEXT,
-                updated_by INTEGER,
-                updated_at TEXT
-            )
-        ''')
-        
-        await self.conn.execute('''
-            CREATE TABLE IF NOT EXISTS economy_settings (
-                parameter TEXT PRIMARY KEY,
-                value REAL,
-                min_value REAL,
-                max_value REAL,
-                description TEXT
-            )
-        ''')
-        
-        # Инициализация настроек экономики
-        default_settings = [
-            ('daily_base_reward', 50, 10, 200, 'Базовая награда за ежедневный бонус'),
-            ('daily_streak_bonus', 10, 5, 50, 'Бонус за серию ежедневных бонусов'),
-            ('message_min_reward', 1, 0, 5, 'Минимальная награда за сообщение'),
-            ('message_max_reward', 3, 1, 10, 'Максимальная награда за сообщение'),
-            ('xp_per_message', 1, 0, 5, 'Опыт за сообщение'),
-            ('tax_rate_small', 0.1, 0, 0.3, 'Налог на мелкие переводы'),
-            ('tax_rate_large', 0.15, 0.1, 0.5, 'Налог на крупные переводы'),
-            ('duel_tax', 0.05, 0, 0.2, 'Налог на дуэли'),
-            ('clan_creation_cost', 1000, 500, 5000, 'Стоимость создания клана')
-        ]
-        
-        for setting in default_settings:
-            await self.conn.execute('''
-                INSERT OR IGNORE INTO economy_settings 
-                (parameter, value, min_value, max_value, description)
-                VALUES (?, ?, ?, ?, ?)
-            ''', setting)
-        
-        await self.conn.commit()
-
     async def admin_edit_user(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Редактирование данных пользователя"""
         if not await self.is_owner(update):
@@ -97,12 +49,16 @@ class AdminSystem:
         new_value = context.args[2]
         reason = ' '.join(context.args[3:])
         
+        # Имя поля подставляется в SQL: только поля из подсказки
+        if field not in ['balance', 'xp', 'level', 'warns', 'daily_streak']:
+            await update.message.reply_text("❌ Это поле нельзя редактировать!")
+            return
+        
         # Получаем пользователя
-        cursor = await self.conn.execute(
+        target_user = await self.db.fetchone(
             'SELECT user_id, username FROM users WHERE username = ?',
             (target_username,)
         )
-        target_user = await cursor.fetchone()
         
         if not target_user:
             await update.message.reply_text("❌ Пользователь не найден!")
@@ -111,34 +67,52 @@ class AdminSystem:
         user_id, username = target_user
         
         # Получаем старое значение
-        cursor = await self.conn.execute(
+        old_value = (await self.db.fetchone(
             f'SELECT {field} FROM users WHERE user_id = ?',
             (user_id,)
-        )
-        old_value = (await cursor.fetchone())[0]
+        ))[0]
         
         try:
             # Обновляем значение
             if field in ['balance', 'xp', 'level', 'warns', 'daily_streak']:
                 new_value = int(new_value)
             
-            await self.conn.execute(
-                f'UPDATE users SET {field} = ? WHERE user_id = ?',
-                (new_value, user_id)
-            )
+            async def write_edit(conn):
+                if field == 'balance':
+                    # Баланс меняется разницей с записью в журнал, чтобы
+                    # сумма transactions сходилась с балансами
+                    cursor = await conn.execute(
+                        'SELECT balance FROM users_hot WHERE user_id = ?', (user_id,)
+                    )
+                    delta = new_value - (await cursor.fetchone())[0]
+                    await self.users.update_balances(conn, [(user_id, delta)])
+                    await self.users.insert_transactions(conn, [
+                        (user_id, delta, 'admin_adjust', None, None, reason)
+                    ])
+                else:
+                    await conn.execute(
+                        f'UPDATE users SET {field} = ? WHERE user_id = ?',
+                        (new_value, user_id)
+                    )
+                
+                # Логируем действие
+                await self.log_admin_action(
+                    update.effective_user.id,
+                    f'edit_user_{field}',
+                    'user',
+                    user_id,
+                    str(old_value),
+                    str(new_value),
+                    reason,
+                    conn=conn
+                )
             
-            # Логируем действие
-            await self.log_admin_action(
-                update.effective_user.id,
-                f'edit_user_{field}',
-                'user',
-                user_id,
-                str(old_value),
-                str(new_value),
-                reason
-            )
+            await self.db.write(write_edit)
             
-            await self.conn.commit()
+            if self.user_cache:
+                self.user_cache.invalidate(user_id)
+            if self.leaderboards:
+                await self.leaderboards.refresh_users([user_id])
             
             await update.message.reply_text(
                 f"✅ Пользователь @{username} обновлен!\n"
@@ -156,84 +130,48 @@ class AdminSystem:
             await update.message.reply_text("❌ Недостаточно прав!")
             return
         
-        # Базовая статистика
-        cursor = await self.conn.execute('SELECT COUNT(*) FROM users')
-        total_users = (await cursor.fetchone())[0]
+        # Базовая статистика из сводных счётчиков
+        totals = await self.economy_stats.totals()
         
-        cursor = await self.conn.execute('SELECT SUM(balance) FROM users')
-        total_coins = (await cursor.fetchone())[0] or 0
+        # Активность по календарным дням последнего сообщения
+        active_today = await self.economy_stats.active_users(1)
         
-        cursor = await self.conn.execute('SELECT AVG(balance) FROM users')
-        avg_balance = (await cursor.fetchone())[0] or 0
-        
-        cursor = await self.conn.execute('SELECT COUNT(*) FROM users WHERE balance > 1000')
-        rich_users = (await cursor.fetchone())[0]
-        
-        # Активность
-        cursor = await self.conn.execute('''
-            SELECT COUNT(*) FROM users 
-            WHERE last_message > datetime('now', '-1 day')
-        ''')
-        active_today = (await cursor.fetchone())[0]
-        
-        cursor = await self.conn.execute('''
-            SELECT COUNT(*) FROM users 
-            WHERE last_message > datetime('now', '-7 days')
-        ''')
-        active_week = (await cursor.fetchone())[0]
+        active_week = await self.economy_stats.active_users(7)
         
         # Экономика
-        cursor = await self.conn.execute('''
-            SELECT type, COUNT(*), SUM(amount) 
-            FROM transactions 
-            WHERE timestamp > datetime('now', '-1 day')
-            GROUP BY type
-        ''')
-        today_transactions = await cursor.fetchall()
+        today_transactions = await self.economy_stats.transactions_by_type()
         
         message = (
             "🤖 **Расширенная статистика системы**\n\n"
-            f"👥 **Пользователи:** {total_users}\n"
-            f"💰 **Общая экономика:** {total_coins:,} коинов\n"
-            f"📊 **Средний баланс:** {avg_balance:.0f} коинов\n"
-            f"🎩 **Состоятельных:** {rich_users} пользователей\n\n"
+            f"👥 **Пользователи:** {totals['users']}\n"
+            f"💰 **Общая экономика:** {totals['money_supply']:,} коинов\n"
+            f"📊 **Средний баланс:** {totals['avg_balance']:.0f} коинов\n"
+            f"🎩 **Состоятельных:** {totals['rich_users']} пользователей\n\n"
             f"📈 **Активность:**\n"
             f"• За сегодня: {active_today} пользователей\n"
             f"• За неделю: {active_week} пользователей\n\n"
             f"💸 **Транзакции за сегодня:**\n"
         )
         
-        for trans_type, count, amount in today_transactions:
-            message += f"• {trans_type}: {count} операций, {amount or 0:,} коинов\n"
+        for type_code, count, amount in today_transactions:
+            message += f"• {TX_TYPES.get(type_code, type_code)}: {count} операций, {amount or 0:,} коинов\n"
         
         # График активности
-        cursor = await self.conn.execute('''
-            SELECT date(timestamp), COUNT(*) 
-            FROM transactions 
-            WHERE timestamp > datetime('now', '-30 days')
-            GROUP BY date(timestamp)
-            ORDER BY date(timestamp)
-        ''')
-        activity_data = await cursor.fetchall()
+        activity_data = await self.economy_stats.daily_transactions(30)
         
         if activity_data:
-            dates = [row[0][5:] for row in activity_data]  # MM-DD
-            counts = [row[1] for row in activity_data]
-            
-            plt.figure(figsize=(12, 4))
-            plt.plot(dates, counts, marker='o', linewidth=2)
-            plt.title('Активность за 30 дней')
-            plt.xticks(rotation=45)
-            plt.grid(True, alpha=0.3)
-            plt.tight_layout()
-            
-            buf = io.BytesIO()
-            plt.savefig(buf, format='png', dpi=100)
-            buf.seek(0)
-            plt.close()
+            chart = LineChart(
+                labels=tuple(row[0][5:] for row in activity_data),  # MM-DD
+                values=tuple(row[1] for row in activity_data),
+                title='Активность за 30 дней',
+                size=(12, 4),
+                dpi=100,
+                label_rotation=45
+            )
             
-            await update.message.reply_photo(
-                photo=buf,
+            await self.charts.reply_chart(
+                update.message,
+                chart,
                 caption=message,
                 parse_mode='Markdown'
             )
@@ -248,11 +186,10 @@ class AdminSystem:
         
         if not context.args:
             # Показать текущие настройки
-            cursor = await self.conn.execute('''
+            settings = await self.db.fetchall('''
                 SELECT parameter, value, min_value, max_value, description 
                 FROM economy_settings
             ''')
-            settings = await cursor.fetchall()
             
             message = "⚙️ **Текущие экономические настройки:**\n\n"
             for param, value, min_val, max_val, desc in settings:
@@ -276,10 +213,9 @@ class AdminSystem:
             return
         
         # Проверяем существование параметра и границы
-        cursor = await self.conn.execute('''
+        result = await self.db.fetchone('''
             SELECT min_value, max_value FROM economy_settings WHERE parameter = ?
         ''', (parameter,))
-        result = await cursor.fetchone()
         
         if not result:
             await update.message.reply_text("❌ Неизвестный параметр!")
@@ -292,21 +228,23 @@ class AdminSystem:
             return
         
         # Обновляем параметр
-        await self.conn.execute('''
-            UPDATE economy_settings SET value = ? WHERE parameter = ?
-        ''', (new_value, parameter))
-        
-        await self.log_admin_action(
-            update.effective_user.id,
-            'economy_update',
-            'system',
-            None,
-            str(result),
-            str(new_value),
-            f"Изменение параметра {parameter}"
-        )
+        async def write_setting(conn):
+            await conn.execute('''
+                UPDATE economy_settings SET value = ? WHERE parameter = ?
+            ''', (new_value, parameter))
+            
+            await self.log_admin_action(
+                update.effective_user.id,
+                'economy_update',
+                'system',
+                None,
+                str(result),
+                str(new_value),
+                f"Изменение параметра {parameter}",
+                conn=conn
+            )
         
-        await self.conn.commit()
+        await self.db.write(write_setting)
         
         await update.message.reply_text(
             f"✅ Экономический параметр обновлен!\n"
@@ -387,15 +325,15 @@ class AdminSystem:
             query += "warns > ?"
             params.append(int(value))
         elif criterion == 'active':
-            query += "last_message > datetime('now', '-7 days')"
+            query += "last_message > ?"
+            params.append((datetime.now() - timedelta(days=7)).isoformat())
         else:
             await update.message.reply_text("❌ Неизвестный критерий!")
             return
         
         query += " ORDER BY balance DESC LIMIT 50"
         
-        cursor = await self.conn.execute(query, params)
-        users = await cursor.fetchall()
+        users = await self.db.fetchall(query, params)
         
         if not users:
             await update.message.reply_text("❌ Пользователи не найдены!")
@@ -433,7 +371,7 @@ class AdminSystem:
                 filename = f"full_backup_{timestamp}.zip"
                 await self.create_full_backup(backup_dir / filename)
             elif backup_type == 'database':
-                filename = f"db_backup_{timestamp}.db"
+                filename = f"db_backup_{timestamp}.zip"
                 await self.create_database_backup(backup_dir / filename)
             elif backup_type == 'logs':
                 filename = f"logs_backup_{timestamp}.zip" 
@@ -453,11 +391,17 @@ class AdminSystem:
         except Exception as e:
             await update.message.reply_text(f"❌ Ошибка создания бэкапа: {e}")
 
+    async def write_database_files(self, zipf: zipfile.ZipFile, prefix: str = ''):
+        """Копии всех файлов базы (основной и доменов) в архив"""
+        with tempfile.TemporaryDirectory() as tmp:
+            for snapshot in await self.db.backup(Path(tmp)):
+                zipf.write(snapshot, prefix + snapshot.name)
+
     async def create_full_backup(self, filepath: Path):
         """Создание полной резервной копии"""
-        with zipfile.ZipFile(filepath, 'w') as zipf:
-            # База данных
-            zipf.write('bot_database.db', 'bot_database.db')
+        with zipfile.ZipFile(filepath, 'w', zipfile.ZIP_DEFLATED) as zipf:
+            # База данных: все файлы одним согласованным снимком
+            await self.write_database_files(zipf)
             
             # Конфиги
             for config_file in ['bad_words.json', 'config.json']:
@@ -471,8 +415,8 @@ class AdminSystem:
 
     async def create_database_backup(self, filepath: Path):
         """Создание резервной копии базы данных"""
-        import shutil
-        shutil.copy2('bot_database.db', filepath)
+        with zipfile.ZipFile(filepath, 'w', zipfile.ZIP_DEFLATED) as zipf:
+            await self.write_database_files(zipf)
 
     async def create_logs_backup(self, filepath: Path):
         """Создание резервной копии логов"""
@@ -483,28 +427,35 @@ class AdminSystem:
 
     async def log_admin_action(self, admin_id: int, action: str, target_type: str, 
                              target_id: Optional[int], old_value: str, 
-                             new_value: str, reason: str):
-        """Логирование действий администратора"""
-        await self.conn.execute('''
+                             new_value: str, reason: str, conn=None):
+        """Логирование действий администратора.
+
+        С conn запись идёт в транзакции вызывающего кода.
+        """
+        sql = '''
             INSERT INTO admin_logs 
             (admin_id, action, target_type, target_id, old_value, new_value, timestamp, reason)
             VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (admin_id, action, target_type, target_id, old_value, new_value, 
-              datetime.now().isoformat(), reason))
-        await self.conn.commit()
+        '''
+        params = (admin_id, action, target_type, target_id, old_value, new_value, 
+                  datetime.now().isoformat(), reason)
+        
+        if conn is not None:
+            await conn.execute(sql, params)
+        else:
+            await self.db.execute_write(sql, params)
 
     async def get_admin_logs(self, days: int = 7, limit: int = 50):
         """Получение логов администратора"""
-        cursor = await self.conn.execute('''
+        return await self.db.fetchall('''
             SELECT al.action, al.target_type, al.old_value, al.new_value, 
                    al.timestamp, al.reason, u.username
             FROM admin_logs al
             JOIN users u ON al.admin_id = u.user_id
-            WHERE al.timestamp > datetime('now', ?)
-            ORDER BY al.timestamp DESC
+            WHERE al.ts > ?
+            ORDER BY al.ts DESC
             LIMIT ?
-        ''', (f'-{days} days', limit))
-        return await cursor.fetchall()
+        ''', (to_epoch(datetime.now() - timedelta(days=days)), limit))
 
     async def is_owner(self, update: Update) -> bool:
         # Замените на вашу логику проверки владельца
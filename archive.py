@@ -0,0 +1,232 @@
+import asyncio
+import gzip
+import json
+import logging
+import os
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from database import to_epoch
+from ledger import history_columns, render_row
+
+# Порядок полей строки архива: тип и описание хранятся текстом,
+# чтобы файлы читались без базы и таблиц кодов
+ARCHIVE_FIELDS = ('id', 'user_id', 'amount', 'type', 'timestamp', 'description')
+
+
+class TransactionArchiver:
+    """Перенос старых транзакций в сжатые помесячные файлы.
+
+    Строки старше окна хранения переносятся порциями: порция читается
+    через пул читателей, дописывается в файл месяца
+    (transactions-YYYY-MM.jsonl.gz, новый gzip-член на каждую порцию)
+    и только после этого удаляется из базы отдельной единицей записи
+    по диапазону id. Между порциями писатель свободен.
+
+    index.json хранит по месяцам число строк и диапазоны id/времени,
+    а pending — порцию, записанную в файлы, но ещё не удалённую:
+    строки с id <= max_id и ts < cutoff. После сбоя между записью
+    файла и удалением следующий запуск сначала удаляет именно эти
+    строки, поэтому они не попадут в архив дважды, а строки той же
+    области id с более поздним ts не будут удалены без записи.
+
+    Рядом с файлом месяца лежит transactions-YYYY-MM.users.json -
+    пользователи, чьи строки есть в этом месяце: история пользователя
+    читает только такие месяцы.
+    """
+
+    def __init__(self, db, directory: str = 'archive', retention_days: int = 90,
+                 chunk_size: int = 5000):
+        self.db = db
+        self.directory = directory
+        self.retention_days = retention_days
+        self.chunk_size = chunk_size
+        self.index_path = os.path.join(directory, 'index.json')
+        self.index: Dict[str, Any] = {'pending': None, 'months': {}}
+        self._lock = asyncio.Lock()
+        # Пользователи месяцев, загруженные с диска
+        self._month_users: Dict[str, Set[int]] = {}
+        self.last_run: Optional[Dict[str, Any]] = None
+
+    def load_index(self):
+        os.makedirs(self.directory, exist_ok=True)
+        try:
+            with open(self.index_path, encoding='utf-8') as f:
+                self.index = json.load(f)
+        except FileNotFoundError:
+            pass
+
+    @staticmethod
+    def _write_json(path: str, data: Any, **kwargs):
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, **kwargs)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    def _save_index(self):
+        self._write_json(self.index_path, self.index, indent=1)
+
+    def month_path(self, month: str) -> str:
+        return os.path.join(self.directory, f'transactions-{month}.jsonl.gz')
+
+    def month_users_path(self, month: str) -> str:
+        return os.path.join(self.directory, f'transactions-{month}.users.json')
+
+    def _load_month_users(self, month: str) -> Set[int]:
+        """Пользователи месяца (выполняется в потоке)"""
+        users = self._month_users.get(month)
+        if users is not None:
+            return users
+
+        try:
+            with open(self.month_users_path(month), encoding='utf-8') as f:
+                users = set(json.load(f))
+        except FileNotFoundError:
+            # Месяц, заархивированный до появления списков: один полный проход
+            users = set()
+            with gzip.open(self.month_path(month), 'rt', encoding='utf-8') as f:
+                for line in f:
+                    users.add(json.loads(line)['user_id'])
+            self._write_json(self.month_users_path(month), sorted(users))
+
+        self._month_users[month] = users
+        return users
+
+    def _append(self, rows: List[tuple], cutoff: int):
+        """Дозапись порции в файлы месяцев (выполняется в потоке)"""
+        by_month: Dict[str, List[tuple]] = {}
+        for row in rows:
+            by_month.setdefault(row[4][:7], []).append(row)
+
+        months = self.index['months']
+        for month, month_rows in by_month.items():
+            text = ''.join(
+                json.dumps(dict(zip(ARCHIVE_FIELDS, row)), ensure_ascii=False) + '\n'
+                for row in month_rows
+            )
+            # Отдельный gzip-член: склейка членов читается как один поток
+            with open(self.month_path(month), 'ab') as f:
+                f.write(gzip.compress(text.encode('utf-8')))
+                f.flush()
+                os.fsync(f.fileno())
+
+            users = self._load_month_users(month) if month in months else set()
+            users.update(row[1] for row in month_rows)
+            self._month_users[month] = users
+            self._write_json(self.month_users_path(month), sorted(users))
+
+            stamps = [to_epoch(datetime.fromisoformat(row[4])) for row in month_rows]
+            info = months.setdefault(month, {
+                'rows': 0, 'min_id': month_rows[0][0], 'max_id': 0,
+                'min_ts': min(stamps), 'max_ts': 0
+            })
+            info['rows'] += len(month_rows)
+            info['max_id'] = max(info['max_id'], month_rows[-1][0])
+            info['min_ts'] = min(info['min_ts'], min(stamps))
+            info['max_ts'] = max(info['max_ts'], max(stamps))
+
+        self.index['pending'] = {'max_id': rows[-1][0], 'cutoff': cutoff}
+        self._save_index()
+
+    async def _delete_pending(self):
+        """Удаление из базы порции, уже записанной в файлы"""
+        pending = self.index.get('pending')
+        await self.db.execute_write(
+            'DELETE FROM transactions WHERE id <= ? AND ts < ?',
+            (pending['max_id'], pending['cutoff'])
+        )
+        self.index['pending'] = None
+        await asyncio.to_thread(self._save_index)
+
+    async def archive_old(self, now: Optional[datetime] = None) -> int:
+        """Перенос транзакций старше retention_days; возвращает число строк"""
+        cutoff = to_epoch(now or datetime.now()) - self.retention_days * 86400
+        moved = 0
+        chunks = 0
+        started = time.perf_counter()
+
+        async with self._lock:
+            # Порция, записанная до сбоя, только удаляется
+            if self.index.get('pending'):
+                await self._delete_pending()
+
+            while True:
+                rows = [render_row(row) for row in await self.db.fetchall(f'''
+                    SELECT {history_columns()} FROM transactions
+                    WHERE ts < ?
+                    ORDER BY id
+                    LIMIT ?
+                ''', (cutoff, self.chunk_size))]
+                if not rows:
+                    break
+
+                await asyncio.to_thread(self._append, rows, cutoff)
+                await self._delete_pending()
+                moved += len(rows)
+                chunks += 1
+
+                # Между порциями даём пройти обычным записям
+                await asyncio.sleep(0)
+
+        elapsed = time.perf_counter() - started
+        self.last_run = {'rows': moved, 'chunks': chunks, 'seconds': elapsed, 'at': time.time()}
+        if moved:
+            logging.info(f"В архив перенесено {moved} транзакций за {chunks} порций, {elapsed:.1f}с")
+        return moved
+
+    def _read_user(self, month: str, user_id: int) -> List[Dict[str, Any]]:
+        rows = []
+        with gzip.open(self.month_path(month), 'rt', encoding='utf-8') as f:
+            for line in f:
+                row = json.loads(line)
+                if row['user_id'] == user_id:
+                    rows.append(row)
+        return rows
+
+    async def user_history(self, user_id: int, limit: int,
+                           created_at: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Архивные транзакции пользователя от новых к старым.
+
+        Читаются только месяцы, в которых есть строки пользователя,
+        начиная с последнего; чтение останавливается, как только
+        набрано limit строк. Пользователь, созданный (created_at) после
+        последней архивной строки, в архив не попадал вовсе.
+        """
+        months = self.index['months']
+        if created_at and months and (
+            to_epoch(datetime.fromisoformat(created_at)) > max(info['max_ts'] for info in months.values())
+        ):
+            return []
+
+        result: List[Dict[str, Any]] = []
+        for month in sorted(months, reverse=True):
+            users = self._month_users.get(month)
+            if users is None:
+                users = await asyncio.to_thread(self._load_month_users, month)
+            if user_id not in users:
+                continue
+
+            rows = await asyncio.to_thread(self._read_user, month, user_id)
+            result.extend(reversed(rows))
+            if len(result) >= limit:
+                break
+
+        return result[:limit]
+
+    def get_stats(self) -> Dict[str, Any]:
+        months: List[Tuple[str, int, int]] = []
+        for month, info in sorted(self.index['months'].items()):
+            try:
+                size = os.path.getsize(self.month_path(month))
+            except OSError:
+                size = 0
+            months.append((month, info['rows'], size))
+        return {
+            'months': months,
+            'rows': sum(rows for _, rows, _ in months),
+            'bytes': sum(size for _, _, size in months),
+            'last_run': self.last_run
+        }
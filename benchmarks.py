@@ -0,0 +1,972 @@
+"""Нагрузочные замеры отдельных подсистем бота.
+
+Запуск: python benchmarks.py <замер> [параметры]
+"""
+import argparse
+import asyncio
+import io
+import os
+import random
+import string
+import tempfile
+import time
+
+from datetime import datetime, timedelta
+
+from PIL import Image, ImageDraw, ImageFont
+
+from captcha_pool import CAPTCHA_SIZE, NOISE_POINTS, CaptchaPool
+from charts import ChartRenderer, LineChart
+from config import Config
+from database import Database, to_epoch
+from economy_stats import EconomyStats
+from leaderboards import SortedIndex
+from ledger import TX_CODES, Ledger
+from migrations import (
+    MIGRATIONS, SHOP_ITEMS, apply_migrations, base_schema, compact_transactions, epoch_column_sql,
+    table_bytes, users_hot_split
+)
+from seasonal_system import SEASON_REWARD_TIERS, SeasonalSystem
+from word_filter import WordFilter
+
+
+def random_word(rng: random.Random, min_len: int = 4, max_len: int = 10) -> str:
+    return ''.join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(min_len, max_len)))
+
+
+def bench_word_filter(args):
+    """check_bad_words: цикл подстрок по каждому слову против автомата"""
+    rng = random.Random(42)
+    words = list({random_word(rng) for _ in range(args.words)})
+    filters = [(word, 'warn') for word in words]
+    messages = [
+        ' '.join(random_word(rng, 2, 8) for _ in range(rng.randint(3, 25)))
+        for _ in range(args.messages)
+    ]
+
+    # Прежний вариант: подстрочная проверка каждого слова
+    started = time.perf_counter()
+    legacy_hits = 0
+    for text in messages:
+        for word, action in filters:
+            if word.lower() in text:
+                legacy_hits += 1
+                break
+    legacy = time.perf_counter() - started
+
+    started = time.perf_counter()
+    engine = WordFilter()
+    engine.load(filters)
+    build = time.perf_counter() - started
+
+    started = time.perf_counter()
+    engine_hits = sum(1 for text in messages if engine.find_first(text))
+    automaton = time.perf_counter() - started
+
+    print(f"Слов в фильтре: {len(filters)}, сообщений: {len(messages)}")
+    print(f"Цикл по словам:  {legacy:.3f}с ({len(messages) / legacy:,.0f} сообщ./с), совпадений {legacy_hits}")
+    print(f"Автомат:         {automaton:.3f}с ({len(messages) / automaton:,.0f} сообщ./с), совпадений {engine_hits}")
+    print(f"Построение автомата: {build * 1000:.1f}мс, ускорение x{legacy / automaton:.1f}")
+
+
+async def create_bench_db(path: str, users: int, **kwargs) -> Database:
+    """Временная база с минимальными users_hot (и представлением users) и transactions"""
+    db = Database(path, **kwargs)
+    await db.connect()
+    await db.conn.execute('CREATE TABLE users_hot (user_id INTEGER PRIMARY KEY, balance INTEGER DEFAULT 0) WITHOUT ROWID')
+    await db.conn.execute('CREATE VIEW users AS SELECT user_id, balance FROM users_hot')
+    await db.conn.execute('''
+        CREATE TABLE transactions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            amount INTEGER,
+            type_code INTEGER,
+            timestamp TEXT,
+            counterparty_id INTEGER,
+            item_id INTEGER,
+            note TEXT
+        )
+    ''')
+    await db.conn.executemany('INSERT INTO users_hot (user_id) VALUES (?)', [(i,) for i in range(users)])
+    await db.conn.commit()
+    return db
+
+
+async def reward_action(conn, user_id: int, amount: int):
+    """Типичное действие пользователя: начисление и запись транзакции"""
+    await conn.execute('UPDATE users_hot SET balance = balance + ? WHERE user_id = ?', (amount, user_id))
+    await conn.execute(
+        f"INSERT INTO transactions (user_id, amount, type_code, timestamp) VALUES (?, ?, {TX_CODES['daily']}, datetime('now'))",
+        (user_id, amount)
+    )
+
+
+async def run_group_commit(args):
+    per_client = args.actions // args.clients
+
+    with tempfile.TemporaryDirectory(dir=args.dir) as tmp:
+        for mode in ('commit', 'group'):
+            db = await create_bench_db(os.path.join(tmp, f'{mode}.db'), args.users)
+            rng = random.Random(42)
+            lock = asyncio.Lock()
+
+            async def client():
+                for _ in range(per_client):
+                    user_id = rng.randrange(args.users)
+                    if mode == 'commit':
+                        # Прежний вариант: commit после каждого действия. Без блокировки
+                        # параллельные клиенты на общем соединении попадали бы в чужой commit
+                        async with lock:
+                            await reward_action(db.conn, user_id, 10)
+                            await db.conn.commit()
+                    else:
+                        await db.write(reward_action, user_id, 10)
+
+            if mode == 'group':
+                db.start_writer()
+
+            started = time.perf_counter()
+            await asyncio.gather(*(client() for _ in range(args.clients)))
+            elapsed = time.perf_counter() - started
+
+            actions = per_client * args.clients
+            commits = actions if mode == 'commit' else db.write_stats['commits']
+            label = 'commit на действие' if mode == 'commit' else 'групповая фиксация'
+            print(
+                f"{label:20} {elapsed:.2f}с: {actions / elapsed:,.0f} действий/с, "
+                f"{commits / elapsed:,.0f} фиксаций/с ({commits} фиксаций)"
+            )
+
+            await db.close()
+
+
+def bench_group_commit(args):
+    """Фиксация после каждого действия против группового писателя"""
+    print(f"Клиентов: {args.clients}, действий: {args.actions}")
+    asyncio.run(run_group_commit(args))
+
+
+async def run_read_pool(args):
+    with tempfile.TemporaryDirectory(dir=args.dir) as tmp:
+        for readers in (0, args.readers):
+            db = await create_bench_db(os.path.join(tmp, f'read{readers}.db'), args.users, readers=readers)
+            rng = random.Random(42)
+            await db.conn.executemany(
+                f"INSERT INTO transactions (user_id, amount, type_code, timestamp) VALUES (?, ?, {TX_CODES['daily']}, datetime('now'))",
+                [(rng.randrange(args.users), rng.randint(1, 100)) for _ in range(args.users * 10)]
+            )
+            await db.conn.commit()
+            db.start_writer()
+
+            latencies = []
+            done = asyncio.Event()
+
+            async def lookup_client():
+                while not done.is_set():
+                    started = time.perf_counter()
+                    await db.fetchone('SELECT balance FROM users WHERE user_id = ?', (rng.randrange(args.users),))
+                    latencies.append(time.perf_counter() - started)
+
+            async def report_client():
+                # Тяжёлый отчёт без индекса, как статистика или топы
+                for _ in range(args.reports):
+                    await db.fetchall('''
+                        SELECT user_id, SUM(amount) AS total FROM transactions
+                        GROUP BY user_id ORDER BY total DESC LIMIT 10
+                    ''')
+
+            async def writer_client():
+                while not done.is_set():
+                    await db.write(reward_action, rng.randrange(args.users), 10)
+
+            lookups = [asyncio.create_task(lookup_client()) for _ in range(args.clients)]
+            writes = asyncio.create_task(writer_client())
+            started = time.perf_counter()
+            await asyncio.gather(*(report_client() for _ in range(2)))
+            elapsed = time.perf_counter() - started
+            done.set()
+            await asyncio.gather(*lookups, writes)
+
+            latencies.sort()
+            p50 = latencies[len(latencies) // 2] * 1000
+            p99 = latencies[int(len(latencies) * 0.99)] * 1000
+            label = 'общее соединение' if readers == 0 else f'{readers} читателя'
+            print(
+                f"{label:18} отчёты {elapsed:.2f}с, точечных чтений {len(latencies) / elapsed:,.0f}/с, "
+                f"p50 {p50:.2f}мс, p99 {p99:.2f}мс, записей {db.write_stats['units']}"
+            )
+
+            await db.close()
+
+
+def bench_read_pool(args):
+    """Точечные чтения рядом с тяжёлыми отчётами: одно соединение против пула"""
+    print(f"Пользователей: {args.users}, клиентов чтения: {args.clients}, отчётов: {args.reports * 2}")
+    asyncio.run(run_read_pool(args))
+
+
+async def run_ledger(args):
+    per_client = args.actions // args.clients
+    initial = 3000
+
+    with tempfile.TemporaryDirectory(dir=args.dir) as tmp:
+        for mode in ('check_then_write', 'ledger'):
+            db = await create_bench_db(os.path.join(tmp, f'{mode}.db'), args.users)
+            await db.conn.execute('UPDATE users_hot SET balance = ?', (initial,))
+            await db.conn.commit()
+            db.start_writer()
+            ledger = Ledger()
+            rng = random.Random(42)
+            stats = {'ok': 0, 'rejected': 0, 'fees': 0}
+
+            async def transfer(from_id, to_id, amount, fee):
+                if mode == 'check_then_write':
+                    # Прежний вариант: проверка баланса чтением, затем безусловная запись
+                    balance = (await db.fetchone('SELECT balance FROM users WHERE user_id = ?', (from_id,)))[0]
+                    if balance < amount + fee:
+                        return False
+
+                    async def unit(conn):
+                        await conn.execute('UPDATE users_hot SET balance = balance - ? WHERE user_id = ?', (amount + fee, from_id))
+                        await conn.execute('UPDATE users_hot SET balance = balance + ? WHERE user_id = ?', (amount, to_id))
+                        await ledger.record(conn, [
+                            (from_id, -(amount + fee), 'transfer_out', to_id, None, None),
+                            (to_id, amount, 'transfer_in', from_id, None, None)
+                        ])
+                        return True
+                else:
+                    async def unit(conn):
+                        balances = await ledger.transfer(
+                            conn, from_id, to_id, amount + fee, amount,
+                            'transfer_out', 'transfer_in'
+                        )
+                        return balances is not None
+
+                return await db.write(unit)
+
+            async def client():
+                for _ in range(per_client):
+                    # Небольшая группа активных счетов, чтобы переводы пересекались
+                    from_id, to_id = rng.sample(range(min(args.users, 50)), 2)
+                    amount = rng.randint(100, 600)
+                    fee = amount // 10
+                    if await transfer(from_id, to_id, amount, fee):
+                        stats['ok'] += 1
+                        stats['fees'] += fee
+                    else:
+                        stats['rejected'] += 1
+
+            started = time.perf_counter()
+            await asyncio.gather(*(client() for _ in range(args.clients)))
+            elapsed = time.perf_counter() - started
+
+            total, negative = await db.fetchone('SELECT SUM(balance), SUM(balance < 0) FROM users')
+            journal = (await db.fetchone('SELECT COALESCE(SUM(amount), 0) FROM transactions'))[0]
+            expected = initial * args.users - stats['fees']
+            conserved = total == expected and journal == total - initial * args.users
+            print(
+                f"{mode:17} {elapsed:.2f}с: {(stats['ok'] + stats['rejected']) / elapsed:,.0f} переводов/с, "
+                f"прошло {stats['ok']}, отказов {stats['rejected']}, "
+                f"отрицательных балансов {negative}, сумма {'сходится' if conserved else 'НЕ сходится'}"
+            )
+
+            await db.close()
+
+
+def bench_ledger(args):
+    """Параллельные переводы: проверка чтением против условного списания"""
+    print(f"Клиентов: {args.clients}, переводов: {args.actions}")
+    asyncio.run(run_ledger(args))
+
+
+async def run_time_range(args):
+    with tempfile.TemporaryDirectory(dir=args.dir) as tmp:
+        db = await create_bench_db(os.path.join(tmp, 'time.db'), args.users)
+        rng = random.Random(42)
+        now = datetime.now()
+        types = [TX_CODES[name] for name in ('daily', 'purchase', 'transfer_out', 'transfer_in', 'duel')]
+
+        # Полгода истории, равномерно по времени
+        started = time.perf_counter()
+        chunk = 100000
+        for offset in range(0, args.rows, chunk):
+            await db.conn.executemany(
+                'INSERT INTO transactions (user_id, amount, type_code, timestamp) VALUES (?, ?, ?, ?)',
+                [
+                    (rng.randrange(args.users), rng.randint(-500, 500), rng.choice(types),
+                     (now - timedelta(seconds=rng.randrange(180 * 86400))).isoformat())
+                    for _ in range(min(chunk, args.rows - offset))
+                ]
+            )
+        await db.conn.execute(epoch_column_sql('transactions', 'ts', 'timestamp'))
+        await db.conn.execute('CREATE INDEX idx_transactions_ts ON transactions (ts)')
+        await db.conn.commit()
+        print(f"Заполнение и индекс: {time.perf_counter() - started:.1f}с")
+
+        day_ago = to_epoch(now - timedelta(days=1))
+        cutoff = to_epoch(now - timedelta(days=90))
+        cases = [
+            ('операции за сутки',
+             "SELECT type_code, COUNT(*), SUM(amount) FROM transactions WHERE timestamp > datetime('now', '-1 day') GROUP BY type_code", (),
+             'SELECT type_code, COUNT(*), SUM(amount) FROM transactions WHERE ts > ? GROUP BY type_code', (day_ago,)),
+            ('старше 90 дней',
+             "SELECT COUNT(*) FROM transactions WHERE date(timestamp) < date('now', '-90 days')", (),
+             'SELECT COUNT(*) FROM transactions WHERE ts < ?', (cutoff,)),
+        ]
+
+        for label, old_sql, old_params, new_sql, new_params in cases:
+            results = []
+            for sql, params in ((old_sql, old_params), (new_sql, new_params)):
+                started = time.perf_counter()
+                for _ in range(args.repeats):
+                    rows = await db.fetchall(sql, params)
+                # Число строк: COUNT(*) — второй столбец при группировке и единственный без неё
+                matched = sum(row[1] if len(row) > 1 else row[0] for row in rows)
+                results.append(((time.perf_counter() - started) / args.repeats * 1000, matched))
+            (old_ms, old_count), (new_ms, new_count) = results
+            print(
+                f"{label:18} функции: {old_ms:8.1f}мс ({old_count} строк), "
+                f"диапазон: {new_ms:7.1f}мс ({new_count} строк), x{old_ms / new_ms:.0f}"
+            )
+
+        await db.close()
+
+
+def bench_time_range(args):
+    """Фильтры по времени: date()/datetime() по TEXT против диапазона по эпохе"""
+    print(f"Строк в transactions: {args.rows}")
+    asyncio.run(run_time_range(args))
+
+
+async def run_hot_cold(args):
+    rng = random.Random(42)
+    now = datetime.now()
+    users = [
+        (user_id, random_word(rng, 5, 16), (now - timedelta(days=rng.randrange(365))).isoformat(),
+         (now - timedelta(hours=rng.randrange(48))).isoformat(), rng.randrange(30),
+         rng.choice([None, 'red', 'gold', 'blue']), rng.randrange(100000), rng.randrange(50000))
+        for user_id in range(args.users)
+    ]
+    # Пачки как у RewardFlusher: в пачке каждый пользователь один раз
+    batches = []
+    for start in range(0, args.actions, args.batch):
+        size = min(args.batch, args.actions - start)
+        batches.append([
+            (rng.randint(1, 20), rng.randint(1, 5), now.isoformat(), user_id)
+            for user_id in rng.sample(range(args.users), size)
+        ])
+
+    with tempfile.TemporaryDirectory(dir=args.dir) as tmp:
+        for label, table in (('users (широкая)', 'users'), ('users_hot', 'users_hot')):
+            db = Database(os.path.join(tmp, f'{table}.db'))
+            await db.connect()
+            conn = db.conn
+            await base_schema(conn)
+            await conn.execute('CREATE INDEX idx_users_username ON users (username)')
+            await conn.executemany('''
+                INSERT INTO users (user_id, username, created_at, last_daily, daily_streak,
+                                   name_color, balance, xp)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ''', users)
+            if table == 'users_hot':
+                await users_hot_split(conn)
+            await conn.commit()
+
+            # Без автоматического checkpoint весь WAL замера остаётся в файле
+            await conn.execute('PRAGMA wal_autocheckpoint = 0')
+            await conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+            page_size = (await (await conn.execute('PRAGMA page_size')).fetchone())[0]
+
+            started = time.perf_counter()
+            for batch in batches:
+                await conn.executemany(f'''
+                    UPDATE {table}
+                    SET xp = xp + ?, balance = balance + ?,
+                        total_message_count = total_message_count + 1,
+                        weekly_activity = weekly_activity + 1,
+                        last_message = ?
+                    WHERE user_id = ?
+                ''', batch)
+                await conn.commit()
+            elapsed = time.perf_counter() - started
+
+            wal_bytes = os.path.getsize(db.db_path + '-wal')
+            # Заголовок WAL 32 байта, у каждого кадра (страницы) ещё 24 байта
+            frames = (wal_bytes - 32) // (page_size + 24)
+            print(
+                f"{label:16} WAL {wal_bytes / 1024:7.0f} KB, записей страниц {frames:6}, "
+                f"{frames / len(batches):5.1f} на пачку, {elapsed * 1000:5.0f}мс"
+            )
+            await db.close()
+
+
+def bench_hot_cold(args):
+    """Объём WAL на начисления за сообщения: широкая users против users_hot"""
+    print(f"Пользователей: {args.users}, начислений: {args.actions}, пачка: {args.batch}")
+    asyncio.run(run_hot_cold(args))
+
+
+async def run_compact_rows(args):
+    rng = random.Random(42)
+    now = datetime.now()
+    shop_names = [item[0] for item in SHOP_ITEMS]
+    legacy = [
+        ('daily', lambda: f"Ежедневный бонус (день {rng.randint(1, 60)})", 1),
+        ('purchase', lambda: f"Покупка: {rng.choice(shop_names)}", -1),
+        ('transfer_out', lambda: f"Перевод пользователю {rng.randrange(10 ** 9)}", -1),
+        ('transfer_in', lambda: f"Перевод от пользователя {rng.randrange(10 ** 9)}", 1),
+        ('duel', lambda: "Победа в дуэли", 1),
+        ('duel', lambda: "Проигрыш в дуэли", -1),
+    ]
+
+    with tempfile.TemporaryDirectory(dir=args.dir) as tmp:
+        db = Database(os.path.join(tmp, 'compact.db'))
+        await db.connect()
+        conn = db.conn
+        # Схема в том виде, какой её застаёт миграция compact_transactions
+        for version, name, migrate in MIGRATIONS:
+            if migrate is compact_transactions:
+                break
+            await migrate(conn)
+
+        chunk = 100000
+        for offset in range(0, args.rows, chunk):
+            rows = []
+            for _ in range(min(chunk, args.rows - offset)):
+                tx_type, description, sign = rng.choice(legacy)
+                rows.append((
+                    rng.randrange(10 ** 9), sign * rng.randint(10, 2000), tx_type,
+                    (now - timedelta(seconds=rng.randrange(90 * 86400))).isoformat(), description()
+                ))
+            await conn.executemany(
+                'INSERT INTO transactions (user_id, amount, type, timestamp, description) VALUES (?, ?, ?, ?, ?)',
+                rows
+            )
+        await conn.commit()
+
+        async def measure(type_column):
+            size = await table_bytes(conn, 'transactions')
+            started = time.perf_counter()
+            for _ in range(args.repeats):
+                cursor = await conn.execute(
+                    f'SELECT {type_column}, COUNT(*), SUM(amount) FROM transactions GROUP BY {type_column}'
+                )
+                await cursor.fetchall()
+            return size, (time.perf_counter() - started) / args.repeats * 1000
+
+        old_size, old_ms = await measure('type')
+        started = time.perf_counter()
+        await compact_transactions(conn)
+        await conn.commit()
+        migrate_s = time.perf_counter() - started
+        new_size, new_ms = await measure('type_code')
+
+        for label, size, ms in (('текст', old_size, old_ms), ('коды', new_size, new_ms)):
+            print(
+                f"{label:6} {size / 1024 / 1024:7.1f} MB с индексами, {size / args.rows:5.0f} байт на строку, "
+                f"полный проход по типам {ms:6.0f}мс"
+            )
+        print(f"Миграция: {migrate_s:.1f}с, экономия {(1 - new_size / old_size) * 100:.0f}%")
+
+        await db.close()
+
+
+def bench_compact_rows(args):
+    """Размер transactions: текстовые type/description против кодов и структурных полей"""
+    print(f"Строк в transactions: {args.rows}")
+    asyncio.run(run_compact_rows(args))
+
+
+async def run_domains(args):
+    rng = random.Random(42)
+    now = datetime.now()
+    # Те же файлы доменов и таблицы в них, что и у бота
+    domains = {
+        schema: (os.path.basename(path), tables)
+        for schema, (path, tables) in Config().db_domains.items()
+    }
+
+    with tempfile.TemporaryDirectory(dir=args.dir) as tmp:
+        for label, split in (('один файл', False), ('по доменам', True)):
+            db = Database(
+                os.path.join(tmp, f'main_{int(split)}.db'), readers=0,
+                domains={schema: (os.path.join(tmp, f'{int(split)}_{path}'), tables)
+                         for schema, (path, tables) in domains.items()} if split else None
+            )
+            await db.connect()
+            await apply_migrations(db.conn)
+            await db.place_tables()
+            await db.conn.executemany(
+                'INSERT INTO users (user_id, username) VALUES (?, ?)',
+                [(user_id, random_word(rng)) for user_id in range(args.users)]
+            )
+            await db.conn.commit()
+            await db.conn.execute('PRAGMA wal_autocheckpoint = 0')
+            await db.conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+            db.start_writer()
+            ledger = Ledger()
+
+            # Пачки наград с активностью, покупки и журналы модерации
+            async def batch(conn, user_ids, day):
+                await conn.executemany(
+                    'UPDATE users_hot SET xp = xp + 5, balance = balance + 1 WHERE user_id = ?',
+                    [(user_id,) for user_id in user_ids]
+                )
+                await conn.executemany('''
+                    INSERT INTO user_activity (user_id, date, message_count) VALUES (?, ?, 1)
+                    ON CONFLICT(user_id, date) DO UPDATE SET message_count = message_count + 1
+                ''', [(user_id, day) for user_id in user_ids])
+                await ledger.record(conn, [(user_id, 1, 'daily', None, None, '1') for user_id in user_ids[:20]])
+                await conn.execute(
+                    'INSERT INTO moderation_logs (user_id, action, timestamp, message_text) VALUES (?, ?, ?, ?)',
+                    (user_ids[0], 'auto_moderate', now.isoformat(), random_word(rng, 40, 200))
+                )
+
+            started = time.perf_counter()
+            for step in range(args.actions // args.batch):
+                day = (now - timedelta(days=step % 60)).date().isoformat()
+                await db.write(batch, rng.sample(range(args.users), args.batch), day)
+            write_s = time.perf_counter() - started
+
+            # Очистка журналов, как в cleanup_old_data, и checkpoint основного файла
+            started = time.perf_counter()
+            await db.execute_write('DELETE FROM user_activity WHERE date < ?', ((now - timedelta(days=30)).date().isoformat(),))
+            await db.execute_write('DELETE FROM moderation_logs')
+            cleanup_ms = (time.perf_counter() - started) * 1000
+
+            main_wal = os.path.getsize(db.db_path + '-wal')
+
+            async def checkpoint(conn):
+                started = time.perf_counter()
+                await (await conn.execute('PRAGMA main.wal_checkpoint(TRUNCATE)')).fetchall()
+                return (time.perf_counter() - started) * 1000
+
+            checkpoint_ms = await db.run_exclusive(checkpoint)
+            print(
+                f"{label:11} запись {write_s:.2f}с, очистка {cleanup_ms:5.0f}мс, "
+                f"WAL основного файла {main_wal / 1024 / 1024:6.1f} MB, его checkpoint {checkpoint_ms:6.1f}мс"
+            )
+            await db.close()
+
+
+def bench_domains(args):
+    """WAL и checkpoint основного файла: все таблицы вместе против файлов доменов"""
+    print(f"Пользователей: {args.users}, наград: {args.actions}, пачка: {args.batch}")
+    asyncio.run(run_domains(args))
+
+
+async def run_leaderboard(args):
+    rng = random.Random(42)
+    with tempfile.TemporaryDirectory(dir=args.dir) as tmp:
+        db = await create_bench_db(os.path.join(tmp, 'bench.db'), args.users, readers=1)
+        await db.conn.executemany(
+            'UPDATE users_hot SET balance = ? WHERE user_id = ?',
+            [(rng.randrange(1000000), user_id) for user_id in range(args.users)]
+        )
+        await db.conn.commit()
+        lookups = [rng.randrange(args.users) for _ in range(args.actions)]
+
+        # Прежний вариант: ORDER BY ... LIMIT по всей таблице и место через COUNT(*)
+        started = time.perf_counter()
+        for user_id in lookups:
+            await db.fetchall('SELECT user_id, balance FROM users ORDER BY balance DESC LIMIT 10')
+            balance, = await db.fetchone('SELECT balance FROM users WHERE user_id = ?', (user_id,))
+            await db.fetchone('SELECT COUNT(*) FROM users WHERE balance > ?', (balance,))
+        sql_s = time.perf_counter() - started
+
+        started = time.perf_counter()
+        index = SortedIndex.from_scores(dict(await db.fetchall('SELECT user_id, balance FROM users')))
+        build_s = time.perf_counter() - started
+
+        started = time.perf_counter()
+        for user_id in lookups:
+            index.range(0, 10)
+            index.rank(user_id)
+        index_s = time.perf_counter() - started
+
+        started = time.perf_counter()
+        for user_id in lookups:
+            index.set(user_id, rng.randrange(1000000))
+        update_s = time.perf_counter() - started
+        await db.close()
+
+    print(f"SQL (топ-10 + место):    {sql_s / args.actions * 1e6:9.1f} мкс/запрос")
+    print(f"Индекс (топ-10 + место): {index_s / args.actions * 1e6:9.1f} мкс/запрос, ускорение x{sql_s / index_s:.0f}")
+    print(f"Обновление счёта:        {update_s / args.actions * 1e6:9.1f} мкс, построение {build_s:.2f}с")
+
+
+def bench_leaderboard(args):
+    """Топ и место пользователя: ORDER BY/COUNT по таблице против отсортированного индекса"""
+    print(f"Пользователей: {args.users}, запросов: {args.actions}")
+    asyncio.run(run_leaderboard(args))
+
+
+async def legacy_season_end(conn, season_id: int):
+    """Прежнее завершение сезона: UPDATE места и две записи наград на каждого участника"""
+    cursor = await conn.execute(
+        'SELECT user_id FROM user_season_stats WHERE season_id = ? ORDER BY xp_earned DESC', (season_id,)
+    )
+    users = await cursor.fetchall()
+    for rank, (user_id,) in enumerate(users, 1):
+        await conn.execute(
+            'UPDATE user_season_stats SET final_rank = ? WHERE user_id = ? AND season_id = ?',
+            (rank, user_id, season_id)
+        )
+
+    now = datetime.now().isoformat()
+    for rank, (user_id,) in enumerate(users, 1):
+        _, coins, xp, item = next(
+            tier for tier in SEASON_REWARD_TIERS if tier[0] is None or rank <= tier[0]
+        )
+        await conn.execute(
+            'UPDATE users_hot SET balance = balance + ?, xp = xp + ? WHERE user_id = ?', (coins, xp, user_id)
+        )
+        await conn.execute(
+            'UPDATE user_season_stats SET rewards_claimed = 1 WHERE user_id = ? AND season_id = ?',
+            (user_id, season_id)
+        )
+        if item:
+            await conn.execute('''
+                INSERT INTO user_inventory (user_id, item_id, purchased_at, is_active)
+                VALUES (?, (SELECT id FROM seasonal_shop_items WHERE item_type = ?), ?, 1)
+            ''', (user_id, item, now))
+    return [user_id for user_id, in users]
+
+
+async def run_season_end(args):
+    for participants in (int(size) for size in args.sizes.split(',')):
+        for label, set_based in (('по одному', False), ('set-based', True)):
+            rng = random.Random(42)
+            with tempfile.TemporaryDirectory(dir=args.dir) as tmp:
+                db = Database(os.path.join(tmp, 'bench.db'), readers=1)
+                await db.connect()
+                await apply_migrations(db.conn)
+                await db.conn.executemany(
+                    'INSERT INTO users_hot (user_id) VALUES (?)', [(user_id,) for user_id in range(participants)]
+                )
+                await db.conn.execute(
+                    "INSERT INTO seasons (name, type, start_date, end_date, is_active) VALUES ('bench', 'halloween', '', '', 1)"
+                )
+                await db.conn.executemany(
+                    'INSERT INTO user_season_stats (user_id, season_id, xp_earned) VALUES (?, 1, ?)',
+                    [(user_id, rng.randrange(100000)) for user_id in range(participants)]
+                )
+                await db.conn.commit()
+                db.start_writer()
+                seasonal = SeasonalSystem(db)
+
+                async def season_end(conn):
+                    if not set_based:
+                        return await legacy_season_end(conn, 1)
+                    await seasonal.calculate_final_ranks(conn, 1)
+                    return await seasonal.distribute_season_rewards(conn, 1)
+
+                # Задержки цикла событий, пока идёт завершение сезона
+                lags = [0.0]
+
+                async def ticker():
+                    while True:
+                        started = time.perf_counter()
+                        await asyncio.sleep(0.01)
+                        lags.append(time.perf_counter() - started - 0.01)
+
+                ticker_task = asyncio.create_task(ticker())
+                started = time.perf_counter()
+                rewarded = await db.write(season_end)
+                elapsed = time.perf_counter() - started
+                ticker_task.cancel()
+                await db.close()
+
+            print(
+                f"{participants:>9,} {label:10} {elapsed:8.2f}с, награждено {len(rewarded):,}, "
+                f"макс. задержка цикла {max(lags) * 1000:.0f}мс"
+            )
+
+
+def bench_season_end(args):
+    """Завершение сезона: места и награды по одному участнику против RANK() OVER и set-based UPDATE"""
+    asyncio.run(run_season_end(args))
+
+
+
+# Запросы прежних команд статистики: полные проходы по users и transactions
+LEGACY_STATS_QUERIES = (
+    ('SELECT COUNT(*) FROM users', ()),
+    ('SELECT SUM(balance) FROM users', ()),
+    ('SELECT AVG(balance) FROM users', ()),
+    ('SELECT COUNT(*) FROM users WHERE balance > 1000', ()),
+    ('SELECT COUNT(*) FROM clans', ()),
+    ("SELECT COUNT(*) FROM duels WHERE status = 'finished'", ()),
+    ('SELECT COUNT(*) FROM users WHERE last_message > ?', 1),
+    ('SELECT COUNT(*) FROM users WHERE last_message > ?', 7),
+    ('SELECT type_code, COUNT(*), SUM(amount) FROM transactions WHERE ts > ? GROUP BY type_code', 'ts'),
+)
+
+
+async def run_economy_stats(args):
+    for users in (int(size) for size in args.sizes.split(',')):
+        rng = random.Random(42)
+        now = datetime.now()
+        with tempfile.TemporaryDirectory(dir=args.dir) as tmp:
+            db = Database(os.path.join(tmp, 'bench.db'), readers=1)
+            await db.connect()
+            await apply_migrations(db.conn)
+            await db.conn.executemany(
+                'INSERT INTO users_hot (user_id, balance, last_message) VALUES (?, ?, ?)',
+                [
+                    (user_id, rng.randrange(5000), (now - timedelta(hours=rng.randrange(24 * 60))).isoformat())
+                    for user_id in range(users)
+                ]
+            )
+            await db.conn.executemany(
+                'INSERT INTO transactions (user_id, amount, type_code, timestamp) VALUES (?, ?, ?, ?)',
+                [
+                    (rng.randrange(users), rng.randrange(1, 500), rng.choice(list(TX_CODES.values())),
+                     (now - timedelta(minutes=rng.randrange(60 * 24 * 30))).isoformat())
+                    for _ in range(users * 2)
+                ]
+            )
+            await db.conn.commit()
+
+            started = time.perf_counter()
+            for _ in range(args.repeats):
+                for sql, param in LEGACY_STATS_QUERIES:
+                    if param == 'ts':
+                        params = (to_epoch(now - timedelta(days=1)),)
+                    elif param:
+                        params = ((now - timedelta(days=param)).isoformat(),)
+                    else:
+                        params = ()
+                    await db.fetchall(sql, params)
+            legacy_s = (time.perf_counter() - started) / args.repeats
+
+            stats = EconomyStats(db)
+            started = time.perf_counter()
+            for _ in range(args.repeats):
+                await stats.totals()
+                await stats.active_users(1)
+                await stats.active_users(7)
+                await stats.transactions_by_type()
+            aggregates_s = (time.perf_counter() - started) / args.repeats
+
+            # Цена триггеров: пачки начислений как у RewardFlusher
+            batches = [
+                [(rng.randrange(1, 50), rng.randrange(users)) for _ in range(args.batch)]
+                for _ in range(200)
+            ]
+
+            async def flush_batches():
+                started = time.perf_counter()
+                for batch in batches:
+                    await db.conn.executemany('UPDATE users_hot SET balance = balance + ? WHERE user_id = ?', batch)
+                    await db.conn.commit()
+                return time.perf_counter() - started
+
+            with_triggers_s = await flush_batches()
+            mismatches = await stats.verify()
+            cursor = await db.conn.execute("SELECT name FROM sqlite_master WHERE type = 'trigger' AND tbl_name = 'users_hot'")
+            for trigger, in await cursor.fetchall():
+                await db.conn.execute(f'DROP TRIGGER {trigger}')
+            await db.conn.commit()
+            without_triggers_s = await flush_batches()
+            await db.close()
+
+        print(
+            f"{users:>9,} пользователей: прежние запросы {legacy_s * 1000:8.1f}мс, "
+            f"счётчики {aggregates_s * 1000:6.2f}мс, сверка {'сходится' if not mismatches else 'расходится'}"
+        )
+        print(
+            f"{'':>9}  пачка из {args.batch}: с триггерами {with_triggers_s / len(batches) * 1000:.2f}мс, "
+            f"без {without_triggers_s / len(batches) * 1000:.2f}мс"
+        )
+
+
+def bench_economy_stats(args):
+    """Команды статистики: COUNT/SUM по таблицам против счётчиков, которые ведут триггеры"""
+    asyncio.run(run_economy_stats(args))
+
+
+def render_with_pyplot(chart: LineChart) -> bytes:
+    """Прежнее построение: глобальное состояние pyplot в цикле событий"""
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    plt.figure(figsize=chart.size)
+    plt.plot(list(chart.labels), list(chart.values), marker='o', linewidth=2, markersize=chart.marker_size)
+    plt.title(chart.title)
+    plt.grid(True, alpha=0.3)
+    buf = io.BytesIO()
+    plt.savefig(buf, format='png', dpi=chart.dpi, bbox_inches='tight')
+    plt.close()
+    return buf.getvalue()
+
+
+async def run_charts(args):
+    rng = random.Random(42)
+    charts = [
+        LineChart(
+            labels=tuple(f'{day:02d}' for day in range(1, 31)),
+            values=tuple(rng.randrange(1000) for _ in range(30)),
+            title='Активность за 30 дней', size=(12, 4), dpi=100, label_rotation=45
+        )
+        for _ in range(args.repeats * 4)
+    ]
+    # Половина запросов повторяет уже построенные графики
+    requests = charts + charts
+
+    async def measure(render):
+        lags = [0.0]
+
+        async def ticker():
+            while True:
+                started = time.perf_counter()
+                await asyncio.sleep(0.005)
+                lags.append(time.perf_counter() - started - 0.005)
+
+        ticker_task = asyncio.create_task(ticker())
+        started = time.perf_counter()
+        await asyncio.gather(*(render(chart) for chart in requests))
+        elapsed = time.perf_counter() - started
+        # Тикер должен успеть записать последнюю задержку
+        await asyncio.sleep(0.01)
+        ticker_task.cancel()
+        return elapsed, max(lags)
+
+    async def inline(chart):
+        await asyncio.sleep(0)
+        return render_with_pyplot(chart)
+
+    render_with_pyplot(charts[0])
+    inline_s, inline_lag = await measure(inline)
+
+    renderer = ChartRenderer(args.readers)
+    try:
+        await renderer.render(charts[0]._replace(title='прогрев'))
+        pool_s, pool_lag = await measure(renderer.render)
+        # Повторные запросы тех же графиков: только кэш PNG
+        started = time.perf_counter()
+        for chart in charts:
+            await renderer.render(chart)
+        cached_s = (time.perf_counter() - started) / len(charts)
+    finally:
+        renderer.shutdown()
+
+    print(f"Графиков: {len(requests)} ({len(charts)} разных)")
+    print(f"pyplot в цикле событий: {inline_s:.2f}с, макс. задержка цикла {inline_lag * 1000:.0f}мс")
+    print(
+        f"Пул из {args.readers} процессов: {pool_s:.2f}с, макс. задержка цикла {pool_lag * 1000:.0f}мс, "
+        f"построено {renderer.stats['renders'] - 1}"
+    )
+    print(f"Повтор из кэша PNG: {cached_s * 1e6:.0f} мкс/график")
+
+def bench_charts(args):
+    """Графики: pyplot в цикле событий против пула процессов с кэшем PNG (--readers процессов)"""
+    asyncio.run(run_charts(args))
+
+
+def legacy_captcha_image(text: str) -> bytes:
+    """Прежняя капча: шрифт на каждый вызов и шум по одной точке"""
+    width, height = CAPTCHA_SIZE
+    image = Image.new('RGB', (width, height), color=(255, 255, 255))
+    draw = ImageDraw.Draw(image)
+    try:
+        font = ImageFont.truetype('arial.ttf', 36)
+    except OSError:
+        font = ImageFont.load_default()
+    for _ in range(NOISE_POINTS):
+        x, y = random.randint(0, width), random.randint(0, height)
+        draw.point((x, y), fill=(random.randint(0, 255), random.randint(0, 255), random.randint(0, 255)))
+    bbox = draw.textbbox((0, 0), text, font=font)
+    draw.text(((width - (bbox[2] - bbox[0])) // 2, (height - (bbox[3] - bbox[1])) // 2), text, font=font, fill=(0, 0, 0))
+    buf = io.BytesIO()
+    image.save(buf, format='PNG')
+    return buf.getvalue()
+
+
+async def run_captcha(args):
+    joins = args.clients
+
+    async def measure(take):
+        lags = [0.0]
+
+        async def ticker():
+            while True:
+                started = time.perf_counter()
+                await asyncio.sleep(0.005)
+                lags.append(time.perf_counter() - started - 0.005)
+
+        ticker_task = asyncio.create_task(ticker())
+        started = time.perf_counter()
+        await asyncio.gather(*(take() for _ in range(joins)))
+        elapsed = time.perf_counter() - started
+        await asyncio.sleep(0.01)
+        ticker_task.cancel()
+        return elapsed, max(lags)
+
+    async def inline():
+        await asyncio.sleep(0)
+        return legacy_captcha_image(random_word(random.Random(), 6, 6))
+
+    inline_s, inline_lag = await measure(inline)
+
+    pool = CaptchaPool(size=args.batch, workers=args.readers)
+    pool.start()
+    try:
+        while pool.get_stats()['ready'] < pool.size:
+            await asyncio.sleep(0.05)
+        pool_s, pool_lag = await measure(pool.take)
+        stats = pool.get_stats()
+    finally:
+        await pool.stop()
+
+    print(f"Входов: {joins}, запас {args.batch}, процессов {args.readers}")
+    print(f"Построение в цикле событий: {inline_s * 1000:.0f}мс, макс. задержка цикла {inline_lag * 1000:.0f}мс")
+    print(
+        f"Запас капч: {pool_s * 1000:.0f}мс, макс. задержка цикла {pool_lag * 1000:.0f}мс, "
+        f"из запаса {stats['hit_rate'] * 100:.0f}%"
+    )
+
+
+def bench_captcha(args):
+    """Волна входов: капча в цикле событий против запаса, пополняемого в пуле процессов"""
+    asyncio.run(run_captcha(args))
+
+BENCHMARKS = {
+    'word_filter': bench_word_filter,
+    'group_commit': bench_group_commit,
+    'read_pool': bench_read_pool,
+    'ledger': bench_ledger,
+    'time_range': bench_time_range,
+    'hot_cold': bench_hot_cold,
+    'compact_rows': bench_compact_rows,
+    'domains': bench_domains,
+    'leaderboard': bench_leaderboard,
+    'season_end': bench_season_end,
+    'economy_stats': bench_economy_stats,
+    'charts': bench_charts,
+    'captcha': bench_captcha,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('benchmark', choices=sorted(BENCHMARKS))
+    parser.add_argument('--words', type=int, default=5000, help='размер словаря фильтра')
+    parser.add_argument('--messages', type=int, default=20000, help='число сообщений')
+    parser.add_argument('--users', type=int, default=10000, help='число пользователей в базе')
+    parser.add_argument('--clients', type=int, default=50, help='число одновременных клиентов')
+    parser.add_argument('--actions', type=int, default=5000, help='число операций записи')
+    parser.add_argument('--readers', type=int, default=4, help='размер пула читателей')
+    parser.add_argument('--reports', type=int, default=5, help='отчётов на каждого из 2 клиентов отчётов')
+    parser.add_argument('--rows', type=int, default=2000000, help='строк в transactions')
+    parser.add_argument('--batch', type=int, default=100, help='пользователей в пачке начислений')
+    parser.add_argument('--sizes', default='10000,100000,1000000', help='числа участников сезона через запятую')
+    parser.add_argument('--repeats', type=int, default=3, help='повторов каждого запроса')
+    parser.add_argument('--dir', default='.', help='каталог для временных баз (диск, как у бота)')
+    args = parser.parse_args()
+    BENCHMARKS[args.benchmark](args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,173 @@
+"""Запас готовых капч, который пополняется в фоне в пуле процессов."""
+import asyncio
+import io
+import logging
+import multiprocessing
+import random
+import string
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Deque, List, Optional, Tuple
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+
+CAPTCHA_CHARACTERS = string.ascii_letters + string.digits
+CAPTCHA_SIZE = (200, 80)
+NOISE_POINTS = 100
+
+# Шрифт загружается один раз на процесс пула (init_worker)
+_font = None
+
+
+def init_worker(font_path: str, font_size: int = 36):
+    global _font
+    try:
+        _font = ImageFont.truetype(font_path, font_size)
+    except OSError:
+        _font = ImageFont.load_default()
+
+
+def render_captcha(text: str, rng: np.random.Generator) -> bytes:
+    """PNG капчи: белый фон, цветной шум и текст по центру"""
+    width, height = CAPTCHA_SIZE
+    pixels = np.full((height, width, 3), 255, dtype=np.uint8)
+    # Шум одним присваиванием по массиву координат вместо draw.point на точку
+    ys = rng.integers(0, height, NOISE_POINTS)
+    xs = rng.integers(0, width, NOISE_POINTS)
+    pixels[ys, xs] = rng.integers(0, 256, (NOISE_POINTS, 3), dtype=np.uint8)
+
+    image = Image.fromarray(pixels, 'RGB')
+    draw = ImageDraw.Draw(image)
+    font = _font or ImageFont.load_default()
+    bbox = draw.textbbox((0, 0), text, font=font)
+    x = (width - (bbox[2] - bbox[0])) // 2
+    y = (height - (bbox[3] - bbox[1])) // 2
+    draw.text((x, y), text, font=font, fill=(0, 0, 0))
+
+    buf = io.BytesIO()
+    image.save(buf, format='PNG')
+    return buf.getvalue()
+
+
+def generate_batch(count: int, length: int = 6) -> List[Tuple[str, bytes]]:
+    """count пар (текст, PNG); выполняется в процессе пула"""
+    rng = np.random.default_rng()
+    chooser = random.SystemRandom()
+    batch = []
+    for _ in range(count):
+        text = ''.join(chooser.choice(CAPTCHA_CHARACTERS) for _ in range(length))
+        batch.append((text, render_captcha(text, rng)))
+    return batch
+
+
+class CaptchaPool:
+    """Готовые капчи для верификации новых участников.
+
+    Фоновая задача держит в очереди до size пар (текст, PNG) и
+    дозаполняет её пачками в отдельном процессе, когда запас падает
+    ниже половины. take() только забирает готовую пару; если запас
+    кончился (волна входов), капча строится в том же пуле, цикл
+    событий в обоих случаях не занят рисованием.
+    """
+
+    def __init__(self, size: int = 200, batch: int = 50, workers: int = 1,
+                 font_path: str = 'arial.ttf', length: int = 6, retry_interval: float = 5):
+        self.size = size
+        self.batch = batch
+        self.workers = workers
+        self.font_path = font_path
+        self.length = length
+        self.retry_interval = retry_interval
+        self._ready: Deque[Tuple[str, bytes]] = deque()
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._refill_task: Optional[asyncio.Task] = None
+        self._low = asyncio.Event()
+
+        self.stats = {
+            'hits': 0,
+            'misses': 0,
+            'generated': 0,
+            'errors': 0,
+            'last_refill_ms': 0.0
+        }
+
+    def _ensure_pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            # spawn: форк процесса с потоками aiosqlite и планировщика небезопасен
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=init_worker,
+                initargs=(self.font_path,)
+            )
+        return self._pool
+
+    def start(self):
+        self._ensure_pool()
+        if self._refill_task is None:
+            self._low.set()
+            self._refill_task = asyncio.create_task(self._refill_loop())
+
+    async def stop(self):
+        if self._refill_task is not None:
+            self._refill_task.cancel()
+            try:
+                await self._refill_task
+            except asyncio.CancelledError:
+                pass
+            self._refill_task = None
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    async def _generate(self, count: int) -> List[Tuple[str, bytes]]:
+        loop = asyncio.get_running_loop()
+        try:
+            batch = await loop.run_in_executor(self._ensure_pool(), generate_batch, count, self.length)
+        except BrokenProcessPool:
+            # Процесс пула завершился: следующий вызов создаст пул заново
+            self._pool = None
+            raise
+        self.stats['generated'] += len(batch)
+        return batch
+
+    async def _refill_loop(self):
+        while True:
+            await self._low.wait()
+            self._low.clear()
+            while len(self._ready) < self.size:
+                started = time.perf_counter()
+                try:
+                    batch = await self._generate(min(self.batch, self.size - len(self._ready)))
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    self.stats['errors'] += 1
+                    logging.error(f"Ошибка пополнения запаса капч: {e}")
+                    await asyncio.sleep(self.retry_interval)
+                    continue
+                self._ready.extend(batch)
+                self.stats['last_refill_ms'] = (time.perf_counter() - started) * 1000
+
+    async def take(self) -> Tuple[str, bytes]:
+        """Готовая пара (текст, PNG)"""
+        if len(self._ready) <= self.size // 2:
+            self._low.set()
+        if self._ready:
+            self.stats['hits'] += 1
+            return self._ready.popleft()
+
+        self.stats['misses'] += 1
+        return (await self._generate(1))[0]
+
+    def get_stats(self):
+        taken = self.stats['hits'] + self.stats['misses']
+        return {
+            'ready': len(self._ready),
+            'size': self.size,
+            'hit_rate': self.stats['hits'] / taken if taken else 0,
+            **self.stats
+        }
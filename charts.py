@@ -0,0 +1,189 @@
+"""Построение графиков в пуле процессов с кэшем PNG и file_id Telegram."""
+import asyncio
+import hashlib
+import io
+import json
+import logging
+import multiprocessing
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, NamedTuple, Optional, Tuple
+
+from telegram.error import BadRequest
+
+
+class LineChart(NamedTuple):
+    """Линейный график: подписи оси X и значения точек.
+
+    Все поля входят в ключ кэша, поэтому график с теми же данными
+    строится один раз.
+    """
+    labels: Tuple[str, ...]
+    values: Tuple[float, ...]
+    title: str
+    xlabel: str = ''
+    ylabel: str = ''
+    size: Tuple[float, float] = (10, 4)
+    dpi: int = 80
+    marker_size: float = 6
+    label_rotation: int = 0
+
+
+def init_worker():
+    """Инициализация процесса пула: Agg и загрузка matplotlib до первого графика"""
+    import matplotlib
+    matplotlib.use('Agg')
+    from matplotlib.figure import Figure
+    Figure()
+
+
+def render_line_chart(chart: LineChart) -> bytes:
+    """PNG графика; выполняется в процессе пула.
+
+    Figure создаётся напрямую, без pyplot: у фигуры нет общего
+    состояния с другими графиками, закрывать её не нужно.
+    """
+    from matplotlib.figure import Figure
+
+    figure = Figure(figsize=chart.size)
+    axes = figure.subplots()
+    axes.plot(list(chart.labels), list(chart.values), marker='o', linewidth=2, markersize=chart.marker_size)
+    axes.set_title(chart.title)
+    if chart.xlabel:
+        axes.set_xlabel(chart.xlabel)
+    if chart.ylabel:
+        axes.set_ylabel(chart.ylabel)
+    if chart.label_rotation:
+        axes.tick_params(axis='x', labelrotation=chart.label_rotation)
+    axes.grid(True, alpha=0.3)
+
+    buf = io.BytesIO()
+    figure.savefig(buf, format='png', dpi=chart.dpi, bbox_inches='tight')
+    return buf.getvalue()
+
+
+def chart_key(chart: LineChart) -> str:
+    """Хэш входных данных графика"""
+    payload = json.dumps([type(chart).__name__, *chart], ensure_ascii=False)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class ChartRenderer:
+    """Графики вне цикла событий.
+
+    matplotlib работает в отдельных процессах (spawn: форк процесса
+    с потоками aiosqlite и планировщика небезопасен), цикл событий
+    только ждёт готовый PNG. Готовые PNG хранятся в LRU по хэшу
+    входных данных, одинаковые одновременные запросы ждут одно
+    построение. После отправки запоминается file_id фото, и тот же
+    график уходит в Telegram повторно без загрузки.
+    """
+
+    def __init__(self, workers: int = 1, cache_size: int = 64, file_id_cache_size: int = 1024):
+        self.workers = workers
+        self.cache_size = cache_size
+        self.file_id_cache_size = file_id_cache_size
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._png: "OrderedDict[str, bytes]" = OrderedDict()
+        self._file_ids: "OrderedDict[str, str]" = OrderedDict()
+        self._pending: Dict[str, asyncio.Task] = {}
+
+        self.stats = {
+            'renders': 0,
+            'png_hits': 0,
+            'file_id_hits': 0,
+            'errors': 0,
+            'last_render_ms': 0.0,
+            'max_render_ms': 0.0
+        }
+
+    def start(self):
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=init_worker
+            )
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    @staticmethod
+    def _remember(cache: OrderedDict, key: str, value, limit: int):
+        cache[key] = value
+        cache.move_to_end(key)
+        while len(cache) > limit:
+            cache.popitem(last=False)
+
+    async def _render_in_pool(self, chart: LineChart) -> bytes:
+        loop = asyncio.get_running_loop()
+        for attempt in range(2):
+            self.start()
+            started = time.perf_counter()
+            try:
+                png = await loop.run_in_executor(self._pool, render_line_chart, chart)
+            except BrokenProcessPool:
+                # Процесс пула завершился (например, по памяти): пул создаётся заново
+                self.stats['errors'] += 1
+                logging.error("Процесс построения графиков завершился, пул пересоздан")
+                self._pool = None
+                if attempt:
+                    raise
+                continue
+
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            self.stats['renders'] += 1
+            self.stats['last_render_ms'] = elapsed_ms
+            self.stats['max_render_ms'] = max(self.stats['max_render_ms'], elapsed_ms)
+            return png
+
+    async def render(self, chart: LineChart) -> bytes:
+        """PNG графика из кэша или пула процессов"""
+        key = chart_key(chart)
+        png = self._png.get(key)
+        if png is not None:
+            self._png.move_to_end(key)
+            self.stats['png_hits'] += 1
+            return png
+
+        task = self._pending.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._render_in_pool(chart))
+            self._pending[key] = task
+            task.add_done_callback(lambda _: self._pending.pop(key, None))
+        # shield: отмена одного ожидающего не отменяет построение для остальных
+        png = await asyncio.shield(task)
+        self._remember(self._png, key, png, self.cache_size)
+        return png
+
+    async def reply_chart(self, message, chart: LineChart, **kwargs):
+        """Ответ на сообщение графиком; kwargs передаются в reply_photo"""
+        key = chart_key(chart)
+        file_id = self._file_ids.get(key)
+        if file_id is not None:
+            try:
+                sent = await message.reply_photo(photo=file_id, **kwargs)
+                self._file_ids.move_to_end(key)
+                self.stats['file_id_hits'] += 1
+                return sent
+            except BadRequest as e:
+                logging.warning(f"file_id графика не принят ({e}), загружаем PNG")
+                self._file_ids.pop(key, None)
+
+        png = await self.render(chart)
+        sent = await message.reply_photo(photo=png, **kwargs)
+        if sent and sent.photo:
+            self._remember(self._file_ids, key, sent.photo[-1].file_id, self.file_id_cache_size)
+        return sent
+
+    def get_stats(self):
+        return {
+            'workers': self.workers,
+            'png_cached': len(self._png),
+            'file_ids_cached': len(self._file_ids),
+            **self.stats
+        }
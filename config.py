@@ -9,5 +9,52 @@ class Config:
         self.redis_db = int(os.getenv('REDIS_DB', 0))
         self.redis_password = os.getenv('REDIS_PASSWORD', None)
         self.port = int(os.getenv('PORT', 8080))
+        self.flush_interval = float(os.getenv('FLUSH_INTERVAL', 0.5))
+        self.flush_max_batch = int(os.getenv('FLUSH_MAX_BATCH', 1000))
+        self.flush_max_attempts = int(os.getenv('FLUSH_MAX_ATTEMPTS', 5))
+        self.user_cache_size = int(os.getenv('USER_CACHE_SIZE', 10000))
+        self.user_cache_ttl = float(os.getenv('USER_CACHE_TTL', 300))
+        self.write_group_window = float(os.getenv('WRITE_GROUP_WINDOW', 0.002))
+        self.write_max_group = int(os.getenv('WRITE_MAX_GROUP', 256))
+        self.db_readers = int(os.getenv('DB_READERS', 4))
+        # Профиль PRAGMA для всех соединений с базой
+        self.db_pragmas = {
+            'synchronous': os.getenv('DB_SYNCHRONOUS', 'NORMAL'),
+            'cache_size': int(os.getenv('DB_CACHE_SIZE', -32000)),
+            'mmap_size': int(os.getenv('DB_MMAP_SIZE', 268435456)),
+            'temp_store': os.getenv('DB_TEMP_STORE', 'MEMORY'),
+            'busy_timeout': int(os.getenv('DB_BUSY_TIMEOUT', 5000)),
+            'journal_size_limit': int(os.getenv('DB_JOURNAL_SIZE_LIMIT', 67108864))
+        }
+        self.checkpoint_hour = int(os.getenv('CHECKPOINT_HOUR', 5))
+        # Таблицы, в которые в основном дописывают, в отдельных файлах
+        # (схема ATTACH -> путь, таблицы); пустой путь оставляет их в основном
+        domains = {
+            'activity': (os.getenv('DB_ACTIVITY_PATH', 'bot_activity.db'), ['user_activity']),
+            'ledger': (os.getenv('DB_LEDGER_PATH', 'bot_ledger.db'), ['transactions', 'transaction_daily_stats']),
+            'logs': (os.getenv('DB_LOGS_PATH', 'bot_logs.db'), ['moderation_logs', 'admin_logs'])
+        }
+        self.db_domains = {schema: domain for schema, domain in domains.items() if domain[0]}
+        # Часы checkpoint по файлам (поле hour для CronTrigger): активность
+        # пишется с каждой пачкой наград, её WAL сбрасывается каждый час
+        self.db_checkpoint_hours = {
+            'main': str(self.checkpoint_hour),
+            'activity': os.getenv('DB_ACTIVITY_CHECKPOINT_HOURS', '*'),
+            'ledger': os.getenv('DB_LEDGER_CHECKPOINT_HOURS', '4'),
+            'logs': os.getenv('DB_LOGS_CHECKPOINT_HOURS', '6')
+        }
+        self.activity_retention_days = int(os.getenv('ACTIVITY_RETENTION_DAYS', 30))
+        self.logs_retention_days = int(os.getenv('LOGS_RETENTION_DAYS', 180))
+        self.vacuum_step_pages = int(os.getenv('VACUUM_STEP_PAGES', 500))
+        self.archive_dir = os.getenv('ARCHIVE_DIR', 'archive')
+        self.transactions_retention_days = int(os.getenv('TRANSACTIONS_RETENTION_DAYS', 90))
+        self.archive_chunk_size = int(os.getenv('ARCHIVE_CHUNK_SIZE', 5000))
+        # Графики строятся в отдельных процессах; PNG и file_id кэшируются
+        self.chart_workers = int(os.getenv('CHART_WORKERS', 1))
+        self.chart_cache_size = int(os.getenv('CHART_CACHE_SIZE', 64))
+        # Запас готовых капч для верификации новых участников
+        self.captcha_pool_size = int(os.getenv('CAPTCHA_POOL_SIZE', 200))
+        self.captcha_workers = int(os.getenv('CAPTCHA_WORKERS', 1))
+        self.captcha_font = os.getenv('CAPTCHA_FONT', 'arial.ttf')
 
 config = Config()
@@ -1,208 +1,443 @@
+import asyncio
 import aiosqlite
+import calendar
 import logging
+import re
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Sequence, Tuple
+
+# Единица записи: корутина, выполняющая запросы на переданном соединении
+# без commit. Её результат возвращается вызывающему Database.write.
+WriteUnit = Callable[..., Awaitable[Any]]
+
+# PRAGMA, действующие на соединение целиком; остальные задаются каждому файлу
+CONNECTION_PRAGMAS = {'temp_store', 'busy_timeout', 'foreign_keys', 'query_only'}
+
+
+def to_epoch(moment: datetime) -> int:
+    """Эпоха в секундах, как её считает strftime('%s', ...) в SQLite.
+
+    Время в базе хранится без часового пояса, поэтому и здесь оно
+    переводится как есть, без поправки на локальный пояс.
+    """
+    return calendar.timegm(moment.timetuple())
+
 
 class Database:
-    def __init__(self, db_path: str = 'bot_database.db'):
+    """Пул соединений SQLite: один писатель и несколько читателей.
+
+    conn — единственное соединение для записи (через write);
+    чтения через fetchone/fetchall/read идут в наименее занятое
+    соединение только для чтения и не стоят в очереди за записью.
+
+    domains — таблицы, вынесенные в отдельные файлы: схема ATTACH ->
+    (путь, таблицы). Все соединения подключают эти файлы, поэтому
+    запросы обращаются к таблицам без имени схемы, а JOIN между
+    файлами работает как раньше. У каждого файла свой WAL, свой
+    checkpoint и своя очистка. В режиме WAL транзакция, затронувшая
+    несколько файлов, атомарна только внутри каждого файла: при сбое
+    посреди фиксации один файл может оказаться зафиксированным без
+    другого.
+    """
+
+    def __init__(self, db_path: str = 'bot_database.db',
+                 group_window: float = 0.002, max_group: int = 256,
+                 readers: int = 4, pragmas: Optional[Dict[str, Any]] = None,
+                 domains: Optional[Dict[str, Tuple[str, Sequence[str]]]] = None):
         self.db_path = db_path
         self.conn = None
+        # Профиль PRAGMA, применяемый к каждому соединению
+        self.pragmas = pragmas or {}
+        self.domains = domains or {}
+        
+        self.read_pool_size = readers
+        self.readers: List[aiosqlite.Connection] = []
+        self._reader_load: List[int] = []
+        self.read_stats = {
+            'queries': 0,
+            'max_in_flight': 0
+        }
+        
+        # Групповая фиксация: всё, что пришло за group_window секунд,
+        # пишется одной транзакцией с одним fsync
+        self.group_window = group_window
+        self.max_group = max_group
+        self._write_queue: Optional[asyncio.Queue] = None
+        self._writer_task: Optional[asyncio.Task] = None
+        # Писатель и обслуживание (checkpoint, vacuum) не делят соединение одновременно
+        self._conn_lock = asyncio.Lock()
+        
+        self.write_stats = {
+            'commits': 0,
+            'units': 0,
+            'failed_units': 0,
+            'last_group': 0,
+            'max_group': 0,
+            'last_commit_ms': 0.0
+        }
+
+    @property
+    def schemas(self) -> List[str]:
+        return ['main', *self.domains]
+
+    def file_path(self, schema: str) -> str:
+        return self.db_path if schema == 'main' else self.domains[schema][0]
 
     async def connect(self):
         self.conn = await aiosqlite.connect(self.db_path)
         await self.conn.execute('PRAGMA journal_mode=WAL')
+        for schema, (path, _) in self.domains.items():
+            await self.conn.execute(f'ATTACH DATABASE ? AS {schema}', (path,))
+            await self.conn.execute(f'PRAGMA {schema}.journal_mode=WAL')
+        await self.apply_pragmas(self.conn)
+        
+        # Читатели открываются после писателя: файлы и WAL уже созданы
+        for _ in range(self.read_pool_size):
+            reader = await aiosqlite.connect(self._read_only_uri(self.db_path), uri=True)
+            for schema, (path, _) in self.domains.items():
+                await reader.execute(f'ATTACH DATABASE ? AS {schema}', (self._read_only_uri(path),))
+            await self.apply_pragmas(reader)
+            await reader.execute('PRAGMA query_only = 1')
+            self.readers.append(reader)
+            self._reader_load.append(0)
+        
         return self.conn
 
     async def close(self):
+        await self.stop_writer()
+        for reader in self.readers:
+            await reader.close()
+        self.readers = []
+        self._reader_load = []
         if self.conn:
             await self.conn.close()
 
-    async def init_tables(self, conn):
-        # Здесь мы инициализируем все таблицы, которые были в оригинальном коде
-        # Мы вынесли сюда только общие таблицы, а таблицы для сезонов и админки инициализируются в своих системах
-        # Основные таблицы
-        await conn.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                user_id INTEGER PRIMARY KEY,
-                username TEXT,
-                balance INTEGER DEFAULT 0,
-                xp INTEGER DEFAULT 0,
-                level INTEGER DEFAULT 1,
-                last_daily TEXT,
-                daily_streak INTEGER DEFAULT 0,
-                last_message TEXT,
-                warns INTEGER DEFAULT 0,
-                is_banned INTEGER DEFAULT 0,
-                clan_id INTEGER,
-                created_at TEXT,
-                name_color TEXT,
-                total_message_count INTEGER DEFAULT 0,
-                weekly_activity INTEGER DEFAULT 0
-            )
-        ''')
-        
-        await conn.execute('''
-            CREATE TABLE IF NOT EXISTS transactions (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER,
-                amount INTEGER,
-                type TEXT,
-                timestamp TEXT,
-                description TEXT
-            )
-        ''')
-        
-        await conn.execute('''
-            CREATE TABLE IF NOT EXISTS achievements (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER,
-                achievement_name TEXT,
-                unlocked_at TEXT
-            )
-        ''')
-        
-        await conn.execute('''
-            CREATE TABLE IF NOT EXISTS shop_items (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name TEXT,
-                description TEXT,
-                price INTEGER,
-                item_type TEXT,
-                duration_days INTEGER
-            )
-        ''')
-        
-        await conn.execute('''
-            CREATE TABLE IF NOT EXISTS user_inventory (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER,
-                item_id INTEGER,
-                purchased_at TEXT,
-                expires_at TEXT,
-                is_active INTEGER DEFAULT 1
-            )
-        ''')
-        
-        await conn.execute('''
-            CREATE TABLE IF NOT EXISTS clans (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name TEXT UNIQUE,
-                description TEXT,
-                owner_id INTEGER,
-                created_at TEXT,
-                balance INTEGER DEFAULT 0
-            )
-        ''')
-        
-        await conn.execute('''
-            CREATE TABLE IF NOT EXISTS clan_members (
-                clan_id INTEGER,
-                user_id INTEGER,
-                role TEXT DEFAULT 'member',
-                joined_at TEXT,
-                PRIMARY KEY (clan_id, user_id)
-            )
-        ''')
-        
-        await conn.execute('''
-            CREATE TABLE IF NOT EXISTS duels (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                challenger_id INTEGER,
-                challenged_id INTEGER,
-                amount INTEGER,
-                status TEXT DEFAULT 'pending',
-                created_at TEXT,
-                winner_id INTEGER
-            )
-        ''')
-        
-        await conn.execute('''
-            CREATE TABLE IF NOT EXISTS user_activity (
-                user_id INTEGER,
-                date TEXT,
-                message_count INTEGER DEFAULT 0,
-                PRIMARY KEY (user_id, date)
-            )
-        ''')
-        
-        await conn.execute('''
-            CREATE TABLE IF NOT EXISTS duel_stats (
-                user_id INTEGER PRIMARY KEY,
-                wins INTEGER DEFAULT 0,
-                losses INTEGER DEFAULT 0,
-                current_streak INTEGER DEFAULT 0,
-                best_streak INTEGER DEFAULT 0
-            )
-        ''')
-        
-        # Новые таблицы для модерации
-        await conn.execute('''
-            CREATE TABLE IF NOT EXISTS moderation_logs (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER,
-                moderator_id INTEGER,
-                action TEXT,
-                reason TEXT,
-                duration_minutes INTEGER,
-                timestamp TEXT,
-                message_text TEXT
-            )
-        ''')
-        
-        await conn.execute('''
-            CREATE TABLE IF NOT EXISTS reports (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                reporter_id INTEGER,
-                reported_user_id INTEGER,
-                reason TEXT,
-                message_id INTEGER,
-                chat_id INTEGER,
-                status TEXT DEFAULT 'pending',
-                timestamp TEXT
-            )
-        ''')
-        
-        await conn.execute('''
-            CREATE TABLE IF NOT EXISTS word_filters (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                word TEXT UNIQUE,
-                action TEXT,
-                created_by INTEGER,
-                created_at TEXT
-            )
-        ''')
-        
-        await conn.execute('''
-            CREATE TABLE IF NOT EXISTS user_verification (
-                user_id INTEGER PRIMARY KEY,
-                captcha_text TEXT,
-                attempts INTEGER DEFAULT 0,
-                verified INTEGER DEFAULT 0,
-                join_time TEXT
-            )
-        ''')
-        
-        await conn.execute('''
-            CREATE TABLE IF NOT EXISTS chat_stats (
-                date TEXT PRIMARY KEY,
-                message_count INTEGER DEFAULT 0,
-                user_count INTEGER DEFAULT 0,
-                new_users INTEGER DEFAULT 0
+    @staticmethod
+    def _read_only_uri(path: str) -> str:
+        return Path(path).absolute().as_uri() + '?mode=ro'
+
+    async def apply_pragmas(self, conn: aiosqlite.Connection):
+        for name, value in self.pragmas.items():
+            if name in CONNECTION_PRAGMAS:
+                await conn.execute(f'PRAGMA {name} = {value}')
+            else:
+                for schema in self.schemas:
+                    await conn.execute(f'PRAGMA {schema}.{name} = {value}')
+
+    async def _schema_objects(self, schema: str, table: str) -> List[tuple]:
+        cursor = await self.conn.execute(
+            f'SELECT type, name, sql FROM {schema}.sqlite_master WHERE tbl_name = ? AND sql IS NOT NULL',
+            (table,)
+        )
+        rows = await cursor.fetchall()
+        await cursor.close()
+        return rows
+
+    async def place_tables(self) -> List[str]:
+        """Перенос таблиц доменов из основного файла в их файлы.
+
+        Вызывается при старте после миграций и до запуска писателя:
+        миграции создают и перестраивают таблицы в main, а здесь они
+        переезжают вместе с индексами и счётчиком AUTOINCREMENT.
+        Возвращает перенесённые таблицы как схема.таблица.
+        """
+        moved = []
+        for schema, (_, tables) in self.domains.items():
+            for table in tables:
+                objects = await self._schema_objects('main', table)
+                if not objects:
+                    continue
+                if await self._schema_objects(schema, table):
+                    logging.error(f"Таблица {table} есть и в основном файле, и в {schema}: перенос пропущен")
+                    continue
+                
+                started = time.perf_counter()
+                await self._move_table(schema, table, objects)
+                logging.info(f"Таблица {table} перенесена в {schema} за {time.perf_counter() - started:.2f}с")
+                moved.append(f'{schema}.{table}')
+        return moved
+
+    async def _move_table(self, schema: str, table: str, objects: List[tuple]):
+        statements = []
+        triggers = []
+        autoincrement = False
+        for object_type, name, sql in objects:
+            if object_type == 'table':
+                autoincrement = 'AUTOINCREMENT' in sql.upper()
+                statements.insert(0, re.sub(
+                    r'^CREATE TABLE ("?\w+"?)', f'CREATE TABLE {schema}.\\1', sql, count=1
+                ))
+            elif object_type == 'index':
+                # Имя таблицы в индексе без схемы: она берётся у самого индекса
+                statements.append(re.sub(
+                    r'^CREATE (UNIQUE )?INDEX ("?\w+"?)', f'CREATE \\1INDEX {schema}.\\2', sql, count=1
+                ))
+            elif object_type == 'trigger':
+                # Создаются после копирования данных, чтобы копия их не вызывала
+                triggers.append(re.sub(
+                    r'^CREATE TRIGGER (IF NOT EXISTS )?("?\w+"?)', f'CREATE TRIGGER \\1{schema}.\\2', sql, count=1
+                ))
+            else:
+                raise ValueError(f"{object_type} {name} на таблице {table} нельзя перенести в {schema}")
+        
+        cursor = await self.conn.execute(f'PRAGMA main.table_info({table})')
+        # table_info не включает вычисляемые столбцы: они пересчитаются сами
+        columns = ', '.join(row[1] for row in await cursor.fetchall())
+        sequence = None
+        if autoincrement:
+            cursor = await self.conn.execute('SELECT seq FROM main.sqlite_sequence WHERE name = ?', (table,))
+            sequence = await cursor.fetchone()
+        
+        try:
+            await self.conn.execute('BEGIN IMMEDIATE')
+            for sql in statements:
+                await self.conn.execute(sql)
+            await self.conn.execute(
+                f'INSERT INTO {schema}.{table} ({columns}) SELECT {columns} FROM main.{table}'
             )
-        ''')
-        
-        # Инициализация товаров магазина
-        shop_items = [
-            ("🎨 Смена цвета ника", "Изменение цвета ника на 7 дней", 300, "color_change", 7),
-            ("📌 Закреп сообщения", "Возможность закреплять сообщения на 1 час", 150, "pin_message", 1),
-            ("🚀 Буст опыта x1.5", "Увеличение получаемого опыта на 50% на 3 дня", 500, "xp_boost", 3),
-            ("👑 VIP статус", "Особый статус в чате на 30 дней", 1000, "vip_status", 30),
-            ("💰 Банковский счёт", "Ежедневные проценты на баланс", 2000, "bank_account", 0),
-            ("🎭 Анонимность", "Отправка анонимных сообщений на 7 дней", 400, "anonymity", 7)
-        ]
-        
-        for item in shop_items:
-            await conn.execute('''
-                INSERT OR IGNORE INTO shop_items (name, description, price, item_type, duration_days)
-                VALUES (?, ?, ?, ?, ?)
-            ''', item)
-        
-        await conn.commit()
+            if sequence:
+                await self.conn.execute(f'DELETE FROM {schema}.sqlite_sequence WHERE name = ?', (table,))
+                await self.conn.execute(
+                    f'INSERT INTO {schema}.sqlite_sequence (name, seq) VALUES (?, ?)', (table, sequence[0])
+                )
+            for sql in triggers:
+                await self.conn.execute(sql)
+            await self.conn.execute(f'DROP TABLE main.{table}')
+            await self.conn.commit()
+        except Exception:
+            await self.conn.rollback()
+            raise
+
+    async def backup(self, directory: Path, suffix: str = '') -> List[Path]:
+        """Согласованные копии всех файлов базы (VACUUM INTO).
+
+        Копии снимаются подряд под блокировкой писателя, поэтому между
+        ними не проходит ни одна запись и файлы совпадают по состоянию.
+        Возвращает пути копий с исходными именами файлов.
+        """
+        directory.mkdir(parents=True, exist_ok=True)
+        
+        async def run(conn):
+            paths = []
+            for schema in self.schemas:
+                source = Path(self.file_path(schema))
+                target = directory / f'{source.stem}{suffix}{source.suffix}'
+                if target.exists():
+                    target.unlink()
+                await conn.execute(f'VACUUM {schema} INTO ?', (str(target),))
+                paths.append(target)
+            return paths
+        
+        return await self.run_exclusive(run)
+
+    @asynccontextmanager
+    async def read(self) -> AsyncIterator[aiosqlite.Connection]:
+        """Наименее занятое соединение для чтения"""
+        if not self.readers:
+            yield self.conn
+            return
+        
+        index = min(range(len(self.readers)), key=self._reader_load.__getitem__)
+        self._reader_load[index] += 1
+        self.read_stats['queries'] += 1
+        self.read_stats['max_in_flight'] = max(self.read_stats['max_in_flight'], sum(self._reader_load))
+        try:
+            yield self.readers[index]
+        finally:
+            self._reader_load[index] -= 1
+
+    async def fetchone(self, sql: str, params: Tuple = ()) -> Optional[tuple]:
+        async with self.read() as conn:
+            cursor = await conn.execute(sql, params)
+            row = await cursor.fetchone()
+            # Незакрытый запрос удерживал бы старый снимок WAL на читателе
+            await cursor.close()
+            return row
+
+    async def fetchall(self, sql: str, params: Tuple = ()) -> List[tuple]:
+        async with self.read() as conn:
+            cursor = await conn.execute(sql, params)
+            return await cursor.fetchall()
+
+    def get_read_stats(self):
+        return {
+            'readers': len(self.readers),
+            'in_flight': sum(self._reader_load),
+            **self.read_stats
+        }
+
+    def start_writer(self):
+        """Запуск фоновой задачи записи"""
+        if self._writer_task is None or self._writer_task.done():
+            self._write_queue = asyncio.Queue()
+            self._writer_task = asyncio.create_task(self._writer(self._write_queue))
+
+    async def stop_writer(self):
+        """Остановка с записью уже принятых единиц.
+
+        Писатель не отменяется: он получает метку конца очереди,
+        дописывает текущую группу и всё, что было принято до остановки.
+        Записи после вызова идут напрямую.
+        """
+        if not self._writer_task:
+            return
+        
+        queue, self._write_queue = self._write_queue, None
+        if queue is not None:
+            queue.put_nowait(None)
+        try:
+            await self._writer_task
+        except asyncio.CancelledError:
+            pass
+        self._writer_task = None
+
+    async def write(self, unit: WriteUnit, *args) -> Any:
+        """Выполнение единицы записи в общей транзакции.
+
+        Возвращает результат unit после того, как транзакция
+        зафиксирована. Ошибка внутри unit откатывает только её
+        изменения и пробрасывается вызывающему. Единица может быть
+        выполнена повторно, поэтому не должна иметь побочных
+        эффектов вне БД.
+        """
+        if self._write_queue is None:
+            # Писатель не запущен (инициализация, скрипты) — пишем сразу
+            return await self._commit_group_direct(unit, args)
+        
+        future = asyncio.get_running_loop().create_future()
+        self._write_queue.put_nowait((unit, args, future))
+        return await future
+
+    async def execute_write(self, sql: str, params: Tuple = ()) -> int:
+        """Одиночный запрос через писателя; возвращает rowcount"""
+        async def unit(conn):
+            cursor = await conn.execute(sql, params)
+            return cursor.rowcount
+        
+        return await self.write(unit)
+
+    async def executemany_write(self, sql: str, rows: List[Tuple]) -> None:
+        async def unit(conn):
+            await conn.executemany(sql, rows)
+        
+        await self.write(unit)
+
+    async def run_exclusive(self, unit: WriteUnit, *args) -> Any:
+        """Выполнение на соединении писателя вне транзакции группы.
+
+        Нужно для операций, которые нельзя выполнять внутри транзакции
+        (wal_checkpoint, incremental_vacuum, VACUUM). Уже принятые
+        группы дописываются до или после, но не одновременно.
+        """
+        async with self._conn_lock:
+            return await unit(self.conn, *args)
+
+    def get_write_stats(self):
+        return {
+            'queue_depth': self._write_queue.qsize() if self._write_queue else 0,
+            **self.write_stats
+        }
+
+    async def _writer(self, queue: asyncio.Queue):
+        stopping = False
+        while not stopping:
+            try:
+                item = await queue.get()
+                if item is None:
+                    break
+                if self.group_window:
+                    await asyncio.sleep(self.group_window)
+                group = self._drain(queue, [item])
+                # Метка остановки: группа перед ней дописывается последней
+                if group[-1] is None:
+                    group.pop()
+                    stopping = True
+                async with self._conn_lock:
+                    await self._commit_group(group)
+            except asyncio.CancelledError:
+                # Принятые, но не начатые единицы тоже не ждут вечно
+                while not queue.empty():
+                    item = queue.get_nowait()
+                    if item is not None and not item[2].done():
+                        item[2].cancel()
+                raise
+            except Exception as e:
+                logging.error(f"Ошибка фоновой записи в БД: {e}")
+
+    def _drain(self, queue: asyncio.Queue, group: list) -> list:
+        while len(group) < self.max_group:
+            try:
+                item = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                break
+            group.append(item)
+            if item is None:
+                break
+        return group
+
+    async def _commit_group_direct(self, unit: WriteUnit, args: Tuple) -> Any:
+        async with self._conn_lock:
+            try:
+                result = await unit(self.conn, *args)
+                await self.conn.commit()
+            except BaseException:
+                await self.conn.rollback()
+                raise
+        self.write_stats['commits'] += 1
+        self.write_stats['units'] += 1
+        return result
+
+    async def _commit_group(self, group: list):
+        """Одна транзакция на группу.
+
+        Точки сохранения на каждую единицу стоили бы лишних обращений
+        к потоку SQLite, поэтому группа пишется целиком, а при ошибке
+        откатывается и повторяется по одной единице: ошибка достаётся
+        только своему вызывающему.
+        """
+        started = time.perf_counter()
+        results = []
+        
+        try:
+            await self.conn.execute('BEGIN IMMEDIATE')
+            for unit, args, _ in group:
+                results.append(await unit(self.conn, *args))
+            await self.conn.commit()
+            
+        except BaseException as e:
+            try:
+                await self.conn.rollback()
+            except BaseException:
+                pass
+            
+            # Отмена посреди транзакции: соединение не остаётся в
+            # открытой транзакции, а вызывающие не ждут вечно
+            if not isinstance(e, Exception):
+                for _, _, future in group:
+                    if not future.done():
+                        future.cancel()
+                raise
+            
+            if len(group) > 1:
+                for item in group:
+                    await self._commit_group([item])
+                return
+            
+            self.write_stats['failed_units'] += 1
+            future = group[0][2]
+            if not future.done():
+                future.set_exception(e)
+            return
+        
+        for (_, _, future), result in zip(group, results):
+            if not future.done():
+                future.set_result(result)
+        
+        self.write_stats['commits'] += 1
+        self.write_stats['units'] += len(group)
+        self.write_stats['last_group'] = len(group)
+        self.write_stats['max_group'] = max(self.write_stats['max_group'], len(group))
+        self.write_stats['last_commit_ms'] = (time.perf_counter() - started) * 1000
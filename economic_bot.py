@@ -3,14 +3,16 @@ import asyncio
 import random
 import json
 import re
-import string
 from datetime import datetime, timedelta
 from typing import Dict, List, Tuple, Optional, Any
-import io
+import sqlite3
 import aiosqlite
 import redis.asyncio as redis
-from PIL import Image, ImageDraw, ImageFont
 import os
+import tempfile
+import time
+import zipfile
+from pathlib import Path
 import aiohttp
 import psutil
 import enum
@@ -34,10 +36,29 @@ from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.cron import CronTrigger
 
 from config import Config
-from database import Database
+from database import Database, to_epoch
+from migrations import apply_migrations
 from seasonal_system import SeasonalSystem
 from admin_system import AdminSystem
-from models import Season, SeasonType
+from reward_flusher import RewardFlusher
+from user_cache import UserCache
+from rate_limiter import RateLimiter
+from word_filter import WordFilter
+from leveling import LevelTable, relevel_all
+from leaderboards import LEVEL_SHIFT, Leaderboards, season_board
+from economy_stats import EconomyStats
+from charts import ChartRenderer, LineChart
+from captcha_pool import CaptchaPool
+from achievement_tracker import AchievementTracker
+from message_pipeline import MessagePipeline, MessageContext
+from maintenance import MaintenanceManager
+from ledger import Ledger, InsufficientFunds, history_columns, render_row
+from archive import TransactionArchiver
+from repository import UserRepository
+from models import Season, SeasonType, User
+
+# Строк на странице досок лидеров
+LEADERBOARD_PAGE_SIZE = 10
 
 # Настройка логирования
 logging.basicConfig(
@@ -90,9 +111,18 @@ class EconomicBot:
 
         # Модерация
         self.bad_words = self.load_bad_words()
-        self.spam_detection = {}
+        self.word_filter = WordFilter()
+        self.rate_limiter = RateLimiter()
+        self.muted_until: Dict[int, datetime] = {}
         self.user_join_times = {}
         
+        # Конвейер обработки текстовых сообщений
+        self.message_pipeline = MessagePipeline()
+        self.message_pipeline.add_stage('early_drop', self.stage_early_drop)
+        self.message_pipeline.add_stage('moderation', self.stage_moderation)
+        self.message_pipeline.add_stage('stats', self.stage_stats)
+        self.message_pipeline.add_stage('reward', self.stage_reward)
+        
         # Мониторинг
         self.start_time = datetime.now()
         self.message_stats = {
@@ -101,9 +131,62 @@ class EconomicBot:
             'last_reset': datetime.now()
         }
 
+        # Кэш горячих полей пользователей
+        self.user_cache = UserCache(
+            max_size=config.user_cache_size,
+            ttl=config.user_cache_ttl
+        )
+
+        # Движение коинов и пакетный доступ к пользователям
+        self.ledger = Ledger()
+        self.users = UserRepository(self.db, self.user_cache, self.ledger)
+
+        # Доски лидеров (Redis ZSET или индекс в памяти)
+        self.leaderboards = Leaderboards(self.db)
+        
+        # Сводные счётчики экономики (ведутся триггерами)
+        self.economy_stats = EconomyStats(self.db, min(30, self.config.transactions_retention_days))
+        
+        # Графики в пуле процессов
+        self.charts = ChartRenderer(self.config.chart_workers, self.config.chart_cache_size)
+        self.captcha_pool = CaptchaPool(
+            size=self.config.captcha_pool_size,
+            workers=self.config.captcha_workers,
+            font_path=self.config.captcha_font
+        )
+
         # Новые системы
-        self.seasonal_system = SeasonalSystem(self.db.conn)
-        self.admin_system = AdminSystem(self.db.conn)
+        self.seasonal_system = SeasonalSystem(self.db, self.user_cache, self.users, self.leaderboards)
+        self.admin_system = AdminSystem(
+            self.db, self.user_cache, self.users, self.leaderboards, self.economy_stats, self.charts
+        )
+
+        # Пороги опыта по уровням
+        self.level_table = LevelTable()
+
+        # Счётчики и открытые достижения
+        self.achievement_tracker = AchievementTracker(self.db, max_users=config.user_cache_size)
+        self.archiver = TransactionArchiver(
+            self.db,
+            directory=config.archive_dir,
+            retention_days=config.transactions_retention_days,
+            chunk_size=config.archive_chunk_size
+        )
+        self.maintenance = MaintenanceManager(self.db, vacuum_step_pages=config.vacuum_step_pages)
+
+        # Фоновая запись наград за сообщения
+        self.reward_flusher = RewardFlusher(
+            self.db,
+            self.seasonal_system,
+            self.message_queue,
+            flush_interval=config.flush_interval,
+            max_batch=config.flush_max_batch,
+            max_attempts=config.flush_max_attempts,
+            user_cache=self.user_cache,
+            level_table=self.level_table,
+            leaderboards=self.leaderboards,
+            on_level_up=self.notify_level_ups
+        )
 
     def load_bad_words(self) -> List[str]:
         """Загрузка списка запрещенных слов"""
@@ -132,6 +215,9 @@ class EconomicBot:
         except Exception as e:
             logging.warning(f"Redis не доступен: {e}. Используем in-memory кэш")
             self.redis_client = None
+        
+        self.rate_limiter.set_redis(self.redis_client)
+        self.leaderboards.set_redis(self.redis_client)
 
     async def init_scheduler(self):
         self.scheduler.add_job(
@@ -146,13 +232,6 @@ class EconomicBot:
             id='reset_weekly_activity'
         )
         
-        self.scheduler.add_job(
-            self.process_message_queue,
-            'interval',
-            seconds=30,
-            id='process_message_queue'
-        )
-        
         # Новые задачи
         self.scheduler.add_job(
             self.daily_stats_report,
@@ -166,6 +245,23 @@ class EconomicBot:
             id='cleanup'
         )
         
+        # Checkpoint в тихие часы, когда WAL не растёт под нагрузкой;
+        # у каждого файла своё расписание
+        for schema in self.db.schemas:
+            self.scheduler.add_job(
+                self.maintenance.scheduled_checkpoint,
+                CronTrigger(hour=self.config.db_checkpoint_hours.get(schema, self.config.checkpoint_hour), minute=0),
+                args=[schema],
+                id=f'wal_checkpoint_{schema}'
+            )
+        
+        self.scheduler.add_job(
+            self.evict_idle_spam_windows,
+            'interval',
+            minutes=5,
+            id='evict_spam_windows'
+        )
+        
         # Сезонные задачи
         self.scheduler.add_job(
             self.seasonal_system.check_seasonal_events,
@@ -184,14 +280,7 @@ class EconomicBot:
 
     async def recalculate_multipliers(self):
         try:
-            cursor = await self.db.conn.execute('''
-                SELECT user_id, weekly_activity 
-                FROM users 
-                WHERE weekly_activity > 0
-                ORDER BY weekly_activity DESC
-                LIMIT 10
-            ''')
-            top_active_users = await cursor.fetchall()
+            top_active_users = await self.leaderboards.top('weekly', 10)
             
             if top_active_users:
                 activities = [activity for _, activity in top_active_users]
@@ -211,47 +300,12 @@ class EconomicBot:
 
     async def reset_weekly_activity(self):
         try:
-            await self.db.conn.execute('UPDATE users SET weekly_activity = 0')
-            await self.db.conn.commit()
+            await self.db.execute_write('UPDATE users_hot SET weekly_activity = 0')
+            await self.leaderboards.clear('weekly')
             logging.info("Недельная активность сброшена")
         except Exception as e:
             logging.error(f"Ошибка при сбросе активности: {e}")
 
-    async def process_message_queue(self):
-        try:
-            for _ in range(100):
-                try:
-                    user_id, message_data = self.message_queue.get_nowait()
-                    await self.process_single_message(user_id, message_data)
-                except asyncio.QueueEmpty:
-                    break
-        except Exception as e:
-            logging.error(f"Ошибка при обработке очереди сообщений: {e}")
-
-    async def process_single_message(self, user_id: int, message_data: dict):
-        try:
-            base_xp = message_data.get('xp_gain', 1)
-            base_coins = message_data.get('coins_gain', random.randint(1, 3))
-            
-            # Применяем сезонные множители
-            xp, coins = await self.seasonal_system.apply_seasonal_multipliers(base_xp, base_coins)
-            
-            await self.db.conn.execute('''
-                UPDATE users 
-                SET xp = xp + ?, balance = balance + ?, 
-                    total_message_count = total_message_count + 1,
-                    weekly_activity = weekly_activity + 1
-                WHERE user_id = ?
-            ''', (xp, coins, user_id))
-            
-            # Обновляем сезонную статистику
-            await self.seasonal_system.update_user_season_stats(user_id, xp, coins)
-            
-            await self.db.conn.commit()
-            
-        except Exception as e:
-            logging.error(f"Ошибка при обработке сообщения пользователя {user_id}: {e}")
-
     def setup_handlers(self):
         # Основные команды
         self.application.add_handler(CommandHandler("balance", self.balance))
@@ -297,6 +351,7 @@ class EconomicBot:
         self.application.add_handler(CommandHandler("report", self.report_user))
         self.application.add_handler(CommandHandler("add_filter", self.add_word_filter))
         self.application.add_handler(CommandHandler("remove_filter", self.remove_word_filter))
+        self.application.add_handler(CommandHandler("import_filters", self.import_word_filters))
         self.application.add_handler(CommandHandler("filters", self.list_filters))
         self.application.add_handler(CommandHandler("clean", self.clean_messages))
         
@@ -318,17 +373,15 @@ class EconomicBot:
         self.application.add_handler(CommandHandler("admin_search", self.admin_system.admin_user_search))
         self.application.add_handler(CommandHandler("admin_backup", self.admin_system.admin_system_backup))
         self.application.add_handler(CommandHandler("admin_logs", self.admin_logs))
+        self.application.add_handler(CommandHandler("admin_relevel", self.admin_relevel))
+        self.application.add_handler(CommandHandler("admin_leaderboards", self.admin_leaderboards))
+        self.application.add_handler(CommandHandler("admin_verify_stats", self.admin_verify_stats))
+        self.application.add_handler(CommandHandler("admin_archive", self.admin_archive))
         
         # Обработчики сообщений
         self.application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, self.handle_message))
         self.application.add_handler(CallbackQueryHandler(self.button_handler))
         
-        # Новые обработчики
-        self.application.add_handler(MessageHandler(
-            filters.TEXT & ~filters.COMMAND, 
-            self.auto_moderate
-        ))
-        
         self.application.add_handler(MessageHandler(
             filters.StatusUpdate.NEW_CHAT_MEMBERS,
             self.handle_new_members
@@ -341,7 +394,7 @@ class EconomicBot:
         user_data = await self.get_user_data(user_id)
         
         if user_data:
-            level, xp, balance = user_data[3], user_data[4], user_data[2]
+            level, xp, balance = user_data.level, user_data.xp, user_data.balance
             next_level_xp = self.calculate_required_xp(level + 1)
             progress_bar = self.create_progress_bar(xp - self.calculate_required_xp(level), 
                                                   next_level_xp - self.calculate_required_xp(level))
@@ -372,11 +425,10 @@ class EconomicBot:
         
         await self.ensure_user_exists(user_id, update.effective_user.username)
         
-        cursor = await self.db.conn.execute(
+        result = await self.db.fetchone(
             'SELECT last_daily, daily_streak FROM users WHERE user_id = ?', 
             (user_id,)
         )
-        result = await cursor.fetchone()
         
         last_daily_str, streak = result
         current_streak = streak
@@ -410,18 +462,29 @@ class EconomicBot:
         if await self.has_active_item(user_id, 'vip_status'):
             total_reward = int(total_reward * 1.5)
         
-        await self.db.conn.execute('''
-            UPDATE users 
-            SET balance = balance + ?, last_daily = ?, daily_streak = ?
-            WHERE user_id = ?
-        ''', (total_reward, now, current_streak, user_id))
+        async def write_daily(conn):
+            # Бонус засчитывается, только если last_daily не изменился с
+            # момента проверки: повторный /daily не получит его второй раз.
+            # rowcount есть только у таблицы, не у представления users
+            cursor = await conn.execute('''
+                UPDATE users_cold 
+                SET last_daily = ?, daily_streak = ?
+                WHERE user_id = ? AND last_daily IS ?
+            ''', (now, current_streak, user_id, last_daily_str))
+            if cursor.rowcount == 0:
+                return None
+            
+            return await self.ledger.credit(
+                conn, user_id, total_reward, 'daily', note=str(current_streak), now=now
+            )
         
-        await self.db.conn.execute('''
-            INSERT INTO transactions (user_id, amount, type, timestamp, description)
-            VALUES (?, ?, 'daily', ?, ?)
-        ''', (user_id, total_reward, now, f"Ежедневный бонус (день {current_streak})"))
+        new_balance = await self.db.write(write_daily)
+        self.user_cache.invalidate(user_id)
+        await self.leaderboards.refresh_users([user_id])
         
-        await self.db.conn.commit()
+        if new_balance is None:
+            await update.message.reply_text("⏰ Ежедневный бонус уже получен!")
+            return
         
         if current_streak == 1:
             await self.unlock_achievement(user_id, 'first_daily', update)
@@ -433,44 +496,82 @@ class EconomicBot:
         )
 
     async def handle_message(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        """Расширенный обработчик сообщений"""
-        await self.update_message_stats()
+        """Расширенный обработчик сообщений: единый конвейер стадий"""
+        ctx = MessageContext(
+            update=update,
+            context=context,
+            user_id=update.effective_user.id,
+            username=update.effective_user.username,
+            text=update.message.text.strip(),
+            now=datetime.now()
+        )
+        await self.message_pipeline.run(ctx)
+
+    async def stage_early_drop(self, ctx: MessageContext):
+        """Стадия 1: отсев забаненных и замученных пользователей"""
+        muted_until = self.muted_until.get(ctx.user_id)
+        if muted_until:
+            if muted_until > ctx.now:
+                ctx.stop('muted')
+                return
+            del self.muted_until[ctx.user_id]
         
-        user_id = update.effective_user.id
-        message_text = update.message.text.strip()
-        now = datetime.now().isoformat()
+        ctx.user = await self.ensure_user_exists(ctx.user_id, ctx.username)
+        if ctx.user and ctx.user.get('is_banned'):
+            ctx.stop('banned')
+
+    async def stage_moderation(self, ctx: MessageContext):
+        """Стадия 2: антиспам и фильтр слов"""
+        message_text = ctx.text.lower()
         
-        await self.ensure_user_exists(user_id, update.effective_user.username)
+        # Проверка на спам
+        if await self.detect_spam(ctx.user_id, message_text, ctx.update, ctx.context):
+            ctx.stop('spam')
+            return
+            
+        # Проверка запрещенных слов
+        if await self.check_bad_words(message_text, ctx.user_id, ctx.update, ctx.context):
+            ctx.stop('word_filter')
+            try:
+                await ctx.update.message.delete()
+                await ctx.update.message.reply_text(
+                    f"⚠️ Сообщение удалено из-за нарушения правил. "
+                    f"Пользователь {ctx.update.effective_user.mention_html()} получил предупреждение.",
+                    parse_mode='HTML'
+                )
+            except Exception as e:
+                logging.error(f"Ошибка удаления сообщения: {e}")
+
+    async def stage_stats(self, ctx: MessageContext):
+        """Стадия 3: статистика сообщений"""
+        await self.update_message_stats()
+
+    async def stage_reward(self, ctx: MessageContext):
+        """Стадия 4: награда за сообщение"""
+        message_text = ctx.text
         
         if (len(message_text) > 15 and 
             not message_text.startswith('/') and
-            await self.can_receive_message_reward(user_id)):
+            await self.can_receive_message_reward(ctx.user_id)):
             
+            now = ctx.now.isoformat()
             message_data = {
                 'xp_gain': 1,
                 'coins_gain': random.randint(1, 3),
                 'timestamp': now,
+                'queued_at': time.monotonic(),
+                'chat_id': ctx.update.effective_chat.id,
                 'text_length': len(message_text)
             }
             
-            await self.message_queue.put((user_id, message_data))
-            
-            await self.db.conn.execute(
-                'UPDATE users SET last_message = ? WHERE user_id = ?',
-                (now, user_id)
-            )
-            
-            today = datetime.now().strftime('%Y-%m-%d')
-            await self.db.conn.execute('''
-                INSERT INTO user_activity (user_id, date, message_count)
-                VALUES (?, ?, 1)
-                ON CONFLICT(user_id, date) 
-                DO UPDATE SET message_count = message_count + 1
-            ''', (user_id, today))
+            # last_message и user_activity записывает RewardFlusher вместе с наградой,
+            # кулдаун уже занят в RateLimiter
+            self.user_cache.update(ctx.user_id, last_message=now)
+            await self.message_queue.put((ctx.user_id, message_data))
             
-            await self.db.conn.commit()
-            
-            await self.check_secret_achievements(user_id, update)
+            if ctx.user:
+                await self.check_message_achievements(ctx.user_id, ctx.update, ctx.user)
+                await self.check_secret_achievements(ctx.user_id, ctx.update, ctx.user)
 
     async def pay(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         if not context.args or len(context.args) < 2:
@@ -490,11 +591,10 @@ class EconomicBot:
             
         from_user_id = update.effective_user.id
         
-        cursor = await self.db.conn.execute(
+        target_user = await self.db.fetchone(
             'SELECT user_id FROM users WHERE username = ?', 
             (target_username,)
         )
-        target_user = await cursor.fetchone()
         
         if not target_user:
             await update.message.reply_text("❌ Пользователь не найден!")
@@ -510,11 +610,10 @@ class EconomicBot:
         tax = int(amount * tax_rate)
         total_deduction = amount + tax
         
-        cursor = await self.db.conn.execute(
+        sender_balance = (await self.db.fetchone(
             'SELECT balance FROM users WHERE user_id = ?', 
             (from_user_id,)
-        )
-        sender_balance = (await cursor.fetchone())[0]
+        ))[0]
         
         if sender_balance < total_deduction:
             await update.message.reply_text("❌ Недостаточно средств для перевода!")
@@ -563,11 +662,10 @@ class EconomicBot:
             
         user_id = update.effective_user.id
         
-        cursor = await self.db.conn.execute(
+        item = await self.db.fetchone(
             'SELECT id, name, description, price, item_type, duration_days FROM shop_items WHERE id = ?',
             (item_id,)
         )
-        item = await cursor.fetchone()
         
         if not item:
             await update.message.reply_text("❌ Предмет не найден!")
@@ -575,39 +673,34 @@ class EconomicBot:
             
         item_id, name, description, price, item_type, duration_days = item
         
-        cursor = await self.db.conn.execute(
-            'SELECT balance FROM users WHERE user_id = ?',
-            (user_id,)
-        )
-        balance = (await cursor.fetchone())[0]
-        
-        if balance < price:
-            await update.message.reply_text("❌ Недостаточно средств для покупки!")
-            return
-            
         now = datetime.now()
         expires_at = (now + timedelta(days=duration_days)).isoformat() if duration_days > 0 else None
         
-        await self.db.conn.execute('''
-            INSERT INTO user_inventory (user_id, item_id, purchased_at, expires_at, is_active)
-            VALUES (?, ?, ?, ?, 1)
-        ''', (user_id, item_id, now.isoformat(), expires_at))
-        
-        await self.db.conn.execute(
-            'UPDATE users SET balance = balance - ? WHERE user_id = ?',
-            (price, user_id)
-        )
+        async def write_purchase(conn):
+            balance = await self.ledger.debit(
+                conn, user_id, price, 'purchase', item_id=item_id, now=now.isoformat()
+            )
+            if balance is None:
+                return None
+            
+            await conn.execute('''
+                INSERT INTO user_inventory (user_id, item_id, purchased_at, expires_at, is_active)
+                VALUES (?, ?, ?, ?, 1)
+            ''', (user_id, item_id, now.isoformat(), expires_at))
+            
+            return await self.achievement_tracker.increment(conn, user_id, purchases=1)
         
-        await self.db.conn.execute('''
-            INSERT INTO transactions (user_id, amount, type, timestamp, description)
-            VALUES (?, ?, 'purchase', ?, ?)
-        ''', (user_id, -price, now.isoformat(), f"Покупка: {name}"))
+        counters = await self.db.write(write_purchase)
+        self.user_cache.invalidate(user_id)
+        await self.leaderboards.refresh_users([user_id])
         
-        await self.db.conn.commit()
+        if counters is None:
+            await update.message.reply_text("❌ Недостаточно средств для покупки!")
+            return
         
         await self.apply_item_effects(user_id, item_type, update)
         
-        await self.check_purchase_achievements(user_id, update)
+        await self.check_purchase_achievements(user_id, update, counters)
         
         await update.message.reply_text(
             f"🎉 Поздравляем с покупкой {name}!\n"
@@ -618,15 +711,13 @@ class EconomicBot:
     async def inventory(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         user_id = update.effective_user.id
         
-        cursor = await self.db.conn.execute('''
+        items = await self.db.fetchall('''
             SELECT si.name, si.description, ui.purchased_at, ui.expires_at
             FROM user_inventory ui
             JOIN shop_items si ON ui.item_id = si.id
             WHERE ui.user_id = ? AND ui.is_active = 1
         ''', (user_id,))
         
-        items = await cursor.fetchall()
-        
         if not items:
             await update.message.reply_text("📦 Ваш инвентарь пуст!")
             return
@@ -649,32 +740,53 @@ class EconomicBot:
         await update.message.reply_text(message)
 
     def calculate_required_xp(self, level: int) -> int:
-        return int(100 * (level ** 1.5))
+        return self.level_table.required_xp(level)
 
     async def check_level_up(self, user_id: int, update: Update):
-        cursor = await self.db.conn.execute(
+        xp, current_level = await self.db.fetchone(
             'SELECT xp, level FROM users WHERE user_id = ?', 
             (user_id,)
         )
-        xp, current_level = await cursor.fetchone()
         
-        new_level = current_level
-        while xp >= self.calculate_required_xp(new_level + 1):
-            new_level += 1
+        new_level = max(current_level, self.level_table.level_for_xp(xp))
             
         if new_level > current_level:
-            await self.db.conn.execute(
+            await self.db.execute_write(
                 'UPDATE users SET level = ? WHERE user_id = ?', 
                 (new_level, user_id)
             )
-            await self.db.conn.commit()
+            self.user_cache.invalidate(user_id)
+            await self.leaderboards.refresh_users([user_id])
             
             await self.send_level_up_message(update, user_id, new_level)
             
             if new_level >= 20:
                 await self.unlock_achievement(user_id, 'veteran', update)
 
-    async def send_level_up_message(self, update: Update, user_id: int, new_level: int):
+    async def notify_level_ups(self, level_ups: List[Tuple[int, Optional[int], int]]):
+        """Поздравления с уровнями, полученными при записи наград"""
+        level_ups = [level_up for level_up in level_ups if level_up[1] is not None]
+        if not level_ups:
+            return
+        
+        try:
+            usernames = await self.users.get_usernames(user_id for user_id, _, _ in level_ups)
+        except Exception as e:
+            logging.error(f"Ошибка загрузки пользователей для поздравлений: {e}")
+            return
+        
+        for user_id, chat_id, new_level in level_ups:
+            try:
+                await self.application.bot.send_message(
+                    chat_id, self.format_level_up_message(f"@{usernames.get(user_id)}", new_level)
+                )
+                
+                if new_level >= 20:
+                    await self.unlock_achievement(user_id, 'veteran', chat_id=chat_id)
+            except Exception as e:
+                logging.error(f"Ошибка поздравления с уровнем для {user_id}: {e}")
+
+    def format_level_up_message(self, name: str, new_level: int) -> str:
         level_titles = {
             5: "Опытный",
             10: "Эксперт", 
@@ -685,23 +797,25 @@ class EconomicBot:
         
         title = level_titles.get(new_level, "Новичок")
         
-        message = (
-            f"🎉 Поздравляем, {update.effective_user.first_name} "
+        return (
+            f"🎉 Поздравляем, {name} "
             f"достиг(ла) уровня {new_level} - {title}!"
         )
-        
-        await update.message.reply_text(message)
+
+    async def send_level_up_message(self, update: Update, user_id: int, new_level: int):
+        await update.message.reply_text(
+            self.format_level_up_message(update.effective_user.first_name, new_level)
+        )
 
     async def achievements(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         user_id = update.effective_user.id
         
-        cursor = await self.db.conn.execute('''
+        unlocked = await self.db.fetchall('''
             SELECT achievement_name, unlocked_at 
             FROM achievements 
             WHERE user_id = ?
         ''', (user_id,))
         
-        unlocked = await cursor.fetchall()
         unlocked_dict = {name: unlocked_at for name, unlocked_at in unlocked}
         
         message = "🏆 Ваши достижения:\n\n"
@@ -729,40 +843,44 @@ class EconomicBot:
         await update.message.reply_text(message)
 
     async def leaderboard(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        leaderboard_type = context.args[0] if context.args else "balance"
+        user_id = update.effective_user.id
+        leaderboard_type = "level" if context.args and context.args[0] == "level" else "balance"
+        page = int(context.args[1]) if len(context.args) > 1 and context.args[1].isdigit() else 1
+        page = max(1, page)
+        offset = (page - 1) * LEADERBOARD_PAGE_SIZE
         
+        top_users = await self.leaderboards.top(leaderboard_type, LEADERBOARD_PAGE_SIZE, offset)
         if leaderboard_type == "level":
-            cursor = await self.db.conn.execute('''
-                SELECT username, level, xp 
-                FROM users 
-                ORDER BY level DESC, xp DESC 
-                LIMIT 10
-            ''')
             title = "🏆 Топ по уровням"
         else:
-            cursor = await self.db.conn.execute('''
-                SELECT username, balance, level 
-                FROM users 
-                ORDER BY balance DESC 
-                LIMIT 10
-            ''')
             title = "💰 Топ по балансу"
-            
-        top_users = await cursor.fetchall()
         
         if not top_users:
-            await update.message.reply_text("📊 Пока нет данных для рейтинга!")
+            if page == 1:
+                await update.message.reply_text("📊 Пока нет данных для рейтинга!")
+            else:
+                await update.message.reply_text(f"📊 Страница {page} пуста!")
             return
-            
-        message = f"{title}:\n\n"
         
-        for i, user_data in enumerate(top_users, 1):
+        users = await self.users.get_users([top_user_id for top_user_id, _ in top_users])
+        message = f"{title} (стр. {page}):\n\n"
+        
+        for i, (top_user_id, score) in enumerate(top_users, offset + 1):
+            user = users.get(top_user_id)
+            if user is None:
+                continue
             if leaderboard_type == "level":
-                username, level, xp = user_data
-                message += f"{i}. @{username} - Ур. {level} ({xp} XP)\n"
+                level, xp = divmod(score, LEVEL_SHIFT)
+                message += f"{i}. @{user.username} - Ур. {level} ({xp} XP)\n"
             else:
-                username, balance, level = user_data
-                message += f"{i}. @{username} - {balance:,} коинов (Ур. {level})\n"
+                message += f"{i}. @{user.username} - {score:,} коинов (Ур. {user.level})\n"
+        
+        own = await self.leaderboards.rank(leaderboard_type, user_id)
+        if own:
+            position, _, size = own
+            message += f"\n📍 Ваше место: {position} из {size}"
+            if offset + LEADERBOARD_PAGE_SIZE < size:
+                message += f"\n➡️ Дальше: /leaderboard {leaderboard_type} {page + 1}"
                 
         await update.message.reply_text(message)
 
@@ -774,18 +892,17 @@ class EconomicBot:
             await update.message.reply_text("❌ Пользователь не найден!")
             return
             
-        username, balance, level, xp = user_data[1], user_data[2], user_data[3], user_data[4]
+        username, balance, level, xp = user_data.username, user_data.balance, user_data.level, user_data.xp
         next_level_xp = self.calculate_required_xp(level + 1)
         progress_bar = self.create_progress_bar(xp - self.calculate_required_xp(level), 
                                               next_level_xp - self.calculate_required_xp(level))
         
         clan_name = await self.get_user_clan(user_id)
         
-        cursor = await self.db.conn.execute(
+        achievements_count = (await self.db.fetchone(
             'SELECT COUNT(*) FROM achievements WHERE user_id = ?',
             (user_id,)
-        )
-        achievements_count = (await cursor.fetchone())[0]
+        ))[0]
         
         message = (
             f"👤 Профиль пользователя @{username}\n"
@@ -820,11 +937,10 @@ class EconomicBot:
             
         challenger_id = update.effective_user.id
         
-        cursor = await self.db.conn.execute(
+        target_user = await self.db.fetchone(
             'SELECT user_id FROM users WHERE username = ?', 
             (target_username,)
         )
-        target_user = await cursor.fetchone()
         
         if not target_user:
             await update.message.reply_text("❌ Пользователь не найден!")
@@ -836,24 +952,21 @@ class EconomicBot:
             await update.message.reply_text("❌ Нельзя вызвать на дуэль самого себя!")
             return
             
-        cursor = await self.db.conn.execute(
+        challenger_balance = (await self.db.fetchone(
             'SELECT balance FROM users WHERE user_id = ?', 
             (challenger_id,)
-        )
-        challenger_balance = (await cursor.fetchone())[0]
+        ))[0]
         
         if challenger_balance < amount:
             await update.message.reply_text("❌ Недостаточно средств для дуэли!")
             return
             
         now = datetime.now().isoformat()
-        await self.db.conn.execute('''
+        await self.db.execute_write('''
             INSERT INTO duels (challenger_id, challenged_id, amount, status, created_at)
             VALUES (?, ?, ?, 'pending', ?)
         ''', (challenger_id, challenged_id, amount, now))
         
-        await self.db.conn.commit()
-        
         keyboard = [
             [
                 InlineKeyboardButton("⚔️ Принять дуэль", callback_data=f"accept_duel_{challenger_id}"),
@@ -872,7 +985,7 @@ class EconomicBot:
     async def accept_duel(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         user_id = update.effective_user.id
         
-        cursor = await self.db.conn.execute('''
+        duel = await self.db.fetchone('''
             SELECT id, challenger_id, amount 
             FROM duels 
             WHERE challenged_id = ? AND status = 'pending'
@@ -880,77 +993,68 @@ class EconomicBot:
             LIMIT 1
         ''', (user_id,))
         
-        duel = await cursor.fetchone()
-        
         if not duel:
             await update.message.reply_text("❌ Нет активных вызовов на дуэль!")
             return
             
         duel_id, challenger_id, amount = duel
         
-        cursor = await self.db.conn.execute(
-            'SELECT balance FROM users WHERE user_id = ?', 
-            (user_id,)
-        )
-        challenged_balance = (await cursor.fetchone())[0]
-        
-        if challenged_balance < amount:
-            await update.message.reply_text("❌ Недостаточно средств для принятия дуэли!")
-            return
-            
-        cursor = await self.db.conn.execute(
-            'SELECT balance FROM users WHERE user_id = ?', 
-            (challenger_id,)
-        )
-        challenger_balance = (await cursor.fetchone())[0]
-        
-        if challenger_balance < amount:
-            await update.message.reply_text("❌ У противника недостаточно средств!")
-            return
-            
         winner_id = random.choice([challenger_id, user_id])
         loser_id = challenger_id if winner_id == user_id else user_id
         
-        await self.update_duel_stats(winner_id, loser_id)
-        
-        await self.db.conn.execute(
-            'UPDATE users SET balance = balance - ? WHERE user_id = ?',
-            (amount, loser_id)
-        )
-        await self.db.conn.execute(
-            'UPDATE users SET balance = balance + ? WHERE user_id = ?',
-            (amount, winner_id)
-        )
-        
-        await self.db.conn.execute('''
-            UPDATE duels SET status = 'finished', winner_id = ? WHERE id = ?
-        ''', (winner_id, duel_id))
+        async def write_duel_result(conn):
+            # Ставку должны покрывать оба участника, проверка внутри транзакции
+            cursor = await conn.execute(
+                'SELECT user_id FROM users WHERE user_id IN (?, ?) AND balance < ?',
+                (challenger_id, user_id, amount)
+            )
+            short = {row[0] for row in await cursor.fetchall()}
+            if short:
+                return 'no_funds', short
+            
+            # Дуэль принимается один раз, даже при двойном нажатии
+            cursor = await conn.execute('''
+                UPDATE duels SET status = 'finished', winner_id = ? 
+                WHERE id = ? AND status = 'pending'
+            ''', (winner_id, duel_id))
+            if cursor.rowcount == 0:
+                return 'finished', None
+            
+            balances = await self.ledger.transfer(
+                conn, loser_id, winner_id, amount, amount, 'duel', 'duel'
+            )
+            if balances is None:
+                raise InsufficientFunds(loser_id, amount)
+            
+            winner_streak = await self.update_duel_stats(conn, winner_id, loser_id)
+            counters = await self.achievement_tracker.increment(conn, winner_id, duel_wins=1)
+            return 'ok', (winner_streak, counters)
         
-        now = datetime.now().isoformat()
-        await self.db.conn.execute('''
-            INSERT INTO transactions (user_id, amount, type, timestamp, description)
-            VALUES (?, ?, 'duel', ?, ?)
-        ''', (loser_id, -amount, now, f"Проигрыш в дуэли"))
+        status, result = await self.db.write(write_duel_result)
         
-        await self.db.conn.execute('''
-            INSERT INTO transactions (user_id, amount, type, timestamp, description)
-            VALUES (?, ?, 'duel', ?, ?)
-        ''', (winner_id, amount, now, f"Победа в дуэли"))
+        if status == 'no_funds':
+            if user_id in result:
+                await update.message.reply_text("❌ Недостаточно средств для принятия дуэли!")
+            else:
+                await update.message.reply_text("❌ У противника недостаточно средств!")
+            return
+        if status == 'finished':
+            await update.message.reply_text("❌ Нет активных вызовов на дуэль!")
+            return
         
-        await self.db.conn.commit()
+        winner_streak, counters = result
+        self.user_cache.invalidate(winner_id, loser_id)
+        await self.leaderboards.refresh_users([winner_id, loser_id])
         
-        cursor = await self.db.conn.execute(
-            'SELECT username FROM users WHERE user_id IN (?, ?)',
-            (challenger_id, user_id)
-        )
-        users = await cursor.fetchall()
-        challenger_name = users[0][0]
-        challenged_name = users[1][0]
+        # Строки IN (...) приходят в произвольном порядке: имена берутся по id
+        usernames = await self.users.get_usernames([challenger_id, user_id])
+        challenger_name = usernames.get(challenger_id)
+        challenged_name = usernames.get(user_id)
         winner_name = challenger_name if winner_id == challenger_id else challenged_name
         
         if winner_id == user_id:
-            await self.check_duel_achievements(user_id, update)
-            await self.check_duel_streak(user_id, update)
+            await self.check_duel_achievements(user_id, update, counters)
+            await self.check_duel_streak(user_id, update, winner_streak)
         
         await update.message.reply_text(
             f"🎉 Дуэль завершена!\n"
@@ -962,28 +1066,24 @@ class EconomicBot:
     async def decline_duel(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         user_id = update.effective_user.id
         
-        cursor = await self.db.conn.execute('''
+        duel = await self.db.fetchone('''
             SELECT challenger_id FROM duels 
             WHERE challenged_id = ? AND status = 'pending'
             ORDER BY created_at DESC 
             LIMIT 1
         ''', (user_id,))
         
-        duel = await cursor.fetchone()
-        
         if not duel:
             await update.message.reply_text("❌ Нет активных вызовов на дуэль!")
             return
             
         challenger_id = duel[0]
         
-        await self.db.conn.execute('''
+        await self.db.execute_write('''
             UPDATE duels SET status = 'declined' 
             WHERE challenged_id = ? AND status = 'pending'
         ''', (user_id,))
         
-        await self.db.conn.commit()
-        
         await update.message.reply_text("🏳️ Вы отказались от дуэли!")
 
     async def clan(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -1009,56 +1109,51 @@ class EconomicBot:
         description = ' '.join(context.args[1:])
         user_id = update.effective_user.id
         
-        cursor = await self.db.conn.execute(
+        user_clan = await self.db.fetchone(
             'SELECT clan_id FROM users WHERE user_id = ?',
             (user_id,)
         )
-        user_clan = await cursor.fetchone()
         
         if user_clan and user_clan[0]:
             await update.message.reply_text("❌ Вы уже состоите в клане!")
             return
             
         creation_cost = 1000
-        cursor = await self.db.conn.execute(
-            'SELECT balance FROM users WHERE user_id = ?',
-            (user_id,)
-        )
-        balance = (await cursor.fetchone())[0]
         
-        if balance < creation_cost:
-            await update.message.reply_text(f"❌ Недостаточно средств! Нужно {creation_cost} коинов.")
-            return
-            
         try:
             now = datetime.now().isoformat()
-            await self.db.conn.execute('''
-                INSERT INTO clans (name, description, owner_id, created_at)
-                VALUES (?, ?, ?, ?)
-            ''', (clan_name, description, user_id, now))
-            
-            cursor = await self.db.conn.execute(
-                'SELECT id FROM clans WHERE name = ?',
-                (clan_name,)
-            )
-            clan_id = (await cursor.fetchone())[0]
-            
-            await self.db.conn.execute('''
-                INSERT INTO clan_members (clan_id, user_id, role, joined_at)
-                VALUES (?, ?, 'owner', ?)
-            ''', (clan_id, user_id, now))
             
-            await self.db.conn.execute(
-                'UPDATE users SET clan_id = ? WHERE user_id = ?',
-                (clan_id, user_id)
-            )
+            async def write_clan(conn):
+                balance = await self.ledger.debit(
+                    conn, user_id, creation_cost, 'clan_creation', note=clan_name, now=now
+                )
+                if balance is None:
+                    return None
+                
+                cursor = await conn.execute('''
+                    INSERT INTO clans (name, description, owner_id, created_at)
+                    VALUES (?, ?, ?, ?)
+                ''', (clan_name, description, user_id, now))
+                clan_id = cursor.lastrowid
+                
+                await conn.execute('''
+                    INSERT INTO clan_members (clan_id, user_id, role, joined_at)
+                    VALUES (?, ?, 'owner', ?)
+                ''', (clan_id, user_id, now))
+                
+                await conn.execute(
+                    'UPDATE users SET clan_id = ? WHERE user_id = ?',
+                    (clan_id, user_id)
+                )
+                return clan_id
             
-            await self.db.conn.execute(
-                'UPDATE users SET balance = balance - ? WHERE user_id = ?',
-                (creation_cost, user_id)
-            )
+            clan_id = await self.db.write(write_clan)
+            self.user_cache.invalidate(user_id)
+            await self.leaderboards.refresh_users([user_id])
             
-            await self.db.conn.commit()
+            if clan_id is None:
+                await update.message.reply_text(f"❌ Недостаточно средств! Нужно {creation_cost} коинов.")
+                return
             
             await update.message.reply_text(
                 f"🎉 Клан '{clan_name}' успешно создан!\n"
@@ -1072,7 +1167,7 @@ class EconomicBot:
     async def clan_info(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         user_id = update.effective_user.id
         
-        cursor = await self.db.conn.execute('''
+        clan_info = await self.db.fetchone('''
             SELECT c.name, c.description, c.balance, c.owner_id,
                    (SELECT COUNT(*) FROM clan_members WHERE clan_id = c.id) as member_count
             FROM clans c
@@ -1080,15 +1175,13 @@ class EconomicBot:
             WHERE u.user_id = ?
         ''', (user_id,))
         
-        clan_info = await cursor.fetchone()
-        
         if not clan_info:
             await update.message.reply_text("❌ Вы не состоите в клане!")
             return
             
         name, description, balance, owner_id, member_count = clan_info
         
-        cursor = await self.db.conn.execute('''
+        members = await self.db.fetchall('''
             SELECT u.username, cm.role
             FROM clan_members cm
             JOIN users u ON cm.user_id = u.user_id
@@ -1102,8 +1195,6 @@ class EconomicBot:
                 cm.joined_at
         ''', (user_id,))
         
-        members = await cursor.fetchall()
-        
         message = (
             f"👥 Клан: {name}\n"
             f"📝 Описание: {description}\n"
@@ -1130,11 +1221,10 @@ class EconomicBot:
         target_username = context.args[0].lstrip('@')
         reason = ' '.join(context.args[1:]) if len(context.args) > 1 else "Не указана"
         
-        cursor = await self.db.conn.execute(
+        target_user = await self.db.fetchone(
             'SELECT user_id, warns FROM users WHERE username = ?', 
             (target_username,)
         )
-        target_user = await cursor.fetchone()
         
         if not target_user:
             await update.message.reply_text("❌ Пользователь не найден!")
@@ -1143,11 +1233,10 @@ class EconomicBot:
         user_id, current_warns = target_user
         new_warns = current_warns + 1
         
-        await self.db.conn.execute(
+        await self.db.execute_write(
             'UPDATE users SET warns = ? WHERE user_id = ?', 
             (new_warns, user_id)
         )
-        await self.db.conn.commit()
         
         warn_message = (
             f"⚠️ Вам вынесено предупреждение в чате {update.effective_chat.title}.\n"
@@ -1183,12 +1272,12 @@ class EconomicBot:
                 ),
                 until_date=until_date
             )
+            self.muted_until[user_id] = until_date
             
-            await self.db.conn.execute(
+            await self.db.execute_write(
                 'UPDATE users SET warns = 0 WHERE user_id = ?',
                 (user_id,)
             )
-            await self.db.conn.commit()
             
             await update.message.reply_text(
                 f"🔇 Пользователь получил мут на {duration // 3600} часов."
@@ -1216,24 +1305,14 @@ class EconomicBot:
         )
 
     async def stats(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        cursor = await self.db.conn.execute('SELECT COUNT(*) FROM users')
-        total_users = (await cursor.fetchone())[0]
-        
-        cursor = await self.db.conn.execute('SELECT SUM(balance) FROM users')
-        total_coins = (await cursor.fetchone())[0] or 0
-        
-        cursor = await self.db.conn.execute('SELECT COUNT(*) FROM clans')
-        total_clans = (await cursor.fetchone())[0]
-        
-        cursor = await self.db.conn.execute('SELECT COUNT(*) FROM duels WHERE status = "finished"')
-        total_duels = (await cursor.fetchone())[0]
+        totals = await self.economy_stats.totals()
         
         message = (
             f"📊 Статистика бота:\n"
-            f"👥 Всего пользователей: {total_users}\n"
-            f"💰 Всего коинов в системе: {total_coins:,}\n"
-            f"👥 Кланов: {total_clans}\n"
-            f"⚔️ Проведено дуэлей: {total_duels}\n"
+            f"👥 Всего пользователей: {totals['users']}\n"
+            f"💰 Всего коинов в системе: {totals['money_supply']:,}\n"
+            f"👥 Кланов: {totals['clans']}\n"
+            f"⚔️ Проведено дуэлей: {totals['finished_duels']}\n"
         )
         
         await update.message.reply_text(message)
@@ -1299,11 +1378,10 @@ class EconomicBot:
             return
             
         try:
-            await self.db.conn.execute(
+            await self.db.execute_write(
                 'UPDATE users SET name_color = ? WHERE user_id = ?',
                 (color_name, user_id)
             )
-            await self.db.conn.commit()
             
             new_name = f"{self.name_colors[color_name]} {update.effective_user.first_name}"
             try:
@@ -1323,20 +1401,18 @@ class EconomicBot:
     async def analyze_activity(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         user_id = update.effective_user.id
         
-        cursor = await self.db.conn.execute('''
+        user_stats = await self.db.fetchone('''
             SELECT total_message_count, weekly_activity, created_at
             FROM users WHERE user_id = ?
         ''', (user_id,))
         
-        user_stats = await cursor.fetchone()
-        
         if not user_stats:
             await update.message.reply_text("❌ Пользователь не найден!")
             return
             
         total_messages, weekly_activity, created_at = user_stats
         
-        cursor = await self.db.conn.execute('''
+        last_week_activity = await self.db.fetchall('''
             SELECT date, message_count 
             FROM user_activity 
             WHERE user_id = ? 
@@ -1344,8 +1420,6 @@ class EconomicBot:
             LIMIT 7
         ''', (user_id,))
         
-        last_week_activity = await cursor.fetchall()
-        
         dates = []
         counts = []
         for date, count in reversed(last_week_activity):
@@ -1353,20 +1427,18 @@ class EconomicBot:
             counts.append(count)
         
         if counts:
-            plt.figure(figsize=(10, 4))
-            plt.plot(dates, counts, marker='o', linewidth=2, markersize=8)
-            plt.title('Активность за последнюю неделю')
-            plt.xlabel('Дата')
-            plt.ylabel('Сообщений')
-            plt.grid(True, alpha=0.3)
-            
-            buf = io.BytesIO()
-            plt.savefig(buf, format='png', dpi=80, bbox_inches='tight')
-            buf.seek(0)
-            plt.close()
+            chart = LineChart(
+                labels=tuple(dates),
+                values=tuple(counts),
+                title='Активность за последнюю неделю',
+                xlabel='Дата',
+                ylabel='Сообщений',
+                marker_size=8
+            )
             
-            await update.message.reply_photo(
-                photo=buf,
+            await self.charts.reply_chart(
+                update.message,
+                chart,
                 caption=(
                     f"📊 Анализ активности:\n"
                     f"💬 Всего сообщений: {total_messages}\n"
@@ -1384,138 +1456,106 @@ class EconomicBot:
             )
 
     async def weekly_stats(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        cursor = await self.db.conn.execute('''
-            SELECT username, weekly_activity, level 
-            FROM users 
-            WHERE weekly_activity > 0 
-            ORDER BY weekly_activity DESC 
-            LIMIT 10
-        ''')
-        
-        top_users = await cursor.fetchall()
+        top_users = await self.leaderboards.top('weekly', LEADERBOARD_PAGE_SIZE)
         
         if not top_users:
             await update.message.reply_text("📊 На этой неделе еще нет активности!")
             return
             
+        users = await self.users.get_users([user_id for user_id, _ in top_users])
         message = "🏆 Топ активности за неделю:\n\n"
         
-        for i, (username, activity, level) in enumerate(top_users, 1):
-            message += f"{i}. @{username} - {activity} сообщ. (Ур. {level})\n"
+        for i, (user_id, activity) in enumerate(top_users, 1):
+            user = users.get(user_id)
+            if user is not None:
+                message += f"{i}. @{user.username} - {activity} сообщ. (Ур. {user.level})\n"
             
-        cursor = await self.db.conn.execute('SELECT SUM(weekly_activity) FROM users')
-        total_activity = (await cursor.fetchone())[0] or 0
+        total_activity = (await self.db.fetchone('SELECT SUM(weekly_activity) FROM users'))[0] or 0
         
-        cursor = await self.db.conn.execute('SELECT COUNT(*) FROM users WHERE weekly_activity > 0')
-        active_users = (await cursor.fetchone())[0]
+        active_users = await self.leaderboards.size('weekly')
         
         message += f"\n📈 Общая статистика:\n"
         message += f"💬 Всего сообщений: {total_activity}\n"
         message += f"👥 Активных пользователей: {active_users}\n"
         message += f"📊 Средняя активность: {total_activity // active_users if active_users > 0 else 0} сообщ./пользователь"
         
+        own = await self.leaderboards.rank('weekly', update.effective_user.id)
+        if own:
+            message += f"\n📍 Ваше место: {own[0]} из {own[2]}"
+        
         await update.message.reply_text(message)
 
     # ===== НОВЫЕ ФУНКЦИИ МОДЕРАЦИИ =====
 
-    async def auto_moderate(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        """Автоматическая модeration сообщений"""
-        user_id = update.effective_user.id
-        message_text = update.message.text.lower()
-        message_id = update.message.message_id
-        chat_id = update.effective_chat.id
-        
-        # Проверка на спам
-        if await self.detect_spam(user_id, message_text, update):
-            return
-            
-        # Проверка запрещенных слов
-        if await self.check_bad_words(message_text, user_id, update):
-            try:
-                await update.message.delete()
-                await update.message.reply_text(
-                    f"⚠️ Сообщение удалено из-за нарушения правил. "
-                    f"Пользователь {update.effective_user.mention_html()} получил предупреждение.",
-                    parse_mode='HTML'
-                )
-                return
-            except Exception as e:
-                logging.error(f"Ошибка удаления сообщения: {e}")
-
-    async def detect_spam(self, user_id: int, text: str, update: Update) -> bool:
+    async def detect_spam(self, user_id: int, text: str, update: Update,
+                          context: ContextTypes.DEFAULT_TYPE) -> bool:
         """Обнаружение спама"""
-        now = datetime.now()
-        
-        if user_id not in self.spam_detection:
-            self.spam_detection[user_id] = {
-                'messages': [],
-                'warnings': 0
-            }
-        
-        user_data = self.spam_detection[user_id]
-        user_data['messages'].append(now)
-        
-        # Очистка старых сообщений
-        user_data['messages'] = [
-            msg_time for msg_time in user_data['messages']
-            if (now - msg_time).seconds < 60
-        ]
-        
-        # Проверка лимита сообщений
-        if len(user_data['messages']) > 5:  # 5 сообщений в минуту
-            user_data['warnings'] += 1
+        # Окно сообщений и предупреждения общие для всех процессов (Redis)
+        # Проверка лимита сообщений: 5 сообщений в минуту
+        if await self.rate_limiter.hit_window('spam', user_id, 60, 5):
+            warnings = await self.rate_limiter.add_warning('spam', user_id, 3600)
             
-            if user_data['warnings'] >= 3:
-                await self.mute_user(update, update.context, user_id, 300)  # 5 минут
+            if warnings >= 3:
+                await self.mute_user(update, context, user_id, 300)  # 5 минут
                 await update.message.reply_text(
                     f"🔇 Пользователь {update.effective_user.mention_html()} "
                     f"получил мут на 5 минут за спам.",
                     parse_mode='HTML'
                 )
-                user_data['warnings'] = 0
-                user_data['messages'] = []
+                await self.rate_limiter.reset('spam', user_id)
                 return True
             else:
                 await update.message.reply_text(
                     f"⚠️ {update.effective_user.mention_html()}, "
-                    f"прекратите спам! Предупреждение {user_data['warnings']}/3",
+                    f"прекратите спам! Предупреждение {warnings}/3",
                     parse_mode='HTML'
                 )
                 return True
         
         return False
 
-    async def check_bad_words(self, text: str, user_id: int, update: Update) -> bool:
+    async def evict_idle_spam_windows(self):
+        """Очистка окон антиспама неактивных пользователей"""
+        evicted = self.rate_limiter.evict_idle(60)
+        
+        now = datetime.now()
+        for user_id in [user_id for user_id, until in self.muted_until.items() if until <= now]:
+            del self.muted_until[user_id]
+        
+        if evicted:
+            logging.info(f"Удалено неактивных окон антиспама: {evicted}")
+
+    async def check_bad_words(self, text: str, user_id: int, update: Update,
+                              context: ContextTypes.DEFAULT_TYPE) -> bool:
         """Проверка на запрещенные слова"""
-        cursor = await self.db.conn.execute('SELECT word, action FROM word_filters')
-        filters = await cursor.fetchall()
-        
-        for word, action in filters:
-            if word.lower() in text:
-                await self.db.conn.execute('''
-                    INSERT INTO moderation_logs 
-                    (user_id, action, reason, timestamp, message_text)
-                    VALUES (?, ?, ?, ?, ?)
-                ''', (user_id, 'auto_moderate', f'Нарушение фильтра: {word}', 
-                     datetime.now().isoformat(), text))
-                
-                await self.db.conn.execute(
-                    'UPDATE users SET warns = warns + 1 WHERE user_id = ?',
-                    (user_id,)
-                )
-                
-                cursor = await self.db.conn.execute(
-                    'SELECT warns FROM users WHERE user_id = ?',
-                    (user_id,)
-                )
-                warns = (await cursor.fetchone())[0]
-                
-                if warns >= 3:
-                    await self.mute_user(update, update.context, user_id, 1440)  # 24 часа
-                
-                await self.db.conn.commit()
-                return True
-        return False
+        # Все слова ищутся за один проход автоматом, загруженным из word_filters
+        match = self.word_filter.find_first(text)
+        if not match:
+            return False
+        
+        word, action = match
+        
+        async def write_violation(conn):
+            await conn.execute('''
+                INSERT INTO moderation_logs 
+                (user_id, action, reason, timestamp, message_text)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (user_id, 'auto_moderate', f'Нарушение фильтра: {word}', 
+                 datetime.now().isoformat(), text))
+            
+            cursor = await conn.execute(
+                'UPDATE users SET warns = warns + 1 WHERE user_id = ? RETURNING warns',
+                (user_id,)
+            )
+            rows = await cursor.fetchall()
+            return rows[0][0] if rows else 0
+        
+        warns = await self.db.write(write_violation)
+        
+        if warns >= 3:
+            await self.mute_user(update, context, user_id, 1440)  # 24 часа
+        
+        return True
 
     async def report_user(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Система жалоб"""
@@ -1535,11 +1575,10 @@ class EconomicBot:
         target_username = context.args[0].lstrip('@')
         reason = ' '.join(context.args[1:])
         
-        cursor = await self.db.conn.execute(
+        target_user = await self.db.fetchone(
             'SELECT user_id FROM users WHERE username = ?',
             (target_username,)
         )
-        target_user = await cursor.fetchone()
         
         if not target_user:
             await update.message.reply_text("❌ Пользователь не найден!")
@@ -1551,7 +1590,7 @@ class EconomicBot:
         # Сохраняем жалобу с контекстом
         context_message = update.message.reply_to_message.text or "Сообщение с медиа-файлом"
         
-        await self.db.conn.execute('''
+        await self.db.execute_write('''
             INSERT INTO reports 
             (reporter_id, reported_user_id, reason, message_id, chat_id, timestamp)
             VALUES (?, ?, ?, ?, ?, ?)
@@ -1560,8 +1599,6 @@ class EconomicBot:
               update.effective_chat.id,
               datetime.now().isoformat()))
         
-        await self.db.conn.commit()
-        
         # Уведомляем модераторов
         moderators = await self.get_moderators()
         for mod_id in moderators:
@@ -1596,25 +1633,84 @@ class EconomicBot:
         action = context.args[1] if len(context.args) > 1 else 'warn'
         
         try:
-            await self.db.conn.execute('''
+            await self.db.execute_write('''
                 INSERT INTO word_filters (word, action, created_by, created_at)
                 VALUES (?, ?, ?, ?)
             ''', (word, action, update.effective_user.id, datetime.now().isoformat()))
             
-            await self.db.conn.commit()
+            self.word_filter.add(word, action)
             await update.message.reply_text(f"✅ Фильтр для слова '{word}' добавлен!")
             
         except sqlite3.IntegrityError:
             await update.message.reply_text("❌ Это слово уже есть в фильтре!")
 
+    async def remove_word_filter(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Удаление слова из фильтра"""
+        if not await self.is_moderator(update):
+            await update.message.reply_text("❌ Недостаточно прав!")
+            return
+        
+        if not context.args:
+            await update.message.reply_text("❌ Использование: /remove_filter слово")
+            return
+        
+        word = context.args[0].lower()
+        
+        deleted = await self.db.execute_write(
+            'DELETE FROM word_filters WHERE word = ?',
+            (word,)
+        )
+        
+        if deleted == 0:
+            await update.message.reply_text("❌ Этого слова нет в фильтре!")
+            return
+        
+        self.word_filter.remove(word)
+        await update.message.reply_text(f"✅ Фильтр для слова '{word}' удален!")
+
+    async def import_word_filters(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Массовый импорт слов в фильтр из текстового файла (по слову в строке)"""
+        if not await self.is_moderator(update):
+            await update.message.reply_text("❌ Недостаточно прав!")
+            return
+        
+        replied = update.message.reply_to_message
+        if not replied or not replied.document:
+            await update.message.reply_text(
+                "❌ Ответьте командой /import_filters [действие] на текстовый файл со словами"
+            )
+            return
+        
+        action = context.args[0] if context.args else 'warn'
+        
+        file = await replied.document.get_file()
+        content = (await file.download_as_bytearray()).decode('utf-8', errors='ignore')
+        words = {line.strip().lower() for line in content.splitlines() if line.strip()}
+        
+        now = datetime.now().isoformat()
+        await self.db.executemany_write('''
+            INSERT OR IGNORE INTO word_filters (word, action, created_by, created_at)
+            VALUES (?, ?, ?, ?)
+        ''', [(word, action, update.effective_user.id, now) for word in words])
+        
+        added = self.word_filter.bulk_add((word, action) for word in words)
+        
+        await update.message.reply_text(
+            f"✅ Импортировано слов: {added} (всего в фильтре: {len(self.word_filter)})"
+        )
+
+    async def load_word_filters(self):
+        """Загрузка словаря фильтров из БД в автомат"""
+        self.word_filter.load(await self.db.fetchall('SELECT word, action FROM word_filters'))
+        logging.info(f"Загружено слов в фильтр: {len(self.word_filter)}")
+
     async def list_filters(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Список фильтров"""
-        cursor = await self.db.conn.execute('''
+        filters = await self.db.fetchall('''
             SELECT wf.word, wf.action, u.username 
             FROM word_filters wf
             LEFT JOIN users u ON wf.created_by = u.user_id
         ''')
-        filters = await cursor.fetchall()
         
         if not filters:
             await update.message.reply_text("📝 Список фильтров пуст.")
@@ -1688,19 +1784,15 @@ class EconomicBot:
         except Exception as e:
             logging.error(f"Ошибка ограничения прав: {e}")
 
-        # Генерируем капчу
-        captcha_text = self.generate_captcha()
+        # Берём готовую капчу из запаса
+        captcha_text, captcha_image = await self.captcha_pool.take()
         
         # Сохраняем в базу
-        await self.db.conn.execute('''
+        await self.db.execute_write('''
             INSERT OR REPLACE INTO user_verification 
             (user_id, captcha_text, join_time)
             VALUES (?, ?, ?)
         ''', (user.id, captcha_text, datetime.now().isoformat()))
-        await self.db.conn.commit()
-
-        # Создаем изображение капчи
-        captcha_image = await self.generate_captcha_image(captcha_text)
         
         # Отправляем капчу
         keyboard = [[InlineKeyboardButton("🔐 Пройти верификацию", 
@@ -1731,54 +1823,14 @@ class EconomicBot:
                 f"Разрешите ЛС с ботом и напишите /verify"
             )
 
-    async def generate_captcha_image(self, text: str) -> io.BytesIO:
-        """Генерация изображения капчи"""
-        width, height = 200, 80
-        image = Image.new('RGB', (width, height), color=(255, 255, 255))
-        draw = ImageDraw.Draw(image)
-        
-        try:
-            font = ImageFont.truetype("arial.ttf", 36)
-        except:
-            font = ImageFont.load_default()
-        
-        # Добавляем шум
-        for _ in range(100):
-            x, y = random.randint(0, width), random.randint(0, height)
-            draw.point((x, y), fill=(random.randint(0, 255), 
-                                   random.randint(0, 255), 
-                                   random.randint(0, 255)))
-        
-        # Рисуем текст
-        bbox = draw.textbbox((0, 0), text, font=font)
-        text_width = bbox[2] - bbox[0]
-        text_height = bbox[3] - bbox[1]
-        
-        x = (width - text_width) // 2
-        y = (height - text_height) // 2
-        
-        draw.text((x, y), text, font=font, fill=(0, 0, 0))
-        
-        # Сохраняем в буфер
-        buf = io.BytesIO()
-        image.save(buf, format='PNG')
-        buf.seek(0)
-        return buf
-
-    def generate_captcha(self) -> str:
-        """Генерация текста капчи"""
-        characters = string.ascii_letters + string.digits
-        return ''.join(random.choice(characters) for _ in range(6))
-
     async def manual_verify(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Ручная верификация"""
         user_id = update.effective_user.id
         
-        cursor = await self.db.conn.execute('''
+        result = await self.db.fetchone('''
             SELECT captcha_text, attempts FROM user_verification 
             WHERE user_id = ? AND verified = 0
         ''', (user_id,))
-        result = await cursor.fetchone()
         
         if not result:
             await update.message.reply_text("❌ У вас нет активной верификации.")
@@ -1787,8 +1839,11 @@ class EconomicBot:
         captcha_text, attempts = result
         
         if not context.args:
-            # Показываем текущую капчу
-            captcha_image = await self.generate_captcha_image(captcha_text)
+            # Картинка прежней капчи не хранится: выдаём новую из запаса
+            captcha_text, captcha_image = await self.captcha_pool.take()
+            await self.db.execute_write('''
+                UPDATE user_verification SET captcha_text = ? WHERE user_id = ? AND verified = 0
+            ''', (captcha_text, user_id))
             await update.message.reply_photo(
                 photo=captcha_image,
                 caption=f"📝 Введите текст с картинки:\n"
@@ -1801,10 +1856,9 @@ class EconomicBot:
         
         if user_input.upper() == captcha_text.upper():
             # Успешная верификация
-            await self.db.conn.execute('''
+            await self.db.execute_write('''
                 UPDATE user_verification SET verified = 1 WHERE user_id = ?
             ''', (user_id,))
-            await self.db.conn.commit()
             
             # Восстанавливаем права
             try:
@@ -1827,10 +1881,9 @@ class EconomicBot:
         else:
             # Неверная капча
             attempts += 1
-            await self.db.conn.execute('''
+            await self.db.execute_write('''
                 UPDATE user_verification SET attempts = ? WHERE user_id = ?
             ''', (attempts, user_id))
-            await self.db.conn.commit()
             
             if attempts >= 3:
                 # Кик за превышение попыток
@@ -1857,7 +1910,7 @@ class EconomicBot:
         
         search_term = ' '.join(context.args)
         
-        cursor = await self.db.conn.execute('''
+        users = await self.db.fetchall('''
             SELECT user_id, username, level, balance 
             FROM users 
             WHERE username LIKE ? OR user_id = ?
@@ -1870,8 +1923,6 @@ class EconomicBot:
             LIMIT 10
         ''', (f'%{search_term}%', search_term, search_term, f'{search_term}%'))
         
-        users = await cursor.fetchall()
-        
         if not users:
             await update.message.reply_text("❌ Пользователи не найдены.")
             return
@@ -1890,14 +1941,10 @@ class EconomicBot:
             return
         
         # Статистика базы данных
-        cursor = await self.db.conn.execute('SELECT COUNT(*) FROM users')
-        total_users = (await cursor.fetchone())[0]
-        
-        cursor = await self.db.conn.execute('SELECT COUNT(*) FROM clans')
-        total_clans = (await cursor.fetchone())[0]
-        
-        cursor = await self.db.conn.execute('SELECT COUNT(*) FROM duels WHERE status = "finished"')
-        total_duels = (await cursor.fetchone())[0]
+        totals = await self.economy_stats.totals()
+        total_users = totals['users']
+        total_clans = totals['clans']
+        total_duels = totals['finished_duels']
         
         # Использование памяти
         memory_usage = psutil.Process().memory_info().rss / 1024 / 1024
@@ -1912,6 +1959,22 @@ class EconomicBot:
         today_messages = self.message_stats['today']
         total_messages = self.message_stats['total']
         
+        # Очередь наград и кэш пользователей
+        flusher_stats = self.reward_flusher.get_stats()
+        cache_stats = self.user_cache.get_stats()
+        write_stats = self.db.get_write_stats()
+        read_stats = self.db.get_read_stats()
+        spam_entries, spam_bytes = self.rate_limiter.memory_usage()
+        chart_stats = self.charts.get_stats()
+        captcha_stats = self.captcha_pool.get_stats()
+        pipeline_stats = self.message_pipeline.get_stats()
+        maintenance_stats = self.maintenance.get_stats()
+        last_checkpoint = maintenance_stats['last_checkpoint']
+        db_files = ', '.join(
+            f"{schema} {sizes['db'] / 1024 / 1024:.1f}+{sizes['wal'] / 1024 / 1024:.1f}"
+            for schema, sizes in maintenance_stats['files'].items()
+        )
+        
         message = (
             "🤖 Статус бота:\n\n"
             f"⏰ Время работы: {days}д {hours}ч {minutes}м\n"
@@ -1921,9 +1984,38 @@ class EconomicBot:
             f"⚔️ Дуэлей: {total_duels}\n"
             f"💬 Сообщений сегодня: {today_messages}\n"
             f"📊 Всего сообщений: {total_messages}\n"
-            f"📈 Активных чатов: {len(self.application.chat_data or {})}"
+            f"📈 Активных чатов: {len(self.application.chat_data or {})}\n\n"
+            f"📥 Очередь наград: {flusher_stats['queue_depth']}, ждут повтора {flusher_stats['retry_items']}, "
+            f"отброшено {flusher_stats['dropped_items']}\n"
+            f"📦 Пачка: {flusher_stats['last_batch_size']} наград / "
+            f"{flusher_stats['last_batch_users']} польз. (макс. {flusher_stats['max_batch_size']})\n"
+            f"⏱ Задержка записи: {flusher_stats['last_lag']:.2f}с "
+            f"(макс. {flusher_stats['max_lag']:.2f}с), запись {flusher_stats['last_flush_ms']:.1f}мс\n"
+            f"💽 Фиксаций БД: {write_stats['commits']} на {write_stats['units']} записей "
+            f"(группа {write_stats['last_group']}, макс. {write_stats['max_group']}, "
+            f"очередь {write_stats['queue_depth']})\n"
+            f"📖 Читателей БД: {read_stats['readers']}, запросов {read_stats['queries']}, "
+            f"одновременно до {read_stats['max_in_flight']}\n"
+            f"🧹 Файлы БД (база+WAL, MB): {db_files}, "
+            f"checkpoint {last_checkpoint['ms'] if last_checkpoint else 0:.0f}мс "
+            f"(макс. {maintenance_stats['max_checkpoint_ms']:.0f}мс)\n"
+            f"🗂 Кэш пользователей: {cache_stats['size']} записей, "
+            f"попаданий {cache_stats['hit_rate'] * 100:.1f}%\n"
+            f"🛡 Антиспам в памяти: {spam_entries} записей, {spam_bytes / 1024:.1f} KB\n"
+            f"📉 Графики: построено {chart_stats['renders']} "
+            f"({chart_stats['last_render_ms']:.0f}мс, макс. {chart_stats['max_render_ms']:.0f}мс), "
+            f"из кэша {chart_stats['png_hits']}, по file_id {chart_stats['file_id_hits']}\n"
+            f"🔐 Капчи: готово {captcha_stats['ready']}/{captcha_stats['size']}, "
+            f"из запаса {captcha_stats['hit_rate'] * 100:.1f}% ({captcha_stats['misses']} построено по запросу)\n\n"
+            f"⚙️ Стадии обработки сообщений:\n"
         )
         
+        for stage, stats in pipeline_stats.items():
+            message += (
+                f"• {stage}: {stats['avg_ms']:.2f}мс в среднем, "
+                f"макс. {stats['max_ms']:.1f}мс, остановок {stats['stops']}\n"
+            )
+        
         await update.message.reply_text(message)
 
     async def create_backup(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -1939,14 +2031,18 @@ class EconomicBot:
             timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
             backup_file = backup_dir / f"backup_{timestamp}.zip"
             
-            with zipfile.ZipFile(backup_file, 'w') as zipf:
-                # Архивируем базу данных
-                zipf.write('bot_database.db', 'bot_database.db')
+            with tempfile.TemporaryDirectory(dir=backup_dir) as tmp:
+                # Согласованные копии всех файлов базы вместо живых файлов с WAL
+                snapshots = await self.db.backup(Path(tmp))
                 
-                # Архивируем конфигурационные файлы
-                for config_file in ['bad_words.json']:
-                    if Path(config_file).exists():
-                        zipf.write(config_file, config_file)
+                with zipfile.ZipFile(backup_file, 'w', zipfile.ZIP_DEFLATED) as zipf:
+                    for snapshot in snapshots:
+                        zipf.write(snapshot, snapshot.name)
+                    
+                    # Архивируем конфигурационные файлы
+                    for config_file in ['bad_words.json']:
+                        if Path(config_file).exists():
+                            zipf.write(config_file, config_file)
             
             await update.message.reply_document(
                 document=backup_file,
@@ -1963,15 +2059,14 @@ class EconomicBot:
 
     async def get_moderators(self) -> List[int]:
         """Получение списка модераторов"""
-        cursor = await self.db.conn.execute('''
+        moderators = [row[0] for row in await self.db.fetchall('''
             SELECT user_id FROM users 
             WHERE level >= 10 OR user_id IN (
                 SELECT user_id FROM user_inventory ui
                 JOIN shop_items si ON ui.item_id = si.id
                 WHERE si.item_type = 'vip_status' AND ui.is_active = 1
             )
-        ''')
-        moderators = [row[0] for row in await cursor.fetchall()]
+        ''')]
         return moderators
 
     async def update_message_stats(self):
@@ -1986,46 +2081,68 @@ class EconomicBot:
 
     async def daily_stats_report(self):
         """Ежедневный отчет статистики"""
-        cursor = await self.db.conn.execute('''
-            SELECT COUNT(*) FROM users WHERE date(created_at) = date('now')
-        ''')
-        new_users = (await cursor.fetchone())[0]
+        today = datetime.now().date()
+        new_users = (await self.db.fetchone('''
+            SELECT COUNT(*) FROM users WHERE created_at >= ?
+        ''', (today.isoformat(),)))[0]
         
-        cursor = await self.db.conn.execute('SELECT SUM(weekly_activity) FROM users')
-        daily_activity = (await cursor.fetchone())[0] or 0
+        daily_activity = (await self.db.fetchone('SELECT SUM(weekly_activity) FROM users'))[0] or 0
         
         # Сохраняем статистику за день
-        await self.db.conn.execute('''
+        await self.db.execute_write('''
             INSERT OR REPLACE INTO chat_stats (date, message_count, new_users)
-            VALUES (date('now'), ?, ?)
-        ''', (daily_activity, new_users))
-        await self.db.conn.commit()
+            VALUES (?, ?, ?)
+        ''', (today.isoformat(), daily_activity, new_users))
         
         logging.info(f"Daily stats: {new_users} new users, {daily_activity} messages")
 
     async def cleanup_old_data(self):
         """Очистка старых данных"""
-        # Удаляем старые сообщения активности (старше 30 дней)
-        await self.db.conn.execute('''
-            DELETE FROM user_activity 
-            WHERE date < date('now', '-30 days')
-        ''')
+        now = datetime.now()
         
-        # Удаляем старые транзакции (старше 90 дней)
-        await self.db.conn.execute('''
-            DELETE FROM transactions 
-            WHERE date(timestamp) < date('now', '-90 days')
-        ''')
+        async def write_cleanup(conn):
+            # Удаляем старую активность и журналы модерации по срокам хранения
+            await conn.execute('''
+                DELETE FROM user_activity 
+                WHERE date < ?
+            ''', ((now - timedelta(days=self.config.activity_retention_days)).date().isoformat(),))
+            
+            logs_cutoff = now - timedelta(days=self.config.logs_retention_days)
+            await conn.execute(
+                'DELETE FROM moderation_logs WHERE timestamp < ?',
+                (logs_cutoff.isoformat(),)
+            )
+            await conn.execute('DELETE FROM admin_logs WHERE ts < ?', (to_epoch(logs_cutoff),))
+            
+            # Удаляем просроченные предметы
+            await conn.execute('''
+                UPDATE user_inventory 
+                SET is_active = 0 
+                WHERE expires_at < ?
+            ''', (now.isoformat(),))
+            
+            # Дни, с которых все пользователи уже написали позже
+            await conn.execute('DELETE FROM user_last_active WHERE users = 0')
         
-        # Удаляем просроченные предметы
-        await self.db.conn.execute('''
-            UPDATE user_inventory 
-            SET is_active = 0 
-            WHERE expires_at < datetime('now')
-        ''')
+        await self.db.write(write_cleanup)
+        
+        # Старые транзакции переносятся в архив порциями
+        try:
+            await self.archiver.archive_old(now)
+        except Exception as e:
+            logging.error(f"Ошибка архивации транзакций: {e}")
+        
+        # Ночная сверка сводных счётчиков; расхождения пишутся в лог
+        try:
+            await self.economy_stats.verify()
+        except Exception as e:
+            logging.error(f"Ошибка сверки сводной статистики: {e}")
         
-        await self.db.conn.commit()
         logging.info("Old data cleanup completed")
+        
+        # Удалённые строки оставили свободные страницы и большой WAL
+        # в каждом файле; обслуживаются все файлы по очереди
+        await self.maintenance.after_cleanup()
 
     # ===== НОВЫЕ ФУНКЦИИ СЕЗОНОВ =====
 
@@ -2076,6 +2193,10 @@ class EconomicBot:
         for i, (username, xp_earned, coins_earned, rank) in enumerate(top_players, 1):
             message += f"{i}. @{username} - {xp_earned} XP, {coins_earned} коинов\n"
         
+        own = await self.leaderboards.rank(season_board(season.id), update.effective_user.id)
+        if own:
+            message += f"\n📍 Ваше место: {own[0]} из {own[2]}"
+        
         await update.message.reply_text(message, parse_mode='Markdown')
 
     async def season_shop(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -2086,14 +2207,12 @@ class EconomicBot:
             await update.message.reply_text("❌ Сезонный магазин доступен только во время событий!")
             return
         
-        cursor = await self.db.conn.execute('''
+        items = await self.db.fetchall('''
             SELECT id, name, description, price, limited_quantity, sold_count
             FROM seasonal_shop_items 
             WHERE season_type = ?
         ''', (season.type.value,))
         
-        items = await cursor.fetchall()
-        
         if not items:
             await update.message.reply_text("❌ В сезонном магазине пока нет предметов!")
             return
@@ -2144,40 +2263,168 @@ class EconomicBot:
         
         await update.message.reply_text(message, parse_mode='Markdown')
 
-    # ===== ВСПОМОГАТЕЛЬНЫЕ МЕТОДЫ =====
+    async def admin_relevel(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Пересчёт уровней всех пользователей по текущей формуле"""
+        if not await self.is_owner(update):
+            await update.message.reply_text("❌ Недостаточно прав!")
+            return
+        
+        await update.message.reply_text("⏳ Пересчитываю уровни...")
+        
+        started = time.perf_counter()
+        try:
+            scanned, changed = await relevel_all(self.db, self.level_table)
+        except Exception as e:
+            logging.error(f"Ошибка пересчёта уровней: {e}")
+            await update.message.reply_text(f"❌ Ошибка пересчёта уровней: {e}")
+            return
+        elapsed = time.perf_counter() - started
+        
+        self.user_cache.invalidate(*changed)
+        await self.leaderboards.refresh_users(changed)
+        
+        try:
+            await self.admin_system.log_admin_action(
+                update.effective_user.id,
+                'relevel_users',
+                'system',
+                None,
+                None,
+                str(len(changed)),
+                'Пересчёт уровней'
+            )
+        except Exception as e:
+            logging.error(f"Ошибка записи в лог администрации: {e}")
+        
+        await update.message.reply_text(
+            f"✅ Уровни пересчитаны за {elapsed:.1f}с\n"
+            f"👥 Проверено: {scanned:,}\n"
+            f"🔄 Изменено: {len(changed):,}"
+        )
 
-    async def get_user_data(self, user_id: int):
-        cursor = await self.db.conn.execute('''
-            SELECT user_id, username, balance, level, xp, 
-                   last_daily, daily_streak, last_message 
-            FROM users WHERE user_id = ?
-        ''', (user_id,))
-        return await cursor.fetchone()
+    async def admin_leaderboards(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Построение досок лидеров заново по таблицам"""
+        if not await self.is_owner(update):
+            await update.message.reply_text("❌ Недостаточно прав!")
+            return
+        
+        try:
+            season = await self.seasonal_system.get_current_season()
+            sizes = await self.leaderboards.rebuild(season.id if season else None)
+        except Exception as e:
+            logging.error(f"Ошибка перестроения досок лидеров: {e}")
+            await update.message.reply_text(f"❌ Ошибка перестроения досок лидеров: {e}")
+            return
+        
+        message = f"✅ Доски лидеров перестроены за {self.leaderboards.last_rebuild['seconds']:.2f}с\n"
+        message += f"🗄 Хранилище: {'Redis' if self.redis_client else 'память процесса'}\n"
+        for board, size in sizes.items():
+            message += f"📊 {board}: {size:,}\n"
+        
+        await update.message.reply_text(message)
 
-    async def ensure_user_exists(self, user_id: int, username: str):
-        cursor = await self.db.conn.execute(
-            'SELECT 1 FROM users WHERE user_id = ?',
-            (user_id,)
-        )
-        if not await cursor.fetchone():
-            await self.db.conn.execute('''
-                INSERT INTO users (user_id, username, created_at)
-                VALUES (?, ?, ?)
-            ''', (user_id, username, datetime.now().isoformat()))
-            await self.db.conn.commit()
+    async def admin_verify_stats(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Сверка сводной статистики с полным пересчётом; fix - пересчитать"""
+        if not await self.is_owner(update):
+            await update.message.reply_text("❌ Недостаточно прав!")
+            return
+        
+        fix = bool(context.args) and context.args[0].lower() == 'fix'
+        try:
+            started = time.perf_counter()
+            mismatches = await self.economy_stats.verify()
+            if mismatches and fix:
+                await self.economy_stats.repair()
+            elapsed = time.perf_counter() - started
+        except Exception as e:
+            logging.error(f"Ошибка сверки сводной статистики: {e}")
+            await update.message.reply_text(f"❌ Ошибка сверки статистики: {e}")
+            return
+        
+        if not mismatches:
+            await update.message.reply_text(f"✅ Сводная статистика сходится с пересчётом ({elapsed:.2f}с)")
+            return
+        
+        message = f"⚠️ Расхождения сводной статистики ({elapsed:.2f}с):\n"
+        for table, diff in mismatches.items():
+            message += f"\n📊 {table}: {len(diff)}\n"
+            for key, (stored, actual) in list(diff.items())[:5]:
+                message += f"• {key}: {stored} → {actual}\n"
+        message += "\n✅ Счётчики пересчитаны" if fix else "\n💡 /admin_verify_stats fix - пересчитать"
+        await update.message.reply_text(message)
 
-    async def can_receive_message_reward(self, user_id: int) -> bool:
-        cursor = await self.db.conn.execute(
-            'SELECT last_message FROM users WHERE user_id = ?', 
-            (user_id,)
-        )
-        result = await cursor.fetchone()
+    async def admin_archive(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Сводка архива транзакций или архивная история пользователя"""
+        if not await self.is_owner(update):
+            await update.message.reply_text("❌ Недостаточно прав!")
+            return
         
-        if not result or not result[0]:
-            return True
+        if not context.args:
+            stats = self.archiver.get_stats()
+            if not stats['months']:
+                await update.message.reply_text("🗄 Архив транзакций пуст.")
+                return
             
-        last_message = datetime.fromisoformat(result[0])
-        return (datetime.now() - last_message) > timedelta(seconds=60)
+            message = (
+                f"🗄 Архив транзакций: {stats['rows']:,} строк, "
+                f"{stats['bytes'] / 1024 / 1024:.1f} MB\n\n"
+            )
+            for month, rows, size in stats['months']:
+                message += f"• {month}: {rows:,} строк, {size / 1024:.0f} KB\n"
+            await update.message.reply_text(message)
+            return
+        
+        target_username = context.args[0].lstrip('@')
+        limit = min(int(context.args[1]) if len(context.args) > 1 else 30, 100)
+        
+        target_user = await self.db.fetchone(
+            'SELECT user_id FROM users WHERE username = ?',
+            (target_username,)
+        )
+        if not target_user:
+            await update.message.reply_text("❌ Пользователь не найден!")
+            return
+        
+        rows = await self.archiver.user_history(target_user[0], limit)
+        if not rows:
+            await update.message.reply_text(f"🗄 В архиве нет операций @{target_username}.")
+            return
+        
+        message = f"🗄 Архив операций @{target_username}:\n\n"
+        for row in rows:
+            date = datetime.fromisoformat(row['timestamp']).strftime('%d.%m.%Y %H:%M')
+            message += f"{date} | {row['type']} | {row['amount']:+,} | {row['description']}\n"
+        
+        await update.message.reply_text(message)
+
+    # ===== ВСПОМОГАТЕЛЬНЫЕ МЕТОДЫ =====
+
+    async def get_user_data(self, user_id: int) -> Optional[User]:
+        return await self.users.get_user(user_id)
+
+    async def load_user_row(self, user_id: int) -> Optional[Dict[str, Any]]:
+        """Горячие поля пользователя из кэша, при промахе - из БД"""
+        return (await self.users.load_rows([user_id])).get(user_id)
+
+    async def ensure_user_exists(self, user_id: int, username: str) -> Optional[Dict[str, Any]]:
+        row = await self.load_user_row(user_id)
+        if row is not None:
+            return row
+        
+        await self.db.execute_write('''
+            INSERT OR IGNORE INTO users (user_id, username, created_at)
+            VALUES (?, ?, ?)
+        ''', (user_id, username, datetime.now().isoformat()))
+        
+        self.user_cache.invalidate(user_id)
+        await self.leaderboards.refresh_users([user_id])
+        return await self.load_user_row(user_id)
+
+    async def can_receive_message_reward(self, user_id: int) -> bool:
+        # Кулдаун в Redis общий для всех процессов и не требует чтения из БД;
+        # без Redis он хранится в памяти RateLimiter, а не в кэше пользователей,
+        # куда обновления некэшированных пользователей не попадают
+        return await self.rate_limiter.acquire_cooldown('reward', user_id, 60)
 
     def get_current_multiplier(self, current_hour: int) -> float:
         for period, (start, end, multiplier) in self.hourly_multipliers.items():
@@ -2216,13 +2463,12 @@ class EconomicBot:
             return update.effective_user.id == 123456789  # Замените на ваш ID
 
     async def has_active_item(self, user_id: int, item_type: str) -> bool:
-        cursor = await self.db.conn.execute('''
+        return await self.db.fetchone('''
             SELECT 1 FROM user_inventory ui
             JOIN shop_items si ON ui.item_id = si.id
             WHERE ui.user_id = ? AND si.item_type = ? AND ui.is_active = 1
             AND (ui.expires_at IS NULL OR ui.expires_at > ?)
-        ''', (user_id, item_type, datetime.now().isoformat()))
-        return await cursor.fetchone() is not None
+        ''', (user_id, item_type, datetime.now().isoformat())) is not None
 
     async def get_active_boosts(self, user_id: int) -> List[str]:
         boosts = []
@@ -2239,158 +2485,103 @@ class EconomicBot:
             pass
 
     async def get_user_clan(self, user_id: int) -> Optional[str]:
-        cursor = await self.db.conn.execute('''
+        result = await self.db.fetchone('''
             SELECT c.name FROM clans c
             JOIN users u ON u.clan_id = c.id
             WHERE u.user_id = ?
         ''', (user_id,))
-        result = await cursor.fetchone()
         return result[0] if result else None
 
-    async def unlock_achievement(self, user_id: int, achievement_id: str, update: Update):
-        cursor = await self.db.conn.execute('''
-            SELECT 1 FROM achievements 
-            WHERE user_id = ? AND achievement_name = ?
-        ''', (user_id, achievement_id))
-        
-        if await cursor.fetchone():
+    async def unlock_achievement(self, user_id: int, achievement_id: str,
+                                 update: Optional[Update] = None, chat_id: Optional[int] = None):
+        if not await self.achievement_tracker.unlock(user_id, achievement_id):
             return
             
         achievement_data = self.achievements_list[achievement_id]
-        await self.db.conn.execute('''
-            INSERT INTO achievements (user_id, achievement_name, unlocked_at)
-            VALUES (?, ?, ?)
-        ''', (user_id, achievement_id, datetime.now().isoformat()))
-        
-        await self.db.conn.commit()
         
-        await update.message.reply_text(
+        message = (
             f"🎉 Новое достижение разблокировано!\n"
             f"🏆 {achievement_data['name']}\n"
             f"📝 {achievement_data['description']}"
         )
+        if update:
+            await update.message.reply_text(message)
+        elif chat_id is not None:
+            await self.application.bot.send_message(chat_id, message)
 
-    async def check_message_achievements(self, user_id: int, update: Update):
-        cursor = await self.db.conn.execute('''
-            SELECT COUNT(*) FROM transactions 
-            WHERE user_id = ? AND type = 'message'
-        ''', (user_id,))
-        
-        message_count = (await cursor.fetchone())[0]
-        
-        if message_count >= 100:
+    async def check_message_achievements(self, user_id: int, update: Update, user: Dict[str, Any]):
+        if (user.get('total_message_count') or 0) >= 100:
             await self.unlock_achievement(user_id, 'social', update)
 
-    async def check_purchase_achievements(self, user_id: int, update: Update):
-        cursor = await self.db.conn.execute('''
-            SELECT COUNT(*) FROM transactions 
-            WHERE user_id = ? AND type = 'purchase'
-        ''', (user_id,))
-        
-        purchase_count = (await cursor.fetchone())[0]
-        
-        if purchase_count >= 5:
+    async def check_purchase_achievements(self, user_id: int, update: Update, counters: Dict[str, int]):
+        if counters['purchases'] >= 5:
             await self.unlock_achievement(user_id, 'collector', update)
 
-    async def check_duel_achievements(self, user_id: int, update: Update):
-        cursor = await self.db.conn.execute('''
-            SELECT COUNT(*) FROM duels 
-            WHERE winner_id = ? AND status = 'finished'
-        ''', (user_id,))
-        
-        duel_wins = (await cursor.fetchone())[0]
-        
-        if duel_wins >= 5:
+    async def check_duel_achievements(self, user_id: int, update: Update, counters: Dict[str, int]):
+        if counters['duel_wins'] >= 5:
             await self.unlock_achievement(user_id, 'gambler', update)
 
-    async def check_balance_achievements(self, user_id: int, update: Update):
-        cursor = await self.db.conn.execute(
-            'SELECT balance FROM users WHERE user_id = ?',
-            (user_id,)
-        )
-        
-        balance = (await cursor.fetchone())[0]
+    async def check_transfer_achievements(self, user_id: int, update: Update, counters: Dict[str, int]):
+        if counters['transfers'] >= 10:
+            await self.unlock_achievement(user_id, 'trader', update)
         
+        if counters['donated'] >= 5000:
+            await self.unlock_achievement(user_id, 'philanthropist', update)
+
+    async def check_balance_achievements(self, user_id: int, update: Update, balance: int):
         if balance >= 10000:
             await self.unlock_achievement(user_id, 'rich', update)
 
-    async def check_secret_achievements(self, user_id: int, update: Update):
-        cursor = await self.db.conn.execute(
-            'SELECT total_message_count FROM users WHERE user_id = ?',
-            (user_id,)
-        )
-        total_messages = (await cursor.fetchone())[0]
-        
-        if total_messages >= 500:
+    async def check_secret_achievements(self, user_id: int, update: Update, user: Dict[str, Any]):
+        if (user.get('total_message_count') or 0) >= 500:
             await self.unlock_achievement(user_id, 'no_life', update)
         
         current_hour = datetime.now().hour
-        if 4 <= current_hour <= 6:
-            cursor = await self.db.conn.execute(
-                'SELECT last_daily FROM users WHERE user_id = ?',
-                (user_id,)
-            )
-            last_daily = await cursor.fetchone()
-            if last_daily and last_daily[0]:
-                last_daily_time = datetime.fromisoformat(last_daily[0])
-                if last_daily_time.date() == datetime.now().date():
-                    await self.unlock_achievement(user_id, 'early_bird', update)
-        
-        cursor = await self.db.conn.execute('''
-            SELECT SUM(amount) FROM transactions 
-            WHERE user_id = ? AND type = 'transfer_out' AND amount < 0
-        ''', (user_id,))
-        
-        total_donated = abs((await cursor.fetchone())[0] or 0)
-        if total_donated >= 5000:
-            await self.unlock_achievement(user_id, 'philanthropist', update)
+        if 4 <= current_hour <= 6 and user.get('last_daily'):
+            last_daily_time = datetime.fromisoformat(user['last_daily'])
+            if last_daily_time.date() == datetime.now().date():
+                await self.unlock_achievement(user_id, 'early_bird', update)
 
-    async def check_duel_streak(self, user_id: int, update: Update):
-        cursor = await self.db.conn.execute('''
-            SELECT current_streak, best_streak 
-            FROM duel_stats 
-            WHERE user_id = ?
-        ''', (user_id,))
-        
-        result = await cursor.fetchone()
-        if result:
-            current_streak, best_streak = result
-            if current_streak >= 3:
-                await self.unlock_achievement(user_id, 'lucky', update)
+    async def check_duel_streak(self, user_id: int, update: Update, current_streak: int):
+        if current_streak >= 3:
+            await self.unlock_achievement(user_id, 'lucky', update)
 
-    async def update_duel_stats(self, winner_id: int, loser_id: int):
-        cursor = await self.db.conn.execute('''
+    async def update_duel_stats(self, conn, winner_id: int, loser_id: int) -> int:
+        cursor = await conn.execute('''
             INSERT OR IGNORE INTO duel_stats (user_id, wins, losses, current_streak, best_streak)
             VALUES (?, 0, 0, 0, 0)
         ''', (winner_id,))
         
-        await self.db.conn.execute('''
+        cursor = await conn.execute('''
             UPDATE duel_stats 
             SET wins = wins + 1, current_streak = current_streak + 1,
                 best_streak = MAX(best_streak, current_streak + 1)
             WHERE user_id = ?
+            RETURNING current_streak
         ''', (winner_id,))
+        winner_streak = (await cursor.fetchall())[0][0]
         
-        cursor = await self.db.conn.execute('''
+        cursor = await conn.execute('''
             INSERT OR IGNORE INTO duel_stats (user_id, wins, losses, current_streak, best_streak)
             VALUES (?, 0, 0, 0, 0)
         ''', (loser_id,))
         
-        await self.db.conn.execute('''
+        await conn.execute('''
             UPDATE duel_stats 
             SET losses = losses + 1, current_streak = 0
             WHERE user_id = ?
         ''', (loser_id,))
+        
+        return winner_streak
 
     async def deactivate_item(self, user_id: int, item_type: str):
-        await self.db.conn.execute('''
+        await self.db.execute_write('''
             UPDATE user_inventory 
             SET is_active = 0 
             WHERE user_id = ? AND item_id IN (
                 SELECT id FROM shop_items WHERE item_type = ?
             )
         ''', (user_id, item_type))
-        await self.db.conn.commit()
 
     async def button_handler(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         query = update.callback_query
@@ -2426,12 +2617,11 @@ class EconomicBot:
             await self.show_enhancement_items(query)
 
     async def show_temporary_items(self, query):
-        cursor = await self.db.conn.execute('''
+        items = await self.db.fetchall('''
             SELECT id, name, description, price, duration_days 
             FROM shop_items 
             WHERE duration_days > 0
         ''')
-        items = await cursor.fetchall()
         
         message = "🎁 Временные бенефиты:\n\n"
         keyboard = []
@@ -2464,46 +2654,35 @@ class EconomicBot:
             tax = int(amount * tax_rate)
             total_deduction = amount + tax
             
-            cursor = await self.db.conn.execute(
-                'SELECT balance FROM users WHERE user_id = ?', 
-                (from_user_id,)
-            )
-            sender_balance = (await cursor.fetchone())[0]
-            
-            if sender_balance < total_deduction:
-                await query.edit_message_text("❌ Недостаточно средств для перевода!")
-                return
+            async def write_transfer(conn):
+                balances = await self.ledger.transfer(
+                    conn, from_user_id, target_user_id, total_deduction, amount,
+                    'transfer_out', 'transfer_in'
+                )
+                if balances is None:
+                    return None
                 
-            await self.db.conn.execute(
-                'UPDATE users SET balance = balance - ? WHERE user_id = ?',
-                (total_deduction, from_user_id)
-            )
-            await self.db.conn.execute(
-                'UPDATE users SET balance = balance + ? WHERE user_id = ?',
-                (amount, target_user_id)
-            )
-            
-            now = datetime.now().isoformat()
-            await self.db.conn.execute('''
-                INSERT INTO transactions (user_id, amount, type, timestamp, description)
-                VALUES (?, ?, 'transfer_out', ?, ?)
-            ''', (from_user_id, -total_deduction, now, f"Перевод пользователю {target_user_id}"))
+                counters = await self.achievement_tracker.increment(
+                    conn, from_user_id, transfers=1, donated=total_deduction
+                )
+                return balances[0], counters
             
-            await self.db.conn.execute('''
-                INSERT INTO transactions (user_id, amount, type, timestamp, description)
-                VALUES (?, ?, 'transfer_in', ?, ?)
-            ''', (target_user_id, amount, now, f"Перевод от пользователя {from_user_id}"))
+            result = await self.db.write(write_transfer)
+            self.user_cache.invalidate(from_user_id, target_user_id)
+            await self.leaderboards.refresh_users([from_user_id, target_user_id])
             
-            await self.db.conn.commit()
+            if result is None:
+                await query.edit_message_text("❌ Недостаточно средств для перевода!")
+                return
             
-            await self.check_balance_achievements(from_user_id, query)
-            await self.unlock_achievement(from_user_id, 'trader', query)
+            sender_balance, counters = result
+            await self.check_balance_achievements(from_user_id, query, sender_balance)
+            await self.check_transfer_achievements(from_user_id, query, counters)
             
-            cursor = await self.db.conn.execute(
+            target_username = (await self.db.fetchone(
                 'SELECT username FROM users WHERE user_id = ?',
                 (target_user_id,)
-            )
-            target_username = (await cursor.fetchone())[0]
+            ))[0]
             
             await query.edit_message_text(
                 f"✅ Перевод выполнен!\n"
@@ -2525,7 +2704,7 @@ class EconomicBot:
 /shop - Магазин привилегий
 /buy - Купить предмет из магазина
 /inventory - Ваш инвентарь
-/top - Таблица лидеров
+/top [balance|level] [стр.] - Таблица лидеров и ваше место
 /achievements - Ваши достижения
 /profile - Ваш профиль
 /pay - Перевод коинов
@@ -2565,15 +2744,13 @@ class EconomicBot:
         await self.inventory_callback(query, user_id)
 
     async def inventory_callback(self, query, user_id):
-        cursor = await self.db.conn.execute('''
+        items = await self.db.fetchall('''
             SELECT si.name, si.description, ui.purchased_at, ui.expires_at
             FROM user_inventory ui
             JOIN shop_items si ON ui.item_id = si.id
             WHERE ui.user_id = ? AND ui.is_active = 1
         ''', (user_id,))
         
-        items = await cursor.fetchall()
-        
         if not items:
             await query.edit_message_text("📦 Ваш инвентарь пуст!")
             return
@@ -2601,14 +2778,12 @@ class EconomicBot:
             item_id = int(data.split('_')[2])
             user_id = query.from_user.id
             
-            cursor = await self.db.conn.execute('''
+            item = await self.db.fetchone('''
                 SELECT name, description, price, limited_quantity, sold_count
                 FROM seasonal_shop_items 
                 WHERE id = ?
             ''', (item_id,))
             
-            item = await cursor.fetchone()
-            
             if not item:
                 await query.answer("❌ Предмет не найден!", show_alert=True)
                 return
@@ -2620,36 +2795,35 @@ class EconomicBot:
                 await query.answer("❌ Этот предмет закончился!", show_alert=True)
                 return
             
-            # Проверяем баланс
-            cursor = await self.db.conn.execute(
-                'SELECT balance FROM users WHERE user_id = ?',
-                (user_id,)
-            )
-            balance = (await cursor.fetchone())[0]
+            # Совершаем покупку: остаток и баланс проверяются самими UPDATE
+            async def write_seasonal_purchase(conn):
+                cursor = await conn.execute('''
+                    UPDATE seasonal_shop_items 
+                    SET sold_count = sold_count + 1 
+                    WHERE id = ? AND (COALESCE(limited_quantity, 0) = 0 OR sold_count < limited_quantity)
+                ''', (item_id,))
+                if cursor.rowcount == 0:
+                    return 'sold_out'
+                
+                balance = await self.ledger.debit(
+                    conn, user_id, price, 'seasonal_purchase', item_id=item_id
+                )
+                if balance is None:
+                    # Счётчик продаж уже увеличен: откатываем единицу
+                    raise InsufficientFunds(user_id, price)
+                return 'ok'
             
-            if balance < price:
+            try:
+                status = await self.db.write(write_seasonal_purchase)
+            except InsufficientFunds:
                 await query.answer("❌ Недостаточно средств!", show_alert=True)
                 return
+            self.user_cache.invalidate(user_id)
+            await self.leaderboards.refresh_users([user_id])
             
-            # Совершаем покупку
-            await self.db.conn.execute(
-                'UPDATE users SET balance = balance - ? WHERE user_id = ?',
-                (price, user_id)
-            )
-            
-            await self.db.conn.execute('''
-                UPDATE seasonal_shop_items 
-                SET sold_count = sold_count + 1 
-                WHERE id = ?
-            ''', (item_id,))
-            
-            now = datetime.now().isoformat()
-            await self.db.conn.execute('''
-                INSERT INTO transactions (user_id, amount, type, timestamp, description)
-                VALUES (?, ?, 'seasonal_purchase', ?, ?)
-            ''', (user_id, -price, now, f"Сезонная покупка: {name}"))
-            
-            await self.db.conn.commit()
+            if status == 'sold_out':
+                await query.answer("❌ Этот предмет закончился!", show_alert=True)
+                return
             
             await query.answer(f"✅ Вы купили {name}!", show_alert=True)
             await query.edit_message_text(
@@ -2665,15 +2839,32 @@ class EconomicBot:
         user_id = update.effective_user.id
         limit = min(int(context.args[0]) if context.args else 10, 20)
         
-        cursor = await self.db.conn.execute('''
-            SELECT amount, type, timestamp, description 
+        # Описания собираются из кода типа и структурных полей
+        transactions = []
+        for row in await self.db.fetchall(f'''
+            SELECT {history_columns()}
             FROM transactions 
             WHERE user_id = ? 
-            ORDER BY timestamp DESC 
+            ORDER BY ts DESC 
             LIMIT ?
-        ''', (user_id, limit))
+        ''', (user_id, limit)):
+            _, _, amount, trans_type, timestamp, description = render_row(row)
+            transactions.append((amount, trans_type, timestamp, description, False))
         
-        transactions = await cursor.fetchall()
+        # Более старые операции дочитываются из архива
+        if len(transactions) < limit:
+            try:
+                row = await self.db.fetchone('SELECT created_at FROM users WHERE user_id = ?', (user_id,))
+                archived = await self.archiver.user_history(
+                    user_id, limit - len(transactions), row[0] if row else None
+                )
+            except Exception as e:
+                logging.error(f"Ошибка чтения архива транзакций: {e}")
+                archived = []
+            transactions += [
+                (row['amount'], row['type'], row['timestamp'], row['description'], True)
+                for row in archived
+            ]
         
         if not transactions:
             await update.message.reply_text("📊 История транзакций пуста!")
@@ -2683,12 +2874,12 @@ class EconomicBot:
         total_income = 0
         total_expense = 0
         
-        for amount, trans_type, timestamp, description in transactions:
+        for amount, trans_type, timestamp, description, from_archive in transactions:
             date = datetime.fromisoformat(timestamp).strftime('%d.%m.%Y %H:%M')
             icon = "⬆️" if amount > 0 else "⬇️"
             color = "🟢" if amount > 0 else "🔴"
             
-            message += f"{color} {date}\n"
+            message += f"{color} {date}{' 🗄' if from_archive else ''}\n"
             message += f"{icon} {description}: {amount:+,} коинов\n\n"
             
             if amount > 0:
@@ -2714,11 +2905,10 @@ class EconomicBot:
         target_username = context.args[0].lstrip('@')
         reason = ' '.join(context.args[1:]) if len(context.args) > 1 else "Не указана"
         
-        cursor = await self.db.conn.execute(
+        target_user = await self.db.fetchone(
             'SELECT user_id FROM users WHERE username = ?', 
             (target_username,)
         )
-        target_user = await cursor.fetchone()
         
         if not target_user:
             await update.message.reply_text("❌ Пользователь не найден!")
@@ -2732,11 +2922,11 @@ class EconomicBot:
                 user_id=user_id
             )
             
-            await self.db.conn.execute(
+            await self.db.execute_write(
                 'UPDATE users SET is_banned = 1 WHERE user_id = ?',
                 (user_id,)
             )
-            await self.db.conn.commit()
+            self.user_cache.invalidate(user_id)
             
             await update.message.reply_text(
                 f"🔨 Пользователь @{target_username} забанен.\n"
@@ -2763,11 +2953,10 @@ class EconomicBot:
             
         reason = ' '.join(context.args[2:]) if len(context.args) > 2 else "Не указана"
         
-        cursor = await self.db.conn.execute(
+        target_user = await self.db.fetchone(
             'SELECT user_id FROM users WHERE username = ?', 
             (target_username,)
         )
-        target_user = await cursor.fetchone()
         
         if not target_user:
             await update.message.reply_text("❌ Пользователь не найден!")
@@ -2783,34 +2972,41 @@ class EconomicBot:
             await self.show_admin_stats(query)
 
     async def show_admin_stats(self, query):
-        cursor = await self.db.conn.execute('SELECT COUNT(*) FROM users')
-        total_users = (await cursor.fetchone())[0]
-        
-        cursor = await self.db.conn.execute('SELECT SUM(balance) FROM users')
-        total_coins = (await cursor.fetchone())[0] or 0
-        
-        cursor = await self.db.conn.execute('SELECT COUNT(*) FROM clans')
-        total_clans = (await cursor.fetchone())[0]
+        totals = await self.economy_stats.totals()
         
         message = (
             f"👑 Статистика администратора:\n"
-            f"👥 Пользователей: {total_users}\n"
-            f"💰 Всего коинов: {total_coins:,}\n"
-            f"👥 Кланов: {total_clans}\n"
+            f"👥 Пользователей: {totals['users']}\n"
+            f"💰 Всего коинов: {totals['money_supply']:,}\n"
+            f"👥 Кланов: {totals['clans']}\n"
         )
         
         await query.edit_message_text(message)
 
     async def run(self):
         await self.db.connect()
-        await self.db.init_tables(self.db.conn)
+        # Новые файлы доменов переводятся в INCREMENTAL до создания таблиц
+        await self.maintenance.ensure_incremental_vacuum()
+        await apply_migrations(self.db.conn)
+        await self.db.place_tables()
+        self.archiver.load_index()
+        await self.load_word_filters()
         await self.init_redis()
+        season = await self.seasonal_system.get_current_season()
+        await self.leaderboards.rebuild(season.id if season else None)
         await self.init_scheduler()
+        self.db.start_writer()
+        self.reward_flusher.start()
+        self.charts.start()
+        self.captcha_pool.start()
         self.setup_handlers()
         
         await self.application.run_polling()
 
     async def close(self):
+        await self.reward_flusher.stop()
+        self.charts.shutdown()
+        await self.captcha_pool.stop()
         if self.redis_client:
             await self.redis_client.close()
         if self.scheduler:
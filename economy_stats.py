@@ -0,0 +1,149 @@
+"""Сводная статистика экономики из таблиц, которые ведут триггеры."""
+import logging
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from database import to_epoch
+from migrations import (
+    ECONOMY_STATS_COLUMNS, ECONOMY_STATS_RECOMPUTE, LAST_ACTIVE_RECOMPUTE, TRANSACTION_DAILY_RECOMPUTE
+)
+
+
+class EconomyStats:
+    """Чтение, сверка и пересчёт сводных счётчиков (миграция 9).
+
+    Счётчики меняются триггерами в транзакции исходной записи, поэтому
+    чтение — несколько строк независимо от числа пользователей и
+    операций. Активность считается по календарным дням последнего
+    сообщения: "сегодня" — с начала текущих суток.
+    """
+
+    def __init__(self, db, verify_days: int = 30):
+        self.db = db
+        # Глубина сверки дневных итогов: не больше срока хранения транзакций
+        self.verify_days = verify_days
+        self.last_check: Optional[Dict[str, Any]] = None
+
+    async def totals(self) -> Dict[str, Any]:
+        row = await self.db.fetchone(
+            f"SELECT {', '.join(ECONOMY_STATS_COLUMNS)} FROM economy_stats WHERE id = 1"
+        )
+        totals = dict(zip(ECONOMY_STATS_COLUMNS, row or (0,) * len(ECONOMY_STATS_COLUMNS)))
+        totals['avg_balance'] = totals['money_supply'] / totals['users'] if totals['users'] else 0
+        return totals
+
+    @staticmethod
+    def first_day(days: int, now: Optional[datetime] = None) -> datetime:
+        """Начало первого из последних days календарных дней"""
+        today = datetime.combine((now or datetime.now()).date(), datetime.min.time())
+        return today - timedelta(days=days - 1)
+
+    async def active_users(self, days: int = 1) -> int:
+        """Пользователи, писавшие за последние days календарных дней"""
+        row = await self.db.fetchone(
+            'SELECT COALESCE(SUM(users), 0) FROM user_last_active WHERE day >= ?',
+            (self.first_day(days).date().isoformat(),)
+        )
+        return row[0]
+
+    async def transactions_by_type(self, day: Optional[str] = None) -> List[Tuple[int, int, int]]:
+        """(type_code, количество, сумма) операций за день, по умолчанию сегодня"""
+        return await self.db.fetchall('''
+            SELECT type_code, count, amount FROM transaction_daily_stats
+            WHERE day = ?
+            ORDER BY type_code
+        ''', (day or datetime.now().date().isoformat(),))
+
+    async def daily_transactions(self, days: int = 30) -> List[Tuple[str, int]]:
+        """(день, количество операций) за последние days дней"""
+        return await self.db.fetchall('''
+            SELECT day, SUM(count) FROM transaction_daily_stats
+            WHERE day >= ?
+            GROUP BY day
+            ORDER BY day
+        ''', (self.first_day(days).date().isoformat(),))
+
+    async def verify(self, days: Optional[int] = None) -> Dict[str, Any]:
+        """Сверка счётчиков с полным пересчётом.
+
+        Всё читается в одном снимке, поэтому записи во время сверки
+        расхождений не дают. Дневные итоги операций сверяются за
+        последние days дней (по умолчанию verify_days): более старые
+        строки уже ушли в архив.
+        Возвращает словарь расхождений по таблицам (пустой — всё сходится).
+        """
+        start = self.first_day(days or self.verify_days)
+        async with self.db.read() as conn:
+            # Без читателей это соединение писателя: оно может быть уже в транзакции
+            own_snapshot = not conn.in_transaction
+            if own_snapshot:
+                await conn.execute('BEGIN')
+            try:
+                cursor = await conn.execute(
+                    f"SELECT {', '.join(ECONOMY_STATS_COLUMNS)} FROM economy_stats WHERE id = 1"
+                )
+                stored = await cursor.fetchone()
+                cursor = await conn.execute(ECONOMY_STATS_RECOMPUTE)
+                actual = await cursor.fetchone()
+
+                cursor = await conn.execute('SELECT day, users FROM user_last_active WHERE users != 0')
+                stored_active = dict(await cursor.fetchall())
+                cursor = await conn.execute(LAST_ACTIVE_RECOMPUTE)
+                actual_active = dict(await cursor.fetchall())
+
+                cursor = await conn.execute('''
+                    SELECT day, type_code, count, amount FROM transaction_daily_stats WHERE day >= ?
+                ''', (start.date().isoformat(),))
+                stored_daily = {(day, code): (count, amount) for day, code, count, amount in await cursor.fetchall()}
+                cursor = await conn.execute(TRANSACTION_DAILY_RECOMPUTE, (to_epoch(start),))
+                actual_daily = {(day, code): (count, amount) for day, code, count, amount in await cursor.fetchall()}
+                await cursor.close()
+            finally:
+                if own_snapshot:
+                    await conn.execute('COMMIT')
+
+        mismatches = {}
+        stored = dict(zip(ECONOMY_STATS_COLUMNS, stored or (None,) * len(ECONOMY_STATS_COLUMNS)))
+        diff = {
+            column: (stored[column], value)
+            for column, value in zip(ECONOMY_STATS_COLUMNS, actual) if stored[column] != value
+        }
+        if diff:
+            mismatches['economy_stats'] = diff
+        for table, stored_rows, actual_rows in (
+            ('user_last_active', stored_active, actual_active),
+            ('transaction_daily_stats', stored_daily, actual_daily)
+        ):
+            diff = {
+                key: (stored_rows.get(key), actual_rows.get(key))
+                for key in stored_rows.keys() | actual_rows.keys()
+                if stored_rows.get(key) != actual_rows.get(key)
+            }
+            if diff:
+                mismatches[table] = diff
+
+        self.last_check = {'time': datetime.now(), 'mismatches': mismatches}
+        if mismatches:
+            logging.error(f"Сводная статистика расходится с пересчётом: {mismatches}")
+        return mismatches
+
+    async def repair(self, days: Optional[int] = None):
+        """Пересчёт счётчиков с нуля; дневные итоги операций — за days дней"""
+        start = self.first_day(days or self.verify_days)
+
+        async def write_repair(conn):
+            await conn.execute('DELETE FROM economy_stats')
+            await conn.execute(
+                f"INSERT INTO economy_stats (id, {', '.join(ECONOMY_STATS_COLUMNS)}) "
+                f"SELECT 1, * FROM ({ECONOMY_STATS_RECOMPUTE})"
+            )
+            await conn.execute('DELETE FROM user_last_active')
+            await conn.execute(f'INSERT INTO user_last_active (day, users) {LAST_ACTIVE_RECOMPUTE}')
+            await conn.execute('DELETE FROM transaction_daily_stats WHERE day >= ?', (start.date().isoformat(),))
+            await conn.execute(
+                f'INSERT INTO transaction_daily_stats (day, type_code, count, amount) {TRANSACTION_DAILY_RECOMPUTE}',
+                (to_epoch(start),)
+            )
+
+        await self.db.write(write_repair)
+        logging.info("Сводная статистика пересчитана")
@@ -0,0 +1,478 @@
+import logging
+import random
+import time
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+# Ограничение на число параметров в одном запросе SQLite
+SELECT_CHUNK = 500
+# Порция ZADD при полной перезаливке доски в Redis
+REDIS_CHUNK = 1000
+
+# Доски по полям users_hot; доска уровней упорядочена по уровню, затем по
+# опыту, поэтому её счёт — level * LEVEL_SHIFT + xp (точен в double до 2^53)
+LEVEL_SHIFT = 2 ** 32
+USER_BOARDS = ('balance', 'level', 'weekly')
+# На этих досках есть все пользователи; на остальных только с положительным счётом
+DENSE_BOARDS = ('balance', 'level')
+
+SKIPLIST_MAX_LEVEL = 32
+SKIPLIST_P = 0.25
+
+
+def season_board(season_id: int) -> str:
+    return f'season:{season_id}'
+
+
+def level_score(level: int, xp: int) -> int:
+    return (level or 0) * LEVEL_SHIFT + (xp or 0)
+
+
+def user_scores(row: tuple) -> Dict[str, int]:
+    """Счёты пользователя на досках по строке (balance, level, xp, weekly_activity)"""
+    balance, level, xp, weekly_activity = row
+    return {
+        'balance': balance or 0,
+        'level': level_score(level, xp),
+        'weekly': weekly_activity or 0
+    }
+
+
+class _Node:
+    __slots__ = ('key', 'forward', 'span')
+
+    def __init__(self, key, height: int):
+        self.key = key
+        self.forward: List[Optional['_Node']] = [None] * height
+        self.span = [0] * height
+
+
+class SortedIndex:
+    """Отсортированный индекс member -> score на списке с пропусками.
+
+    Как и zskiplist в Redis, каждая ссылка хранит число пропускаемых
+    узлов, поэтому вставка, удаление, место участника и переход к
+    N-му месту выполняются за O(log n). Ключ узла — (-score, member):
+    обход по возрастанию идёт от большего счёта к меньшему, равные
+    счёты упорядочены по member.
+    """
+
+    def __init__(self):
+        self.head = _Node(None, SKIPLIST_MAX_LEVEL)
+        self.level = 1
+        self.length = 0
+        self.scores: Dict[int, int] = {}
+        self._random = random.Random()
+
+    def __len__(self) -> int:
+        return len(self.scores)
+
+    def _random_level(self) -> int:
+        level = 1
+        while level < SKIPLIST_MAX_LEVEL and self._random.random() < SKIPLIST_P:
+            level += 1
+        return level
+
+    def _insert(self, key):
+        update: List[_Node] = [self.head] * SKIPLIST_MAX_LEVEL
+        rank = [0] * SKIPLIST_MAX_LEVEL
+        node = self.head
+        for i in range(self.level - 1, -1, -1):
+            rank[i] = 0 if i == self.level - 1 else rank[i + 1]
+            while node.forward[i] is not None and node.forward[i].key < key:
+                rank[i] += node.span[i]
+                node = node.forward[i]
+            update[i] = node
+
+        height = self._random_level()
+        if height > self.level:
+            for i in range(self.level, height):
+                rank[i] = 0
+                update[i] = self.head
+                self.head.span[i] = self.length
+            self.level = height
+
+        new = _Node(key, height)
+        for i in range(height):
+            new.forward[i] = update[i].forward[i]
+            update[i].forward[i] = new
+            new.span[i] = update[i].span[i] - (rank[0] - rank[i])
+            update[i].span[i] = rank[0] - rank[i] + 1
+
+        for i in range(height, self.level):
+            update[i].span[i] += 1
+        self.length += 1
+
+    def _delete(self, key):
+        update: List[_Node] = [self.head] * SKIPLIST_MAX_LEVEL
+        node = self.head
+        for i in range(self.level - 1, -1, -1):
+            while node.forward[i] is not None and node.forward[i].key < key:
+                node = node.forward[i]
+            update[i] = node
+
+        node = node.forward[0]
+        for i in range(self.level):
+            if update[i].forward[i] is node:
+                update[i].span[i] += node.span[i] - 1
+                update[i].forward[i] = node.forward[i]
+            else:
+                update[i].span[i] -= 1
+
+        while self.level > 1 and self.head.forward[self.level - 1] is None:
+            self.level -= 1
+        self.length -= 1
+
+    @classmethod
+    def from_scores(cls, scores: Dict[int, int]) -> 'SortedIndex':
+        """Построение за один проход по отсортированным ключам вместо n вставок"""
+        index = cls()
+        index.scores = dict(scores)
+        keys = sorted((-score, member) for member, score in index.scores.items())
+        last: List[_Node] = [index.head] * SKIPLIST_MAX_LEVEL
+        last_pos = [0] * SKIPLIST_MAX_LEVEL
+
+        for position, key in enumerate(keys, 1):
+            height = index._random_level()
+            index.level = max(index.level, height)
+            node = _Node(key, height)
+            for i in range(height):
+                last[i].forward[i] = node
+                last[i].span[i] = position - last_pos[i]
+                last[i] = node
+                last_pos[i] = position
+
+        # Спан последней ссылки уровня - число узлов до конца списка
+        index.length = len(keys)
+        for i in range(SKIPLIST_MAX_LEVEL):
+            last[i].span[i] = index.length - last_pos[i]
+        return index
+
+    def set(self, member: int, score: int):
+        old = self.scores.get(member)
+        if old == score:
+            return
+        if old is not None:
+            self._delete((-old, member))
+        self._insert((-score, member))
+        self.scores[member] = score
+
+    def discard(self, member: int):
+        old = self.scores.pop(member, None)
+        if old is not None:
+            self._delete((-old, member))
+
+    def score(self, member: int) -> Optional[int]:
+        return self.scores.get(member)
+
+    def rank(self, member: int) -> Optional[int]:
+        """Место участника с нуля (0 - наибольший счёт)"""
+        score = self.scores.get(member)
+        if score is None:
+            return None
+
+        key = (-score, member)
+        traversed = 0
+        node = self.head
+        for i in range(self.level - 1, -1, -1):
+            while node.forward[i] is not None and node.forward[i].key <= key:
+                traversed += node.span[i]
+                node = node.forward[i]
+            if node.key == key:
+                return traversed - 1
+        return None
+
+    def range(self, offset: int, limit: int) -> List[Tuple[int, int]]:
+        """Участники с местами offset .. offset + limit - 1: [(member, score)]"""
+        result: List[Tuple[int, int]] = []
+        if offset < 0 or offset >= len(self.scores) or limit <= 0:
+            return result
+
+        # Спуск к узлу с местом offset (счёт мест в спанах с единицы)
+        traversed = 0
+        node = self.head
+        for i in range(self.level - 1, -1, -1):
+            while node.forward[i] is not None and traversed + node.span[i] <= offset + 1:
+                traversed += node.span[i]
+                node = node.forward[i]
+            if traversed == offset + 1:
+                break
+
+        while node is not None and len(result) < limit:
+            score, member = node.key
+            result.append((member, -score))
+            node = node.forward[0]
+        return result
+
+
+class Leaderboards:
+    """Доски лидеров: баланс, уровень, недельная активность, опыт сезона.
+
+    Доски держатся в памяти процесса (SortedIndex) и, если Redis
+    доступен, дублируются в ZSET {prefix}:leaderboard:{доска}, общие
+    для всех процессов бота; чтения идут в Redis, а при его
+    недоступности - в память. Если запись в Redis не удалась, после
+    восстановления связи доски перезаливаются из памяти.
+
+    Счёты всегда абсолютные: их читают из базы после записи (в той же
+    единице записи или через читателей), поэтому повтор или
+    перестановка обновлений не накапливает расхождений. rebuild()
+    заново строит все доски по таблицам.
+    """
+
+    def __init__(self, db, redis_client=None, prefix: str = 'bot', retry_interval: float = 30):
+        self.db = db
+        self.prefix = prefix
+        self.retry_interval = retry_interval
+        self.boards: Dict[str, SortedIndex] = {board: SortedIndex() for board in USER_BOARDS}
+        self.last_rebuild: Optional[Dict[str, Any]] = None
+        self._retry_at = 0.0
+        self._dirty = False
+        self.redis = None
+        self.set_redis(redis_client)
+
+    def set_redis(self, redis_client):
+        self.redis = redis_client
+        self._retry_at = 0.0
+
+    def _key(self, board: str) -> str:
+        return f'{self.prefix}:leaderboard:{board}'
+
+    def _redis_ready(self) -> bool:
+        return self.redis is not None and time.monotonic() >= self._retry_at
+
+    def _redis_failed(self, e: Exception):
+        logging.warning(f"Redis недоступен ({e}), доски лидеров читаются из памяти")
+        self._retry_at = time.monotonic() + self.retry_interval
+        self._dirty = True
+
+    def _board(self, board: str) -> SortedIndex:
+        index = self.boards.get(board)
+        if index is None:
+            index = self.boards[board] = SortedIndex()
+        return index
+
+    async def _push_board(self, board: str, index: SortedIndex):
+        """Полная замена ZSET доски: заливка во временный ключ и RENAME"""
+        key = self._key(board)
+        if not len(index):
+            await self.redis.delete(key)
+            return
+
+        tmp_key = f'{key}:rebuild'
+        items = list(index.scores.items())
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.delete(tmp_key)
+            for start in range(0, len(items), REDIS_CHUNK):
+                pipe.zadd(tmp_key, dict(items[start:start + REDIS_CHUNK]))
+            pipe.rename(tmp_key, key)
+            await pipe.execute()
+
+    async def _redis_synced(self) -> bool:
+        """Redis готов и совпадает с памятью (после сбоя доски перезаливаются)"""
+        if not self._redis_ready():
+            return False
+        if not self._dirty:
+            return True
+
+        try:
+            for board, index in list(self.boards.items()):
+                await self._push_board(board, index)
+            self._dirty = False
+            logging.info("Доски лидеров перезалиты в Redis")
+            return True
+        except Exception as e:
+            self._redis_failed(e)
+            return False
+
+    async def apply(self, scores: Dict[str, Dict[int, int]]):
+        """Запись абсолютных счётов {доска: {user_id: счёт}}"""
+        removed: Dict[str, List[int]] = {}
+        for board, board_scores in scores.items():
+            index = self._board(board)
+            for user_id, score in board_scores.items():
+                if score > 0 or board in DENSE_BOARDS:
+                    index.set(user_id, score)
+                else:
+                    index.discard(user_id)
+                    removed.setdefault(board, []).append(user_id)
+
+        if not await self._redis_synced():
+            return
+
+        try:
+            async with self.redis.pipeline(transaction=False) as pipe:
+                for board, board_scores in scores.items():
+                    kept = {
+                        user_id: score for user_id, score in board_scores.items()
+                        if score > 0 or board in DENSE_BOARDS
+                    }
+                    if kept:
+                        pipe.zadd(self._key(board), kept)
+                    if board in removed:
+                        pipe.zrem(self._key(board), *removed[board])
+                await pipe.execute()
+        except Exception as e:
+            self._redis_failed(e)
+
+    async def _read_scores(self, fetchall: Callable[[str, list], Awaitable[List[tuple]]],
+                           user_ids: List[int], season_id: Optional[int]) -> Dict[str, Dict[int, int]]:
+        scores: Dict[str, Dict[int, int]] = {board: {} for board in USER_BOARDS}
+        if season_id is not None:
+            scores[season_board(season_id)] = {}
+
+        for start in range(0, len(user_ids), SELECT_CHUNK):
+            chunk = user_ids[start:start + SELECT_CHUNK]
+            placeholders = ','.join('?' * len(chunk))
+            rows = await fetchall(f'''
+                SELECT user_id, balance, level, xp, weekly_activity
+                FROM users_hot WHERE user_id IN ({placeholders})
+            ''', chunk)
+            for user_id, *row in rows:
+                for board, score in user_scores(row).items():
+                    scores[board][user_id] = score
+
+            if season_id is not None:
+                board_scores = scores[season_board(season_id)]
+                rows = await fetchall(f'''
+                    SELECT user_id, xp_earned FROM user_season_stats
+                    WHERE season_id = ? AND user_id IN ({placeholders})
+                ''', [season_id, *chunk])
+                board_scores.update(dict.fromkeys(chunk, 0))
+                board_scores.update(rows)
+
+        return scores
+
+    async def read_scores(self, conn, user_ids: Iterable[int],
+                          season_id: Optional[int] = None) -> Dict[str, Dict[int, int]]:
+        """Счёты пользователей на соединении единицы записи (после их изменения)"""
+        async def fetchall(sql, params):
+            cursor = await conn.execute(sql, params)
+            return await cursor.fetchall()
+
+        return await self._read_scores(fetchall, list(dict.fromkeys(user_ids)), season_id)
+
+    async def refresh_users(self, user_ids: Iterable[int], season_id: Optional[int] = None):
+        """Перечитать счёты пользователей после записи и обновить доски"""
+        try:
+            scores = await self._read_scores(self.db.fetchall, list(dict.fromkeys(user_ids)), season_id)
+            await self.apply(scores)
+        except Exception as e:
+            logging.error(f"Ошибка обновления досок лидеров: {e}")
+
+    async def clear(self, board: str):
+        """Очистка доски (сброс недельной активности, конец сезона)"""
+        if board in USER_BOARDS:
+            self.boards[board] = SortedIndex()
+        else:
+            self.boards.pop(board, None)
+
+        if await self._redis_synced():
+            try:
+                await self.redis.delete(self._key(board))
+            except Exception as e:
+                self._redis_failed(e)
+
+    def has_board(self, board: str) -> bool:
+        return board in self.boards
+
+    async def top(self, board: str, limit: int = 10, offset: int = 0) -> List[Tuple[int, int]]:
+        """Страница доски от наибольшего счёта: [(user_id, счёт)]"""
+        if await self._redis_synced():
+            try:
+                rows = await self.redis.zrevrange(
+                    self._key(board), offset, offset + limit - 1, withscores=True
+                )
+                return [(int(member), int(score)) for member, score in rows]
+            except Exception as e:
+                self._redis_failed(e)
+
+        index = self.boards.get(board)
+        return index.range(offset, limit) if index else []
+
+    async def rank(self, board: str, user_id: int) -> Optional[Tuple[int, int, int]]:
+        """Место пользователя с единицы, его счёт и размер доски; None, если его нет на доске"""
+        if await self._redis_synced():
+            try:
+                key = self._key(board)
+                async with self.redis.pipeline(transaction=False) as pipe:
+                    pipe.zrevrank(key, user_id)
+                    pipe.zscore(key, user_id)
+                    pipe.zcard(key)
+                    position, score, size = await pipe.execute()
+                if position is None:
+                    return None
+                return position + 1, int(score), size
+            except Exception as e:
+                self._redis_failed(e)
+
+        index = self.boards.get(board)
+        position = index.rank(user_id) if index else None
+        if position is None:
+            return None
+        return position + 1, index.score(user_id), len(index)
+
+    async def size(self, board: str) -> int:
+        if await self._redis_synced():
+            try:
+                return await self.redis.zcard(self._key(board))
+            except Exception as e:
+                self._redis_failed(e)
+
+        index = self.boards.get(board)
+        return len(index) if index else 0
+
+    async def rebuild(self, season_id: Optional[int] = None) -> Dict[str, int]:
+        """Построение всех досок заново по таблицам; возвращает размеры досок.
+
+        Пользователи читаются порциями по user_id через пул читателей,
+        новые доски подменяют старые целиком: в памяти - присваиванием,
+        в Redis - RENAME временного ключа.
+        """
+        started = time.perf_counter()
+        board_scores: Dict[str, Dict[int, int]] = {board: {} for board in USER_BOARDS}
+        last_id = None
+
+        while True:
+            if last_id is None:
+                rows = await self.db.fetchall('''
+                    SELECT user_id, balance, level, xp, weekly_activity
+                    FROM users_hot ORDER BY user_id LIMIT ?
+                ''', (SELECT_CHUNK * 10,))
+            else:
+                rows = await self.db.fetchall('''
+                    SELECT user_id, balance, level, xp, weekly_activity
+                    FROM users_hot WHERE user_id > ? ORDER BY user_id LIMIT ?
+                ''', (last_id, SELECT_CHUNK * 10))
+            if not rows:
+                break
+
+            for user_id, *row in rows:
+                for board, score in user_scores(row).items():
+                    if score > 0 or board in DENSE_BOARDS:
+                        board_scores[board][user_id] = score
+            last_id = rows[-1][0]
+
+        if season_id is not None:
+            board_scores[season_board(season_id)] = dict(await self.db.fetchall('''
+                SELECT user_id, xp_earned FROM user_season_stats
+                WHERE season_id = ? AND xp_earned > 0
+            ''', (season_id,)))
+
+        boards = {board: SortedIndex.from_scores(scores) for board, scores in board_scores.items()}
+        stale = [board for board in self.boards if board not in boards]
+        self.boards = boards
+
+        if self._redis_ready():
+            try:
+                for board, index in boards.items():
+                    await self._push_board(board, index)
+                for board in stale:
+                    await self.redis.delete(self._key(board))
+                self._dirty = False
+            except Exception as e:
+                self._redis_failed(e)
+
+        sizes = {board: len(index) for board, index in boards.items()}
+        self.last_rebuild = {'sizes': sizes, 'seconds': time.perf_counter() - started, 'at': time.time()}
+        logging.info(f"Доски лидеров построены за {self.last_rebuild['seconds']:.2f}с: {sizes}")
+        return sizes
@@ -0,0 +1,189 @@
+from datetime import datetime
+from typing import Iterable, Optional, Tuple
+
+# Коды типов операций в transactions.type_code; 0 — старые строки,
+# описание которых не разобрано при переходе на коды
+TX_CODES = {
+    'other': 0,
+    'daily': 1,
+    'purchase': 2,
+    'transfer_out': 3,
+    'transfer_in': 4,
+    'duel': 5,
+    'clan_creation': 6,
+    'seasonal_purchase': 7,
+    'season_reward': 8,
+    'admin_adjust': 9,
+}
+TX_TYPES = {code: name for name, code in TX_CODES.items()}
+RECORD_CHUNK = 100
+
+# Шаблоны описаний: {counterparty} — второй участник, {item} — название
+# предмета, {note} — короткий параметр операции (день серии, имя клана,
+# место в сезоне, причина корректировки)
+TX_DESCRIPTIONS = {
+    'daily': 'Ежедневный бонус (день {note})',
+    'purchase': 'Покупка: {item}',
+    'transfer_out': 'Перевод пользователю {counterparty}',
+    'transfer_in': 'Перевод от пользователя {counterparty}',
+    'clan_creation': 'Создание клана {note}',
+    'seasonal_purchase': 'Сезонная покупка: {item}',
+    'season_reward': 'Награда за {note} место в сезоне',
+    'admin_adjust': 'Корректировка администратором: {note}',
+}
+
+# Строка операции для показа: (id, user_id, amount, type_code, timestamp,
+# counterparty_id, название предмета, note); alias — псевдоним transactions
+HISTORY_COLUMNS = '''
+    {t}.id, {t}.user_id, {t}.amount, {t}.type_code, {t}.timestamp, {t}.counterparty_id,
+    CASE {t}.type_code
+        WHEN {purchase} THEN (SELECT name FROM shop_items WHERE id = {t}.item_id)
+        WHEN {seasonal} THEN (SELECT name FROM seasonal_shop_items WHERE id = {t}.item_id)
+    END,
+    {t}.note
+'''
+
+
+def history_columns(alias: str = 'transactions') -> str:
+    return HISTORY_COLUMNS.format(
+        t=alias, purchase=TX_CODES['purchase'], seasonal=TX_CODES['seasonal_purchase']
+    )
+
+
+def describe(tx_type: str, amount: int, counterparty_id: Optional[int] = None,
+             item_name: Optional[str] = None, note: Optional[str] = None) -> str:
+    """Текст операции из кода и структурных полей"""
+    if tx_type == 'duel':
+        return "Победа в дуэли" if amount > 0 else "Проигрыш в дуэли"
+    
+    template = TX_DESCRIPTIONS.get(tx_type)
+    if template is None:
+        return note or tx_type
+    return template.format(counterparty=counterparty_id, item=item_name or note or '?', note=note)
+
+
+def render_row(row: tuple) -> Tuple[int, int, int, str, str, str]:
+    """Строка HISTORY_COLUMNS -> (id, user_id, amount, type, timestamp, description)"""
+    tx_id, user_id, amount, type_code, timestamp, counterparty_id, item_name, note = row
+    tx_type = TX_TYPES.get(type_code, 'other')
+    return (tx_id, user_id, amount, tx_type, timestamp,
+            describe(tx_type, amount, counterparty_id, item_name, note))
+
+
+class InsufficientFunds(Exception):
+    """Списание не прошло: на счёте меньше требуемой суммы"""
+
+    def __init__(self, user_id: int, amount: int):
+        super().__init__(f"Недостаточно средств у {user_id} для списания {amount}")
+        self.user_id = user_id
+        self.amount = amount
+
+
+class Ledger:
+    """Движение коинов внутри единиц записи Database.write.
+
+    Проверка баланса делается самим UPDATE (balance >= ?), поэтому
+    между проверкой и списанием нет окна для двойной траты. Методы
+    выполняются в транзакции вызывающей единицы вместе со строками
+    transactions и возвращают новые балансы. Строка transactions хранит
+    код типа и второго участника или предмет; текст описания
+    собирается при показе (describe).
+
+    debit и transfer возвращают None, если средств не хватило, и в
+    этом случае ничего не пишут: единица может просто выйти без
+    отката всей группы. Если до списания единица уже что-то записала,
+    она поднимает InsufficientFunds, чтобы откатить свои изменения.
+    """
+
+    async def debit(self, conn, user_id: int, amount: int, tx_type: str,
+                    item_id: Optional[int] = None, note: Optional[str] = None,
+                    now: Optional[str] = None) -> Optional[int]:
+        cursor = await conn.execute('''
+            UPDATE users_hot SET balance = balance - ?
+            WHERE user_id = ? AND balance >= ?
+            RETURNING balance
+        ''', (amount, user_id, amount))
+        rows = await cursor.fetchall()
+        if not rows:
+            return None
+
+        await self.record(conn, [(user_id, -amount, tx_type, None, item_id, note)], now)
+        return rows[0][0]
+
+    async def credit(self, conn, user_id: int, amount: int, tx_type: str,
+                     item_id: Optional[int] = None, note: Optional[str] = None,
+                     now: Optional[str] = None) -> int:
+        cursor = await conn.execute('''
+            UPDATE users_hot SET balance = balance + ?
+            WHERE user_id = ?
+            RETURNING balance
+        ''', (amount, user_id))
+        rows = await cursor.fetchall()
+        if not rows:
+            raise ValueError(f"Пользователь {user_id} не найден")
+
+        await self.record(conn, [(user_id, amount, tx_type, None, item_id, note)], now)
+        return rows[0][0]
+
+    async def transfer(self, conn, from_id: int, to_id: int, debit_amount: int,
+                       credit_amount: int, out_type: str, in_type: str,
+                       now: Optional[str] = None) -> Optional[Tuple[int, int]]:
+        """Списание с from_id и зачисление to_id одним UPDATE.
+
+        debit_amount может быть больше credit_amount (комиссия сгорает).
+        Каждая сторона записывается с другой как counterparty_id.
+        Возвращает (баланс отправителя, баланс получателя) или None.
+        """
+        cursor = await conn.execute('''
+            UPDATE users_hot
+            SET balance = balance + CASE WHEN user_id = ? THEN -? ELSE ? END
+            WHERE user_id IN (?, ?)
+            AND (SELECT balance FROM users_hot WHERE user_id = ?) >= ?
+            RETURNING user_id, balance
+        ''', (from_id, debit_amount, credit_amount, from_id, to_id, from_id, debit_amount))
+        balances = dict(await cursor.fetchall())
+        if not balances:
+            return None
+        if to_id not in balances or from_id not in balances:
+            # Деньги уже сдвинуты у одной стороны: откатываем единицу
+            raise ValueError(f"Пользователь {to_id if from_id in balances else from_id} не найден")
+
+        await self.record(conn, [
+            (from_id, -debit_amount, out_type, to_id, None, None),
+            (to_id, credit_amount, in_type, from_id, None, None)
+        ], now)
+        return balances[from_id], balances[to_id]
+
+    async def record(self, conn, rows: Iterable[Tuple[int, int, str, Optional[int], Optional[int], Optional[str]]],
+                     now: Optional[str] = None):
+        """Строки transactions одним INSERT: (user_id, amount, type, counterparty_id, item_id, note)"""
+        rows = list(rows)
+        if not rows:
+            return
+
+        now = now or datetime.now().isoformat()
+        # Порции по RECORD_CHUNK строк: 7 параметров на строку
+        for start in range(0, len(rows), RECORD_CHUNK):
+            chunk = rows[start:start + RECORD_CHUNK]
+            await conn.execute(
+                'INSERT INTO transactions (user_id, amount, type_code, timestamp, counterparty_id, item_id, note) VALUES '
+                + ', '.join('(?, ?, ?, ?, ?, ?, ?)' for _ in chunk),
+                [value for user_id, amount, tx_type, counterparty_id, item_id, note in chunk
+                 for value in (user_id, amount, TX_CODES[tx_type], now, counterparty_id, item_id, note)]
+            )
+
+    async def record_select(self, conn, tx_type: str, select_sql: str, params: Iterable = (),
+                            now: Optional[str] = None) -> int:
+        """Строки transactions из запроса одним INSERT ... SELECT; возвращает число строк.
+
+        Запрос возвращает колонки user_id, amount, counterparty_id,
+        item_id, note - для начислений множеству пользователей по
+        таблице без выборки строк в Python.
+        """
+        now = now or datetime.now().isoformat()
+        cursor = await conn.execute(f'''
+            INSERT INTO transactions (user_id, amount, type_code, timestamp, counterparty_id, item_id, note)
+            SELECT src.user_id, src.amount, ?, ?, src.counterparty_id, src.item_id, src.note
+            FROM ({select_sql}) AS src
+        ''', (TX_CODES[tx_type], now, *params))
+        return cursor.rowcount
@@ -0,0 +1,96 @@
+import bisect
+from typing import Callable, List, Tuple
+
+import numpy as np
+
+MAX_LEVEL = 1000
+
+
+def required_xp(level: int) -> int:
+    """Опыт, необходимый для уровня"""
+    return int(100 * (level ** 1.5))
+
+
+class LevelTable:
+    """Предрасчитанная таблица порогов опыта по уровням.
+
+    thresholds[i] — опыт, необходимый для уровня i + 1, поэтому уровень
+    по опыту находится двоичным поиском вместо пошагового цикла.
+    Уровень не опускается ниже первого.
+    """
+
+    def __init__(self, max_level: int = MAX_LEVEL,
+                 formula: Callable[[int], int] = required_xp):
+        self.max_level = max_level
+        self.formula = formula
+        self.thresholds: List[int] = [formula(level) for level in range(1, max_level + 1)]
+        self._array = np.array(self.thresholds, dtype=np.int64)
+
+    def required_xp(self, level: int) -> int:
+        if 1 <= level <= self.max_level:
+            return self.thresholds[level - 1]
+        return self.formula(level)
+
+    def _beyond_table(self, xp: int) -> int:
+        # Опыт выше последнего порога: дошагиваем по формуле
+        level = self.max_level
+        while xp >= self.formula(level + 1):
+            level += 1
+        return level
+
+    def level_for_xp(self, xp: int) -> int:
+        xp = xp or 0
+        level = bisect.bisect_right(self.thresholds, xp)
+        if level >= self.max_level:
+            return self._beyond_table(xp)
+        return max(1, level)
+
+    def levels_for_xp(self, xp: np.ndarray) -> np.ndarray:
+        """Векторный расчёт уровней для массива опыта"""
+        levels = np.maximum(np.searchsorted(self._array, xp, side='right'), 1)
+        for i in np.flatnonzero(levels >= self.max_level):
+            levels[i] = self._beyond_table(int(xp[i]))
+        return levels
+
+
+async def relevel_all(db, table: LevelTable, chunk_size: int = 5000) -> Tuple[int, List[int]]:
+    """Пересчёт уровней всех пользователей порциями.
+
+    Каждая порция читается по user_id и пишется отдельной единицей
+    записи, чтобы не держать блокировку записи на всю таблицу.
+    Возвращает (число проверенных, список изменённых user_id).
+    """
+    scanned = 0
+    changed: List[int] = []
+    last_id = None
+
+    while True:
+        if last_id is None:
+            rows = await db.fetchall(
+                'SELECT user_id, xp, level FROM users_hot ORDER BY user_id LIMIT ?',
+                (chunk_size,)
+            )
+        else:
+            rows = await db.fetchall(
+                'SELECT user_id, xp, level FROM users_hot WHERE user_id > ? ORDER BY user_id LIMIT ?',
+                (last_id, chunk_size)
+            )
+        if not rows:
+            break
+
+        user_ids = np.array([row[0] for row in rows], dtype=np.int64)
+        xp = np.array([row[1] or 0 for row in rows], dtype=np.int64)
+        current = np.array([row[2] or 0 for row in rows], dtype=np.int64)
+
+        levels = table.levels_for_xp(xp)
+        mask = levels != current
+
+        if mask.any():
+            updates = list(zip(levels[mask].tolist(), user_ids[mask].tolist()))
+            await db.executemany_write('UPDATE users_hot SET level = ? WHERE user_id = ?', updates)
+            changed.extend(user_id for _, user_id in updates)
+
+        scanned += len(rows)
+        last_id = rows[-1][0]
+
+    return scanned, changed
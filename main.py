@@ -30,7 +30,13 @@ def run_web_server(port):
 
 async def main():
     config = Config()
-    db = Database()
+    db = Database(
+        group_window=config.write_group_window,
+        max_group=config.write_max_group,
+        readers=config.db_readers,
+        pragmas=config.db_pragmas,
+        domains=config.db_domains
+    )
     
     bot = EconomicBot(config, db)
     
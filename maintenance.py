@@ -0,0 +1,194 @@
+"""Обслуживание файла SQLite: checkpoint WAL, optimize, incremental_vacuum."""
+import asyncio
+import logging
+import os
+import time
+from typing import Any, Dict, List, Optional
+
+
+class MaintenanceManager:
+    """Плановое обслуживание базы.
+
+    Все операции выполняются на соединении писателя через
+    Database.run_exclusive, между группами записи. Освобождение
+    страниц идёт короткими шагами, чтобы запись не стояла долго.
+    Checkpoint и vacuum выполняются для каждого файла (схемы main
+    и подключённых доменов) отдельно.
+    """
+
+    def __init__(self, db, vacuum_step_pages: int = 500, vacuum_max_steps: int = 200):
+        self.db = db
+        self.vacuum_step_pages = vacuum_step_pages
+        self.vacuum_max_steps = vacuum_max_steps
+
+        self.last_checkpoint: Optional[Dict[str, Any]] = None
+        self.last_vacuum: Optional[Dict[str, Any]] = None
+        # Последний checkpoint по каждой схеме
+        self.checkpoints: Dict[str, Dict[str, Any]] = {}
+        self.stats = {
+            'checkpoints': 0,
+            'busy_checkpoints': 0,
+            'max_checkpoint_ms': 0.0,
+            'vacuumed_pages': 0
+        }
+
+    def file_sizes(self, schema: str = 'main') -> Dict[str, int]:
+        """Размеры файла базы и WAL в байтах"""
+        db_path = self.db.file_path(schema)
+        sizes = {}
+        for name, path in (('db', db_path), ('wal', db_path + '-wal')):
+            try:
+                sizes[name] = os.path.getsize(path)
+            except OSError:
+                sizes[name] = 0
+        return sizes
+
+    def all_file_sizes(self) -> Dict[str, Dict[str, int]]:
+        return {schema: self.file_sizes(schema) for schema in self.db.schemas}
+
+    async def ensure_incremental_vacuum(self):
+        """Перевод всех файлов базы в auto_vacuum=INCREMENTAL.
+
+        Режим меняется только полным VACUUM, поэтому это делается один
+        раз при старте, до запуска писателя. Новый пустой файл домена
+        переводится сразу, до создания в нём таблиц.
+        """
+        for schema in self.db.schemas:
+            cursor = await self.db.conn.execute(f'PRAGMA {schema}.auto_vacuum')
+            mode = (await cursor.fetchone())[0]
+            await cursor.close()
+            if mode == 2:
+                continue
+
+            before = self.file_sizes(schema)
+            started = time.perf_counter()
+            await self.db.conn.execute(f'PRAGMA {schema}.auto_vacuum = INCREMENTAL')
+            await self.db.conn.execute(f'VACUUM {schema}')
+            after = self.file_sizes(schema)
+            logging.info(
+                f"{schema}: auto_vacuum=INCREMENTAL за {time.perf_counter() - started:.2f}с, "
+                f"{before['db'] / 1024:.0f} KB -> {after['db'] / 1024:.0f} KB"
+            )
+
+    async def checkpoint(self, mode: str = 'TRUNCATE', schema: str = 'main') -> Dict[str, Any]:
+        """Перенос WAL в файл схемы; в режиме TRUNCATE WAL обнуляется"""
+        async def run(conn):
+            cursor = await conn.execute(f'PRAGMA {schema}.wal_checkpoint({mode})')
+            row = await cursor.fetchone()
+            await cursor.close()
+            return row
+
+        before = self.file_sizes(schema)
+        started = time.perf_counter()
+        busy, log_pages, checkpointed = await self.db.run_exclusive(run)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        after = self.file_sizes(schema)
+
+        self.stats['checkpoints'] += 1
+        if busy:
+            # Читатель держал старый снимок: часть WAL осталась
+            self.stats['busy_checkpoints'] += 1
+        self.stats['max_checkpoint_ms'] = max(self.stats['max_checkpoint_ms'], elapsed_ms)
+
+        self.last_checkpoint = self.checkpoints[schema] = {
+            'schema': schema,
+            'mode': mode,
+            'busy': bool(busy),
+            'log_pages': log_pages,
+            'checkpointed': checkpointed,
+            'ms': elapsed_ms,
+            'before': before,
+            'after': after,
+            'at': time.time()
+        }
+        logging.info(
+            f"Checkpoint {schema} {mode} за {elapsed_ms:.1f}мс: WAL {before['wal'] / 1024:.0f} KB -> "
+            f"{after['wal'] / 1024:.0f} KB, база {after['db'] / 1024:.0f} KB"
+            + (", занят читателями" if busy else "")
+        )
+        return self.last_checkpoint
+
+    async def optimize(self):
+        """Обновление статистики планировщика там, где она устарела"""
+        async def run(conn):
+            await conn.execute('PRAGMA optimize')
+
+        await self.db.run_exclusive(run)
+
+    async def freelist_count(self, schema: str = 'main') -> int:
+        async def run(conn):
+            cursor = await conn.execute(f'PRAGMA {schema}.freelist_count')
+            row = await cursor.fetchone()
+            await cursor.close()
+            return row[0]
+
+        return await self.db.run_exclusive(run)
+
+    async def incremental_vacuum(self, schema: str = 'main') -> int:
+        """Возврат свободных страниц файлу шагами по vacuum_step_pages"""
+        async def step(conn):
+            # execute делает один шаг оператора и освобождает одну страницу;
+            # executescript выполняет его до конца
+            await conn.executescript(f'PRAGMA {schema}.incremental_vacuum({self.vacuum_step_pages})')
+
+        before = self.file_sizes(schema)
+        free_before = await self.freelist_count(schema)
+        started = time.perf_counter()
+
+        free = free_before
+        steps = 0
+        while free and steps < self.vacuum_max_steps:
+            await self.db.run_exclusive(step)
+            steps += 1
+            free = await self.freelist_count(schema)
+            # Между шагами даём пройти накопившимся записям
+            await asyncio.sleep(0)
+
+        freed = free_before - free
+        self.stats['vacuumed_pages'] += freed
+        self.last_vacuum = {
+            'schema': schema,
+            'freed_pages': freed,
+            'left_pages': free,
+            'steps': steps,
+            'ms': (time.perf_counter() - started) * 1000,
+            'before': before,
+            'after': self.file_sizes(schema),
+            'at': time.time()
+        }
+        if freed:
+            logging.info(
+                f"incremental_vacuum {schema}: освобождено {freed} страниц за {steps} шагов, "
+                f"база {before['db'] / 1024:.0f} KB -> {self.last_vacuum['after']['db'] / 1024:.0f} KB"
+            )
+        return freed
+
+    async def after_cleanup(self, schemas: Optional[List[str]] = None):
+        """Обслуживание файлов, где были массово удалены строки"""
+        try:
+            await self.optimize()
+        except Exception as e:
+            logging.error(f"Ошибка PRAGMA optimize: {e}")
+
+        for schema in schemas or self.db.schemas:
+            try:
+                await self.incremental_vacuum(schema)
+                await self.checkpoint('TRUNCATE', schema)
+            except Exception as e:
+                logging.error(f"Ошибка обслуживания БД ({schema}): {e}")
+
+    async def scheduled_checkpoint(self, schema: str = 'main'):
+        try:
+            await self.checkpoint('TRUNCATE', schema)
+        except Exception as e:
+            logging.error(f"Ошибка checkpoint БД ({schema}): {e}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            'sizes': self.file_sizes(),
+            'files': self.all_file_sizes(),
+            'checkpoints': self.checkpoints,
+            'last_checkpoint': self.last_checkpoint,
+            'last_vacuum': self.last_vacuum,
+            **self.stats
+        }
@@ -0,0 +1,79 @@
+import logging
+import time
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+
+@dataclass
+class MessageContext:
+    """Общий контекст сообщения для всех стадий конвейера"""
+    update: Any
+    context: Any
+    user_id: int
+    username: Optional[str]
+    text: str
+    now: datetime
+    user: Optional[Dict[str, Any]] = None
+    stopped_by: Optional[str] = None
+    timings: Dict[str, float] = field(default_factory=dict)
+
+    @property
+    def stopped(self) -> bool:
+        return self.stopped_by is not None
+
+    def stop(self, reason: str):
+        self.stopped_by = reason
+
+
+Stage = Callable[[MessageContext], Awaitable[None]]
+
+
+class MessagePipeline:
+    """Упорядоченные стадии обработки текстового сообщения.
+
+    Стадии выполняются по очереди; стадия может прервать обработку
+    через ctx.stop(), тогда следующие стадии не запускаются.
+    """
+
+    def __init__(self):
+        self.stages: List[Tuple[str, Stage]] = []
+        self.stats: Dict[str, Dict[str, float]] = {}
+
+    def add_stage(self, name: str, stage: Stage):
+        self.stages.append((name, stage))
+        self.stats[name] = {'calls': 0, 'stops': 0, 'total_ms': 0.0, 'max_ms': 0.0}
+
+    async def run(self, ctx: MessageContext) -> MessageContext:
+        for name, stage in self.stages:
+            started = time.perf_counter()
+            try:
+                await stage(ctx)
+            except Exception as e:
+                logging.error(f"Ошибка стадии '{name}' для пользователя {ctx.user_id}: {e}")
+                ctx.stop(name)
+            elapsed_ms = (time.perf_counter() - started) * 1000
+
+            ctx.timings[name] = elapsed_ms
+            stats = self.stats[name]
+            stats['calls'] += 1
+            stats['total_ms'] += elapsed_ms
+            stats['max_ms'] = max(stats['max_ms'], elapsed_ms)
+
+            if ctx.stopped:
+                stats['stops'] += 1
+                break
+
+        return ctx
+
+    def get_stats(self) -> Dict[str, Dict[str, float]]:
+        """Средняя и максимальная длительность стадий"""
+        return {
+            name: {
+                'calls': stats['calls'],
+                'stops': stats['stops'],
+                'avg_ms': stats['total_ms'] / stats['calls'] if stats['calls'] else 0.0,
+                'max_ms': stats['max_ms']
+            }
+            for name, stats in self.stats.items()
+        }
@@ -0,0 +1,995 @@
+"""Версионированные миграции схемы БД.
+
+Каждая миграция выполняется один раз в своей транзакции и
+записывается в schema_version. Новые изменения схемы добавляются
+в конец MIGRATIONS со следующим номером; уже выпущенные миграции
+не редактируются.
+"""
+import logging
+import re
+import sqlite3
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+import aiosqlite
+
+from ledger import TX_CODES
+
+SHOP_ITEMS = [
+    ("🎨 Смена цвета ника", "Изменение цвета ника на 7 дней", 300, "color_change", 7),
+    ("📌 Закреп сообщения", "Возможность закреплять сообщения на 1 час", 150, "pin_message", 1),
+    ("🚀 Буст опыта x1.5", "Увеличение получаемого опыта на 50% на 3 дня", 500, "xp_boost", 3),
+    ("👑 VIP статус", "Особый статус в чате на 30 дней", 1000, "vip_status", 30),
+    ("💰 Банковский счёт", "Ежедневные проценты на баланс", 2000, "bank_account", 0),
+    ("🎭 Анонимность", "Отправка анонимных сообщений на 7 дней", 400, "anonymity", 7)
+]
+
+
+async def base_schema(conn: aiosqlite.Connection):
+    """Основные таблицы бота и товары магазина"""
+    await conn.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            user_id INTEGER PRIMARY KEY,
+            username TEXT,
+            balance INTEGER DEFAULT 0,
+            xp INTEGER DEFAULT 0,
+            level INTEGER DEFAULT 1,
+            last_daily TEXT,
+            daily_streak INTEGER DEFAULT 0,
+            last_message TEXT,
+            warns INTEGER DEFAULT 0,
+            is_banned INTEGER DEFAULT 0,
+            clan_id INTEGER,
+            created_at TEXT,
+            name_color TEXT,
+            total_message_count INTEGER DEFAULT 0,
+            weekly_activity INTEGER DEFAULT 0
+        )
+    ''')
+    
+    await conn.execute('''
+        CREATE TABLE IF NOT EXISTS transactions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            amount INTEGER,
+            type TEXT,
+            timestamp TEXT,
+            description TEXT
+        )
+    ''')
+    
+    await conn.execute('''
+        CREATE TABLE IF NOT EXISTS achievements (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            achievement_name TEXT,
+            unlocked_at TEXT
+        )
+    ''')
+    
+    await conn.execute('''
+        CREATE TABLE IF NOT EXISTS shop_items (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT,
+            description TEXT,
+            price INTEGER,
+            item_type TEXT,
+            duration_days INTEGER
+        )
+    ''')
+    
+    await conn.execute('''
+        CREATE TABLE IF NOT EXISTS user_inventory (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            item_id INTEGER,
+            purchased_at TEXT,
+            expires_at TEXT,
+            is_active INTEGER DEFAULT 1
+        )
+    ''')
+    
+    await conn.execute('''
+        CREATE TABLE IF NOT EXISTS clans (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT UNIQUE,
+            description TEXT,
+            owner_id INTEGER,
+            created_at TEXT,
+            balance INTEGER DEFAULT 0
+        )
+    ''')
+    
+    await conn.execute('''
+        CREATE TABLE IF NOT EXISTS clan_members (
+            clan_id INTEGER,
+            user_id INTEGER,
+            role TEXT DEFAULT 'member',
+            joined_at TEXT,
+            PRIMARY KEY (clan_id, user_id)
+        )
+    ''')
+    
+    await conn.execute('''
+        CREATE TABLE IF NOT EXISTS duels (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            challenger_id INTEGER,
+            challenged_id INTEGER,
+            amount INTEGER,
+            status TEXT DEFAULT 'pending',
+            created_at TEXT,
+            winner_id INTEGER
+        )
+    ''')
+    
+    await conn.execute('''
+        CREATE TABLE IF NOT EXISTS user_activity (
+            user_id INTEGER,
+            date TEXT,
+            message_count INTEGER DEFAULT 0,
+            PRIMARY KEY (user_id, date)
+        )
+    ''')
+    
+    await conn.execute('''
+        CREATE TABLE IF NOT EXISTS duel_stats (
+            user_id INTEGER PRIMARY KEY,
+            wins INTEGER DEFAULT 0,
+            losses INTEGER DEFAULT 0,
+            current_streak INTEGER DEFAULT 0,
+            best_streak INTEGER DEFAULT 0
+        )
+    ''')
+    
+    # Новые таблицы для модерации
+    await conn.execute('''
+        CREATE TABLE IF NOT EXISTS moderation_logs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            moderator_id INTEGER,
+            action TEXT,
+            reason TEXT,
+            duration_minutes INTEGER,
+            timestamp TEXT,
+            message_text TEXT
+        )
+    ''')
+    
+    await conn.execute('''
+        CREATE TABLE IF NOT EXISTS reports (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            reporter_id INTEGER,
+            reported_user_id INTEGER,
+            reason TEXT,
+            message_id INTEGER,
+            chat_id INTEGER,
+            status TEXT DEFAULT 'pending',
+            timestamp TEXT
+        )
+    ''')
+    
+    await conn.execute('''
+        CREATE TABLE IF NOT EXISTS word_filters (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            word TEXT UNIQUE,
+            action TEXT,
+            created_by INTEGER,
+            created_at TEXT
+        )
+    ''')
+    
+    await conn.execute('''
+        CREATE TABLE IF NOT EXISTS user_verification (
+            user_id INTEGER PRIMARY KEY,
+            captcha_text TEXT,
+            attempts INTEGER DEFAULT 0,
+            verified INTEGER DEFAULT 0,
+            join_time TEXT
+        )
+    ''')
+    
+    await conn.execute('''
+        CREATE TABLE IF NOT EXISTS chat_stats (
+            date TEXT PRIMARY KEY,
+            message_count INTEGER DEFAULT 0,
+            user_count INTEGER DEFAULT 0,
+            new_users INTEGER DEFAULT 0
+        )
+    ''')
+    
+    # Без уникального имени INSERT OR IGNORE ничего не отсекал,
+    # поэтому товар добавляется, только если его ещё нет
+    for item in SHOP_ITEMS:
+        await conn.execute('''
+            INSERT INTO shop_items (name, description, price, item_type, duration_days)
+            SELECT ?, ?, ?, ?, ?
+            WHERE NOT EXISTS (SELECT 1 FROM shop_items WHERE name = ?)
+        ''', (*item, item[0]))
+
+
+async def seasonal_schema(conn: aiosqlite.Connection):
+    """Таблицы сезонов"""
+    await conn.execute('''
+        CREATE TABLE IF NOT EXISTS seasons (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT,
+            type TEXT,
+            start_date TEXT,
+            end_date TEXT,
+            xp_multiplier REAL DEFAULT 1.0,
+            coin_multiplier REAL DEFAULT 1.0,
+            special_items TEXT,
+            is_active INTEGER DEFAULT 0,
+            created_at TEXT
+        )
+    ''')
+    
+    await conn.execute('''
+        CREATE TABLE IF NOT EXISTS user_season_stats (
+            user_id INTEGER,
+            season_id INTEGER,
+            xp_earned INTEGER DEFAULT 0,
+            coins_earned INTEGER DEFAULT 0,
+            messages_sent INTEGER DEFAULT 0,
+            achievements_unlocked INTEGER DEFAULT 0,
+            final_rank INTEGER,
+            rewards_claimed INTEGER DEFAULT 0,
+            PRIMARY KEY (user_id, season_id)
+        )
+    ''')
+    
+    await conn.execute('''
+        CREATE TABLE IF NOT EXISTS season_leaderboard (
+            season_id INTEGER,
+            user_id INTEGER,
+            total_xp INTEGER DEFAULT 0,
+            rank INTEGER,
+            PRIMARY KEY (season_id, user_id)
+        )
+    ''')
+    
+    await conn.execute('''
+        CREATE TABLE IF NOT EXISTS seasonal_shop_items (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            season_type TEXT,
+            name TEXT,
+            description TEXT,
+            price INTEGER,
+            item_type TEXT,
+            duration_days INTEGER,
+            limited_quantity INTEGER,
+            sold_count INTEGER DEFAULT 0
+        )
+    ''')
+
+
+async def admin_schema(conn: aiosqlite.Connection):
+    """Таблицы администрирования и настройки экономики по умолчанию"""
+    await conn.execute('''
+        CREATE TABLE IF NOT EXISTS admin_logs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            admin_id INTEGER,
+            action TEXT,
+            target_type TEXT,
+            target_id INTEGER,
+            old_value TEXT,
+            new_value TEXT,
+            timestamp TEXT,
+            reason TEXT
+        )
+    ''')
+    
+    await conn.execute('''
+        CREATE TABLE IF NOT EXISTS system_settings (
+            key TEXT PRIMARY KEY,
+            value TEXT,
+            description TEXT,
+            updated_by INTEGER,
+            updated_at TEXT
+        )
+    ''')
+    
+    await conn.execute('''
+        CREATE TABLE IF NOT EXISTS economy_settings (
+            parameter TEXT PRIMARY KEY,
+            value REAL,
+            min_value REAL,
+            max_value REAL,
+            description TEXT
+        )
+    ''')
+    
+    # Инициализация настроек экономики
+    default_settings = [
+        ('daily_base_reward', 50, 10, 200, 'Базовая награда за ежедневный бонус'),
+        ('daily_streak_bonus', 10, 5, 50, 'Бонус за серию ежедневных бонусов'),
+        ('message_min_reward', 1, 0, 5, 'Минимальная награда за сообщение'),
+        ('message_max_reward', 3, 1, 10, 'Максимальная награда за сообщение'),
+        ('xp_per_message', 1, 0, 5, 'Опыт за сообщение'),
+        ('tax_rate_small', 0.1, 0, 0.3, 'Налог на мелкие переводы'),
+        ('tax_rate_large', 0.15, 0.1, 0.5, 'Налог на крупные переводы'),
+        ('duel_tax', 0.05, 0, 0.2, 'Налог на дуэли'),
+        ('clan_creation_cost', 1000, 500, 5000, 'Стоимость создания клана')
+    ]
+    
+    for setting in default_settings:
+        await conn.execute('''
+            INSERT OR IGNORE INTO economy_settings 
+            (parameter, value, min_value, max_value, description)
+            VALUES (?, ?, ?, ?, ?)
+        ''', setting)
+
+
+async def unique_constraints(conn: aiosqlite.Connection):
+    """Удаление накопившихся дублей и уникальные индексы против новых"""
+    # Достижение могло записаться дважды при параллельной проверке
+    await conn.execute('''
+        DELETE FROM achievements
+        WHERE id NOT IN (
+            SELECT MIN(id) FROM achievements GROUP BY user_id, achievement_name
+        )
+    ''')
+    await conn.execute('''
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_achievements_user_name
+        ON achievements (user_id, achievement_name)
+    ''')
+    
+    # Товары магазина дублировались при каждом запуске. Покупки
+    # переносятся на первый экземпляр товара с тем же именем
+    await conn.execute('''
+        UPDATE user_inventory
+        SET item_id = (
+            SELECT MIN(keep.id) FROM shop_items keep
+            JOIN shop_items dup ON dup.name = keep.name
+            WHERE dup.id = user_inventory.item_id
+        )
+        WHERE item_id IN (
+            SELECT id FROM shop_items
+            WHERE id NOT IN (SELECT MIN(id) FROM shop_items GROUP BY name)
+        )
+    ''')
+    await conn.execute('''
+        DELETE FROM shop_items
+        WHERE id NOT IN (SELECT MIN(id) FROM shop_items GROUP BY name)
+    ''')
+    await conn.execute('''
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_shop_items_name
+        ON shop_items (name)
+    ''')
+    
+    # Сезонные товары дублировались при каждой активации сезона;
+    # продажи дублей суммируются в оставшийся товар
+    await conn.execute('''
+        UPDATE seasonal_shop_items
+        SET sold_count = (
+            SELECT SUM(dup.sold_count) FROM seasonal_shop_items dup
+            WHERE dup.season_type = seasonal_shop_items.season_type
+            AND dup.name = seasonal_shop_items.name
+        )
+        WHERE id IN (SELECT MIN(id) FROM seasonal_shop_items GROUP BY season_type, name)
+    ''')
+    await conn.execute('''
+        DELETE FROM seasonal_shop_items
+        WHERE id NOT IN (SELECT MIN(id) FROM seasonal_shop_items GROUP BY season_type, name)
+    ''')
+    await conn.execute('''
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_seasonal_shop_items_name
+        ON seasonal_shop_items (season_type, name)
+    ''')
+
+
+async def hot_path_indexes(conn: aiosqlite.Connection):
+    """Индексы под частые запросы обработчиков"""
+    indexes = [
+        # /pay, /duel, /warn, /ban, /report, /admin_edit ищут по имени
+        'CREATE INDEX IF NOT EXISTS idx_users_username ON users (username)',
+        # История операций пользователя по времени
+        'CREATE INDEX IF NOT EXISTS idx_transactions_user_time ON transactions (user_id, timestamp)',
+        # Последний входящий вызов на дуэль
+        'CREATE INDEX IF NOT EXISTS idx_duels_challenged ON duels (challenged_id, status, created_at)',
+        # Активные предметы пользователя
+        'CREATE INDEX IF NOT EXISTS idx_inventory_user_active ON user_inventory (user_id, is_active)',
+        # Таблица лидеров сезона
+        'CREATE INDEX IF NOT EXISTS idx_season_stats_xp ON user_season_stats (season_id, xp_earned)',
+    ]
+    for sql in indexes:
+        await conn.execute(sql)
+
+
+# Целочисленные эпохи: (таблица, столбец, исходный столбец ISO-времени)
+EPOCH_COLUMNS = [
+    ('transactions', 'ts', 'timestamp'),
+    ('admin_logs', 'ts', 'timestamp'),
+    ('seasons', 'start_ts', 'start_date'),
+    ('seasons', 'end_ts', 'end_date'),
+]
+
+
+def epoch_column_sql(table: str, column: str, source: str) -> str:
+    return (
+        f"ALTER TABLE {table} ADD COLUMN {column} INTEGER "
+        f"GENERATED ALWAYS AS (CAST(strftime('%s', {source}) AS INTEGER)) VIRTUAL"
+    )
+
+
+async def epoch_timestamps(conn: aiosqlite.Connection):
+    """Эпохи для запросов по диапазону времени.
+
+    Столбцы вычисляемые: старые строки и все места записи получают
+    значение без изменений, а индекс хранит готовые числа, так что
+    условия вида ts > ? идут поиском по индексу вместо вызова
+    date()/datetime() на каждой строке.
+    """
+    for table, column, source in EPOCH_COLUMNS:
+        await conn.execute(epoch_column_sql(table, column, source))
+    
+    await conn.execute('DROP INDEX IF EXISTS idx_transactions_user_time')
+    await conn.execute('CREATE INDEX IF NOT EXISTS idx_transactions_user_ts ON transactions (user_id, ts)')
+    await conn.execute('CREATE INDEX IF NOT EXISTS idx_transactions_ts ON transactions (ts)')
+    await conn.execute('CREATE INDEX IF NOT EXISTS idx_admin_logs_ts ON admin_logs (ts)')
+
+
+# Поля, меняющиеся с каждым сообщением, и их значения по умолчанию
+HOT_USER_COLUMNS = [
+    ('balance', 0), ('xp', 0), ('level', 1), ('last_message', None),
+    ('total_message_count', 0), ('weekly_activity', 0)
+]
+COLD_USER_COLUMNS = [
+    ('username', None), ('last_daily', None), ('daily_streak', 0), ('warns', 0),
+    ('is_banned', 0), ('clan_id', None), ('created_at', None), ('name_color', None)
+]
+# Порядок столбцов прежней таблицы users, его сохраняет представление
+USER_COLUMNS = [
+    'user_id', 'username', 'balance', 'xp', 'level', 'last_daily', 'daily_streak',
+    'last_message', 'warns', 'is_banned', 'clan_id', 'created_at', 'name_color',
+    'total_message_count', 'weekly_activity'
+]
+
+
+def _default(column: str, default) -> str:
+    return f'NEW.{column}' if default is None else f'COALESCE(NEW.{column}, {default})'
+
+
+async def users_hot_split(conn: aiosqlite.Connection):
+    """Разделение users на горячую и холодную части.
+
+    Награда за сообщение меняет только users_hot: узкие строки
+    WITHOUT ROWID по user_id, так что запись затрагивает меньше
+    страниц. Имя, даты, цвет и прочее редко меняющееся лежат в
+    users_cold. Представление users с прежним порядком столбцов и
+    INSTEAD OF триггерами оставляет остальные запросы как есть.
+    Для представления rowcount всегда 0, поэтому код, которому он
+    нужен, и горячие пути пишут в таблицы напрямую.
+    """
+    hot = [name for name, _ in HOT_USER_COLUMNS]
+    cold = [name for name, _ in COLD_USER_COLUMNS]
+    
+    await conn.execute('''
+        CREATE TABLE users_hot (
+            user_id INTEGER PRIMARY KEY,
+            balance INTEGER DEFAULT 0,
+            xp INTEGER DEFAULT 0,
+            level INTEGER DEFAULT 1,
+            last_message TEXT,
+            total_message_count INTEGER DEFAULT 0,
+            weekly_activity INTEGER DEFAULT 0
+        ) WITHOUT ROWID
+    ''')
+    
+    await conn.execute('''
+        CREATE TABLE users_cold (
+            user_id INTEGER PRIMARY KEY,
+            username TEXT,
+            last_daily TEXT,
+            daily_streak INTEGER DEFAULT 0,
+            warns INTEGER DEFAULT 0,
+            is_banned INTEGER DEFAULT 0,
+            clan_id INTEGER,
+            created_at TEXT,
+            name_color TEXT
+        )
+    ''')
+    
+    await conn.execute(
+        f"INSERT INTO users_hot (user_id, {', '.join(hot)}) "
+        f"SELECT user_id, {', '.join(hot)} FROM users"
+    )
+    await conn.execute(
+        f"INSERT INTO users_cold (user_id, {', '.join(cold)}) "
+        f"SELECT user_id, {', '.join(cold)} FROM users"
+    )
+    await conn.execute('DROP TABLE users')
+    
+    columns = [
+        f'h.{name}' if name in hot else f'c.{name}'
+        for name in USER_COLUMNS
+    ]
+    await conn.execute(f'''
+        CREATE VIEW users AS
+        SELECT {', '.join(columns)}
+        FROM users_cold c
+        JOIN users_hot h ON h.user_id = c.user_id
+    ''')
+    
+    # OR IGNORE/OR REPLACE внешнего INSERT применяется и к этим вставкам
+    await conn.execute(f'''
+        CREATE TRIGGER users_insert INSTEAD OF INSERT ON users
+        BEGIN
+            INSERT INTO users_cold (user_id, {', '.join(cold)})
+            VALUES (NEW.user_id, {', '.join(_default(name, default) for name, default in COLD_USER_COLUMNS)});
+            INSERT INTO users_hot (user_id, {', '.join(hot)})
+            VALUES (NEW.user_id, {', '.join(_default(name, default) for name, default in HOT_USER_COLUMNS)});
+        END
+    ''')
+    
+    # Отдельные триггеры: UPDATE только горячих полей не трогает users_cold
+    for table, names in (('users_hot', hot), ('users_cold', cold)):
+        await conn.execute(f'''
+            CREATE TRIGGER {table}_update INSTEAD OF UPDATE OF {', '.join(names)} ON users
+            BEGIN
+                UPDATE {table}
+                SET {', '.join(f'{name} = NEW.{name}' for name in names)}
+                WHERE user_id = OLD.user_id;
+            END
+        ''')
+    
+    await conn.execute('''
+        CREATE TRIGGER users_delete INSTEAD OF DELETE ON users
+        BEGIN
+            DELETE FROM users_hot WHERE user_id = OLD.user_id;
+            DELETE FROM users_cold WHERE user_id = OLD.user_id;
+        END
+    ''')
+    
+    # Индекс по имени пропал вместе с таблицей users
+    await conn.execute('CREATE INDEX IF NOT EXISTS idx_users_username ON users_cold (username)')
+
+
+# Разбор прежних текстовых описаний: тип -> (шаблон, куда идёт значение)
+LEGACY_DESCRIPTIONS = {
+    'daily': (re.compile(r'Ежедневный бонус \(день (\d+)\)'), 'note'),
+    'purchase': (re.compile(r'Покупка: (.+)'), 'shop_items'),
+    'transfer_out': (re.compile(r'Перевод пользователю (\d+)'), 'counterparty'),
+    'transfer_in': (re.compile(r'Перевод от пользователя (\d+)'), 'counterparty'),
+    'duel': (re.compile(r'(?:Победа|Проигрыш) в дуэли'), None),
+    'clan_creation': (re.compile(r'Создание клана (.+)'), 'note'),
+    'seasonal_purchase': (re.compile(r'Сезонная покупка: (.+)'), 'seasonal_shop_items'),
+}
+COMPACT_CHUNK = 20000
+
+
+def parse_legacy_description(tx_type: str, description: Optional[str],
+                             items: Dict[str, Dict[str, int]]) -> Optional[tuple]:
+    """(counterparty_id, item_id, note) из прежнего описания или None"""
+    if tx_type not in LEGACY_DESCRIPTIONS:
+        return None
+    pattern, target = LEGACY_DESCRIPTIONS[tx_type]
+    match = pattern.fullmatch(description or '')
+    if not match:
+        return None
+    
+    if target is None:
+        return None, None, None
+    value = match.group(1)
+    if target == 'counterparty':
+        return int(value), None, None
+    if target == 'note':
+        return None, None, value
+    
+    # Предмет, которого уже нет в магазине, остаётся названием в note
+    item_id = items[target].get(value)
+    return None, item_id, None if item_id else value
+
+
+async def table_bytes(conn: aiosqlite.Connection, table: str) -> Optional[int]:
+    """Размер таблицы вместе с индексами по dbstat; None, если dbstat не собран"""
+    try:
+        cursor = await conn.execute('''
+            SELECT SUM(pgsize) FROM dbstat
+            WHERE name IN (SELECT name FROM sqlite_master WHERE tbl_name = ?)
+        ''', (table,))
+    except sqlite3.OperationalError:
+        return None
+    row = await cursor.fetchone()
+    await cursor.close()
+    return row[0] or 0
+
+
+async def compact_transactions(conn: aiosqlite.Connection):
+    """Компактные строки transactions.
+
+    Текстовые type и description заменяются кодом типа (ledger.TX_CODES)
+    и структурными полями: второй участник, id предмета и короткий
+    параметр в note. Описание собирается при показе.
+    
+    Миграция фиксирует себя сама (STEPWISE_MIGRATIONS): строки
+    переписываются в новую таблицу порциями по id, каждая порция в
+    своей транзакции, так что запись не блокируется на всё время
+    переноса. Прогресс - последний перенесённый id в transactions_compact,
+    после сбоя перенос продолжается с него. Последняя проверка порции,
+    удаление старой таблицы и индексы выполняются в транзакции, которую
+    фиксирует apply_migrations вместе с номером версии.
+    """
+    before = await table_bytes(conn, 'transactions')
+    
+    await conn.execute('BEGIN IMMEDIATE')
+    await conn.execute('''
+        CREATE TABLE IF NOT EXISTS transactions_compact (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            amount INTEGER,
+            type_code INTEGER NOT NULL,
+            timestamp TEXT,
+            counterparty_id INTEGER,
+            item_id INTEGER,
+            note TEXT
+        )
+    ''')
+    
+    items = {}
+    for table in ('shop_items', 'seasonal_shop_items'):
+        cursor = await conn.execute(f'SELECT name, MIN(id) FROM {table} GROUP BY name')
+        items[table] = dict(await cursor.fetchall())
+    
+    cursor = await conn.execute('SELECT COALESCE(MAX(id), 0), COUNT(*) FROM transactions_compact')
+    last_id, resumed = await cursor.fetchone()
+    await conn.commit()
+    if resumed:
+        logging.info(f"transactions: продолжение переноса после id {last_id}, уже перенесено {resumed}")
+    
+    total = resumed
+    unparsed = 0
+    while True:
+        # Пустая выборка оставляет транзакцию открытой для завершающего шага
+        await conn.execute('BEGIN IMMEDIATE')
+        cursor = await conn.execute('''
+            SELECT id, user_id, amount, type, timestamp, description FROM transactions
+            WHERE id > ? ORDER BY id LIMIT ?
+        ''', (last_id, COMPACT_CHUNK))
+        rows = await cursor.fetchall()
+        if not rows:
+            break
+        
+        compact = []
+        for tx_id, user_id, amount, tx_type, timestamp, description in rows:
+            fields = parse_legacy_description(tx_type, description, items)
+            if fields is None:
+                # Неизвестный формат: текст сохраняется как есть
+                unparsed += 1
+                compact.append((tx_id, user_id, amount, TX_CODES['other'], timestamp, None, None, description))
+            else:
+                compact.append((tx_id, user_id, amount, TX_CODES[tx_type], timestamp) + fields)
+        
+        await conn.executemany('''
+            INSERT INTO transactions_compact
+            (id, user_id, amount, type_code, timestamp, counterparty_id, item_id, note)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', compact)
+        await conn.commit()
+        last_id = rows[-1][0]
+        total += len(rows)
+    
+    # Счётчик AUTOINCREMENT не должен откатиться к id, уже ушедшим в архив
+    cursor = await conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'transactions'")
+    row = await cursor.fetchone()
+    
+    await conn.execute('DROP TABLE transactions')
+    await conn.execute('ALTER TABLE transactions_compact RENAME TO transactions')
+    if row:
+        await conn.execute("DELETE FROM sqlite_sequence WHERE name = 'transactions'")
+        await conn.execute(
+            "INSERT INTO sqlite_sequence (name, seq) VALUES ('transactions', ?)",
+            (max(row[0], last_id),)
+        )
+    
+    await conn.execute(epoch_column_sql('transactions', 'ts', 'timestamp'))
+    await conn.execute('CREATE INDEX idx_transactions_user_ts ON transactions (user_id, ts)')
+    await conn.execute('CREATE INDEX idx_transactions_ts ON transactions (ts)')
+    
+    after = await table_bytes(conn, 'transactions')
+    if before is not None and after is not None:
+        logging.info(
+            f"transactions: {total} строк переписано, не разобрано {unparsed}; "
+            f"{before / 1024:.0f} KB -> {after / 1024:.0f} KB с индексами"
+            + (f", {before / total:.0f} -> {after / total:.0f} байт на строку" if total else "")
+        )
+    else:
+        logging.info(f"transactions: {total} строк переписано, не разобрано {unparsed}")
+
+
+async def achievement_counters(conn: aiosqlite.Connection):
+    """Счётчики событий для достижений, заполненные из истории.
+
+    Раньше таблицу создавал AchievementTracker при старте; в таких
+    базах уже накопленные счётчики сохраняются как есть.
+    """
+    cursor = await conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'achievement_counters'"
+    )
+    if await cursor.fetchone():
+        return
+    
+    await conn.execute('''
+        CREATE TABLE achievement_counters (
+            user_id INTEGER PRIMARY KEY,
+            purchases INTEGER DEFAULT 0,
+            transfers INTEGER DEFAULT 0,
+            donated INTEGER DEFAULT 0,
+            duel_wins INTEGER DEFAULT 0
+        )
+    ''')
+    await conn.execute(f'''
+        INSERT INTO achievement_counters (user_id, purchases, transfers, donated, duel_wins)
+        SELECT u.user_id,
+               (SELECT COUNT(*) FROM transactions t
+                WHERE t.user_id = u.user_id AND t.type_code = {TX_CODES['purchase']}),
+               (SELECT COUNT(*) FROM transactions t
+                WHERE t.user_id = u.user_id AND t.type_code = {TX_CODES['transfer_out']}),
+               (SELECT COALESCE(-SUM(t.amount), 0) FROM transactions t
+                WHERE t.user_id = u.user_id AND t.type_code = {TX_CODES['transfer_out']} AND t.amount < 0),
+               (SELECT COUNT(*) FROM duels d
+                WHERE d.winner_id = u.user_id AND d.status = 'finished')
+        FROM users_hot u
+    ''')
+    logging.info("Счётчики достижений заполнены из истории")
+
+
+# Порог "состоятельного" пользователя в сводной статистике
+RICH_BALANCE = 1000
+ECONOMY_STATS_COLUMNS = ('users', 'money_supply', 'rich_users', 'clans', 'finished_duels')
+# Полный пересчёт сводных таблиц: заполнение при миграции и сверка
+ECONOMY_STATS_RECOMPUTE = f'''
+    SELECT
+        (SELECT COUNT(*) FROM users_hot),
+        (SELECT COALESCE(SUM(balance), 0) FROM users_hot),
+        (SELECT COUNT(*) FROM users_hot WHERE balance > {RICH_BALANCE}),
+        (SELECT COUNT(*) FROM clans),
+        (SELECT COUNT(*) FROM duels WHERE status = 'finished')
+'''
+LAST_ACTIVE_RECOMPUTE = '''
+    SELECT substr(last_message, 1, 10) AS day, COUNT(*)
+    FROM users_hot
+    WHERE last_message IS NOT NULL
+    GROUP BY day
+'''
+TRANSACTION_DAILY_RECOMPUTE = '''
+    SELECT substr(timestamp, 1, 10) AS day, type_code, COUNT(*), COALESCE(SUM(amount), 0)
+    FROM transactions
+    WHERE ts >= ?
+    GROUP BY day, type_code
+'''
+
+
+async def table_schema(conn: aiosqlite.Connection, table: str) -> str:
+    """Схема (main или файл домена), в которой лежит таблица"""
+    cursor = await conn.execute('PRAGMA database_list')
+    schemas = [row[1] for row in await cursor.fetchall() if row[1] != 'temp']
+    for schema in schemas:
+        cursor = await conn.execute(
+            f"SELECT 1 FROM {schema}.sqlite_master WHERE type = 'table' AND name = ?", (table,)
+        )
+        if await cursor.fetchone():
+            return schema
+    raise ValueError(f"Таблица {table} не найдена")
+
+
+async def economy_aggregates(conn: aiosqlite.Connection):
+    """Сводные счётчики экономики, которые ведут триггеры.
+
+    economy_stats - одна строка: пользователи, сумма балансов, число
+    балансов выше RICH_BALANCE, кланы, завершённые дуэли.
+    user_last_active - число пользователей по дню последнего сообщения,
+    transaction_daily_stats - число и сумма операций по дню и типу.
+    Триггеры меняют их в той же транзакции, что и исходные строки,
+    поэтому команды статистики читают несколько строк вместо полных
+    проходов по таблицам.
+
+    Триггер пишет только в таблицы своей схемы, поэтому
+    transaction_daily_stats создаётся в том же файле, что и
+    transactions. Удаление старых транзакций архивом дневные итоги
+    не уменьшает.
+    """
+    await conn.execute('''
+        CREATE TABLE economy_stats (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            users INTEGER NOT NULL DEFAULT 0,
+            money_supply INTEGER NOT NULL DEFAULT 0,
+            rich_users INTEGER NOT NULL DEFAULT 0,
+            clans INTEGER NOT NULL DEFAULT 0,
+            finished_duels INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    await conn.execute(
+        f"INSERT INTO economy_stats (id, {', '.join(ECONOMY_STATS_COLUMNS)}) "
+        f"SELECT 1, * FROM ({ECONOMY_STATS_RECOMPUTE})"
+    )
+    
+    await conn.execute('''
+        CREATE TABLE user_last_active (
+            day TEXT PRIMARY KEY,
+            users INTEGER NOT NULL DEFAULT 0
+        ) WITHOUT ROWID
+    ''')
+    await conn.execute(f'INSERT INTO user_last_active (day, users) {LAST_ACTIVE_RECOMPUTE}')
+    
+    # Баланс и день последнего сообщения без NULL: сравнения дают 0/1
+    new_balance = 'COALESCE(NEW.balance, 0)'
+    old_balance = 'COALESCE(OLD.balance, 0)'
+    new_day = 'substr(NEW.last_message, 1, 10)'
+    old_day = 'substr(OLD.last_message, 1, 10)'
+    touch_new_day = f'''
+        INSERT INTO user_last_active (day, users)
+        SELECT {new_day}, 1 WHERE NEW.last_message IS NOT NULL
+        ON CONFLICT(day) DO UPDATE SET users = users + 1;
+    '''
+    
+    await conn.execute(f'''
+        CREATE TRIGGER users_hot_stats_insert AFTER INSERT ON users_hot
+        BEGIN
+            UPDATE economy_stats
+            SET users = users + 1,
+                money_supply = money_supply + {new_balance},
+                rich_users = rich_users + ({new_balance} > {RICH_BALANCE})
+            WHERE id = 1;
+            {touch_new_day}
+        END
+    ''')
+    await conn.execute(f'''
+        CREATE TRIGGER users_hot_stats_delete AFTER DELETE ON users_hot
+        BEGIN
+            UPDATE economy_stats
+            SET users = users - 1,
+                money_supply = money_supply - {old_balance},
+                rich_users = rich_users - ({old_balance} > {RICH_BALANCE})
+            WHERE id = 1;
+            UPDATE user_last_active SET users = users - 1 WHERE day = {old_day};
+        END
+    ''')
+    # Награды меняют баланс каждой пачкой: WHEN отсекает строки без изменения
+    await conn.execute(f'''
+        CREATE TRIGGER users_hot_stats_balance AFTER UPDATE OF balance ON users_hot
+        WHEN NEW.balance IS NOT OLD.balance
+        BEGIN
+            UPDATE economy_stats
+            SET money_supply = money_supply + {new_balance} - {old_balance},
+                rich_users = rich_users + ({new_balance} > {RICH_BALANCE}) - ({old_balance} > {RICH_BALANCE})
+            WHERE id = 1;
+        END
+    ''')
+    await conn.execute(f'''
+        CREATE TRIGGER users_hot_stats_last_active AFTER UPDATE OF last_message ON users_hot
+        WHEN {new_day} IS NOT {old_day}
+        BEGIN
+            UPDATE user_last_active SET users = users - 1 WHERE day = {old_day};
+            {touch_new_day}
+        END
+    ''')
+    
+    for event, delta in (('INSERT', '+ 1'), ('DELETE', '- 1')):
+        await conn.execute(f'''
+            CREATE TRIGGER clans_stats_{event.lower()} AFTER {event} ON clans
+            BEGIN
+                UPDATE economy_stats SET clans = clans {delta} WHERE id = 1;
+            END
+        ''')
+    
+    await conn.execute('''
+        CREATE TRIGGER duels_stats_insert AFTER INSERT ON duels
+        WHEN NEW.status = 'finished'
+        BEGIN
+            UPDATE economy_stats SET finished_duels = finished_duels + 1 WHERE id = 1;
+        END
+    ''')
+    await conn.execute('''
+        CREATE TRIGGER duels_stats_delete AFTER DELETE ON duels
+        WHEN OLD.status = 'finished'
+        BEGIN
+            UPDATE economy_stats SET finished_duels = finished_duels - 1 WHERE id = 1;
+        END
+    ''')
+    await conn.execute('''
+        CREATE TRIGGER duels_stats_status AFTER UPDATE OF status ON duels
+        WHEN NEW.status IS NOT OLD.status
+        BEGIN
+            UPDATE economy_stats
+            SET finished_duels = finished_duels + (NEW.status IS 'finished') - (OLD.status IS 'finished')
+            WHERE id = 1;
+        END
+    ''')
+    
+    schema = await table_schema(conn, 'transactions')
+    await conn.execute(f'''
+        CREATE TABLE {schema}.transaction_daily_stats (
+            day TEXT,
+            type_code INTEGER,
+            count INTEGER NOT NULL DEFAULT 0,
+            amount INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, type_code)
+        ) WITHOUT ROWID
+    ''')
+    await conn.execute(
+        f'INSERT INTO {schema}.transaction_daily_stats (day, type_code, count, amount) '
+        f'{TRANSACTION_DAILY_RECOMPUTE}', (0,)
+    )
+    await conn.execute(f'''
+        CREATE TRIGGER {schema}.transactions_daily_stats AFTER INSERT ON transactions
+        BEGIN
+            INSERT INTO transaction_daily_stats (day, type_code, count, amount)
+            VALUES (substr(NEW.timestamp, 1, 10), NEW.type_code, 1, COALESCE(NEW.amount, 0))
+            ON CONFLICT(day, type_code) DO UPDATE
+            SET count = count + 1, amount = amount + excluded.amount;
+        END
+    ''')
+
+Migration = Tuple[int, str, Callable[[aiosqlite.Connection], Awaitable[None]]]
+
+# Долгие миграции, которые сами фиксируют порции и продолжают с места
+# сбоя. Их последний шаг остаётся в открытой транзакции, которую
+# apply_migrations фиксирует вместе с номером версии
+STEPWISE_MIGRATIONS = {'compact_transactions'}
+
+MIGRATIONS: List[Migration] = [
+    (1, 'base_schema', base_schema),
+    (2, 'seasonal_schema', seasonal_schema),
+    (3, 'admin_schema', admin_schema),
+    (4, 'unique_constraints', unique_constraints),
+    (5, 'hot_path_indexes', hot_path_indexes),
+    (6, 'epoch_timestamps', epoch_timestamps),
+    (7, 'users_hot_split', users_hot_split),
+    (8, 'compact_transactions', compact_transactions),
+    (9, 'economy_aggregates', economy_aggregates),
+    (10, 'achievement_counters', achievement_counters),
+]
+
+
+async def get_schema_version(conn: aiosqlite.Connection) -> int:
+    cursor = await conn.execute('SELECT MAX(version) FROM schema_version')
+    row = await cursor.fetchone()
+    await cursor.close()
+    return row[0] or 0
+
+
+async def apply_migrations(conn: aiosqlite.Connection) -> List[int]:
+    """Применение недостающих миграций; возвращает номера применённых.
+
+    Вызывается при старте до запуска писателя. Каждая миграция
+    фиксируется отдельно, поэтому блокировка записи держится только
+    на время одного шага, а чтения в WAL не останавливаются.
+    Миграции из STEPWISE_MIGRATIONS открывают транзакции сами.
+    """
+    await conn.execute('''
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            name TEXT,
+            applied_at TEXT
+        )
+    ''')
+    await conn.commit()
+    
+    current = await get_schema_version(conn)
+    applied = []
+    
+    for version, name, migrate in MIGRATIONS:
+        if version <= current:
+            continue
+        
+        started = datetime.now()
+        try:
+            if name not in STEPWISE_MIGRATIONS:
+                await conn.execute('BEGIN IMMEDIATE')
+            await migrate(conn)
+            await conn.execute(
+                'INSERT INTO schema_version (version, name, applied_at) VALUES (?, ?, ?)',
+                (version, name, datetime.now().isoformat())
+            )
+            await conn.commit()
+        except Exception as e:
+            await conn.rollback()
+            logging.error(f"Ошибка миграции {version} ({name}): {e}")
+            raise
+        
+        elapsed = (datetime.now() - started).total_seconds()
+        logging.info(f"Применена миграция {version} ({name}) за {elapsed:.2f}с")
+        applied.append(version)
+    
+    return applied
@@ -1,7 +1,7 @@
 import enum
 from dataclasses import dataclass
 from datetime import datetime
-from typing import List, Optional
+from typing import List, NamedTuple, Optional
 
 class SeasonType(enum.Enum):
     SPRING = "spring"
@@ -23,3 +23,16 @@ class Season:
     coin_multiplier: float
     special_items: List[int]
     is_active: bool
+
+class User(NamedTuple):
+    """Горячие поля пользователя; порядок совпадает с прежним кортежем get_user_data"""
+    user_id: int
+    username: Optional[str]
+    balance: int
+    level: int
+    xp: int
+    last_daily: Optional[str]
+    daily_streak: int
+    last_message: Optional[str]
+    is_banned: int
+    total_message_count: int
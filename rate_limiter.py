@@ -0,0 +1,210 @@
+import logging
+import os
+import sys
+import time
+from array import array
+from typing import Dict, Tuple
+
+# Скользящее окно на отсортированном множестве: чистка, добавление, обрезка
+# до limit + 1 последних событий и подсчёт выполняются атомарно одним
+# обращением к Redis
+SLIDING_WINDOW_SCRIPT = """
+local key = KEYS[1]
+local now = tonumber(ARGV[1])
+local window = tonumber(ARGV[2])
+local keep = tonumber(ARGV[4])
+redis.call('ZREMRANGEBYSCORE', key, '-inf', now - window)
+redis.call('ZADD', key, now, ARGV[3])
+redis.call('ZREMRANGEBYRANK', key, 0, -keep - 1)
+redis.call('PEXPIRE', key, window)
+return redis.call('ZCARD', key)
+"""
+
+
+class SlidingWindow:
+    """Кольцевой буфер последних limit + 1 моментов событий (time.monotonic).
+
+    Памяти занимает фиксированный объём, а превышение лимита проверяется
+    за O(1): лимит превышен, если самое старое из limit + 1 событий
+    попадает в окно. Точное число событий в окне не считается.
+    """
+
+    __slots__ = ('times', 'pos', 'size')
+
+    def __init__(self, limit: int):
+        self.times = array('d', bytes(8 * (limit + 1)))
+        self.pos = 0
+        self.size = 0
+
+    def hit(self, now: float, window: float) -> bool:
+        """Регистрирует событие; True, если в окне больше limit событий"""
+        capacity = len(self.times)
+        self.times[self.pos] = now
+        self.pos = (self.pos + 1) % capacity
+        if self.size < capacity:
+            self.size += 1
+            if self.size < capacity:
+                return False
+
+        # После записи pos указывает на самое старое из limit + 1 событий
+        return now - self.times[self.pos] < window
+
+    @property
+    def last_seen(self) -> float:
+        return self.times[self.pos - 1]
+
+    def clear(self):
+        self.pos = 0
+        self.size = 0
+
+
+class RateLimiter:
+    """Кулдауны и окна антиспама.
+
+    Если Redis доступен, состояние общее для всех процессов бота.
+    При недоступности Redis используется память процесса, а повторное
+    подключение пробуется не чаще раза в retry_interval секунд.
+    """
+
+    def __init__(self, redis_client=None, prefix: str = 'bot', retry_interval: float = 30):
+        self.prefix = prefix
+        self.retry_interval = retry_interval
+        self._retry_at = 0.0
+        self._window_script = None
+        self.redis = None
+        self.set_redis(redis_client)
+
+        # Резервное состояние в памяти: окна, (счётчик, истекает) предупреждений
+        # и моменты истечения кулдаунов
+        self.local_windows: Dict[Tuple[str, int], SlidingWindow] = {}
+        self.local_warnings: Dict[Tuple[str, int], Tuple[int, float]] = {}
+        self.local_cooldowns: Dict[Tuple[str, int], float] = {}
+
+    def set_redis(self, redis_client):
+        self.redis = redis_client
+        self._window_script = (
+            redis_client.register_script(SLIDING_WINDOW_SCRIPT) if redis_client else None
+        )
+        self._retry_at = 0.0
+
+    def _key(self, *parts) -> str:
+        return ':'.join([self.prefix, *map(str, parts)])
+
+    def _redis_ready(self) -> bool:
+        return self.redis is not None and time.monotonic() >= self._retry_at
+
+    def _redis_failed(self, e: Exception):
+        logging.warning(f"Redis недоступен ({e}), используем состояние в памяти")
+        self._retry_at = time.monotonic() + self.retry_interval
+
+    async def acquire_cooldown(self, name: str, user_id: int, seconds: int) -> bool:
+        """Атомарная попытка занять кулдаун.
+
+        True - кулдаун занят этим вызовом, False - ещё не истёк.
+        Без Redis кулдаун хранится в памяти процесса.
+        """
+        if self._redis_ready():
+            try:
+                return bool(await self.redis.set(
+                    self._key('cooldown', name, user_id), 1, nx=True, ex=seconds
+                ))
+            except Exception as e:
+                self._redis_failed(e)
+
+        key = (name, user_id)
+        now = time.monotonic()
+        if self.local_cooldowns.get(key, 0.0) > now:
+            return False
+        self.local_cooldowns[key] = now + seconds
+        return True
+
+    async def hit_window(self, name: str, user_id: int, window: float, limit: int) -> bool:
+        """Регистрирует событие; True, если за window секунд событий больше limit.
+
+        Хранятся только limit + 1 последних событий.
+        """
+        if self._redis_ready():
+            now_ms = int(time.time() * 1000)
+            try:
+                return int(await self._window_script(
+                    keys=[self._key('window', name, user_id)],
+                    args=[now_ms, int(window * 1000), f"{now_ms}-{os.urandom(4).hex()}", limit + 1]
+                )) > limit
+            except Exception as e:
+                self._redis_failed(e)
+
+        key = (name, user_id)
+        sliding_window = self.local_windows.get(key)
+        if sliding_window is None or len(sliding_window.times) != limit + 1:
+            sliding_window = self.local_windows[key] = SlidingWindow(limit)
+        return sliding_window.hit(time.monotonic(), window)
+
+    async def add_warning(self, name: str, user_id: int, ttl: int) -> int:
+        """Увеличивает счётчик предупреждений и возвращает новое значение"""
+        if self._redis_ready():
+            key = self._key('warnings', name, user_id)
+            try:
+                async with self.redis.pipeline(transaction=True) as pipe:
+                    pipe.incr(key)
+                    pipe.expire(key, ttl)
+                    warnings, _ = await pipe.execute()
+                return int(warnings)
+            except Exception as e:
+                self._redis_failed(e)
+
+        key = (name, user_id)
+        now = time.monotonic()
+        warnings, expires_at = self.local_warnings.get(key, (0, 0.0))
+        if expires_at < now:
+            warnings = 0
+        self.local_warnings[key] = (warnings + 1, now + ttl)
+        return warnings + 1
+
+    async def reset(self, name: str, user_id: int):
+        """Сброс окна, предупреждений и кулдауна пользователя"""
+        self.local_windows.pop((name, user_id), None)
+        self.local_warnings.pop((name, user_id), None)
+        self.local_cooldowns.pop((name, user_id), None)
+
+        if self._redis_ready():
+            try:
+                await self.redis.delete(
+                    self._key('window', name, user_id),
+                    self._key('warnings', name, user_id),
+                    self._key('cooldown', name, user_id)
+                )
+            except Exception as e:
+                self._redis_failed(e)
+
+    def evict_idle(self, max_idle: float) -> int:
+        """Удаление окон неактивных пользователей, истёкших предупреждений и кулдаунов"""
+        now = time.monotonic()
+        idle = [
+            key for key, sliding_window in self.local_windows.items()
+            if now - sliding_window.last_seen > max_idle
+        ]
+        for key in idle:
+            del self.local_windows[key]
+
+        expired = [key for key, (_, expires_at) in self.local_warnings.items() if expires_at < now]
+        for key in expired:
+            del self.local_warnings[key]
+
+        finished = [key for key, expires_at in self.local_cooldowns.items() if expires_at < now]
+        for key in finished:
+            del self.local_cooldowns[key]
+
+        return len(idle) + len(expired) + len(finished)
+
+    def memory_usage(self) -> Tuple[int, int]:
+        """Число записей и примерный объём памяти резервного состояния в байтах"""
+        size = (sys.getsizeof(self.local_windows) + sys.getsizeof(self.local_warnings)
+                + sys.getsizeof(self.local_cooldowns))
+        for key, sliding_window in self.local_windows.items():
+            size += sys.getsizeof(key) + sys.getsizeof(sliding_window) + sys.getsizeof(sliding_window.times)
+        for key, value in self.local_warnings.items():
+            size += sys.getsizeof(key) + sys.getsizeof(value)
+        for key, value in self.local_cooldowns.items():
+            size += sys.getsizeof(key) + sys.getsizeof(value)
+        entries = len(self.local_windows) + len(self.local_warnings) + len(self.local_cooldowns)
+        return entries, size
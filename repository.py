@@ -0,0 +1,126 @@
+"""Пакетный доступ к пользователям, балансам и журналу операций."""
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from ledger import Ledger
+from models import User
+from user_cache import USER_FIELDS
+
+# Ограничение числа параметров в одном запросе (SQLITE_MAX_VARIABLE_NUMBER
+# в старых сборках 999)
+SELECT_CHUNK = 500
+VALUES_CHUNK = 300
+
+
+def chunks(items: List[Any], size: int) -> Iterable[List[Any]]:
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+class UserRepository:
+    """Операции над множеством пользователей за один запрос.
+
+    Чтения идут через пул читателей и кэш горячих полей и возвращают
+    словари по user_id: порядок строк из IN (...) не гарантирован.
+    Записи выполняются на соединении единицы записи (Database.write)
+    одним UPDATE ... FROM (VALUES ...) на порцию и возвращают новые
+    значения по user_id. Сброс кэша после записи — на вызывающем коде,
+    как и для остальных единиц записи.
+    """
+
+    def __init__(self, db, user_cache=None, ledger: Optional[Ledger] = None):
+        self.db = db
+        self.user_cache = user_cache
+        self.ledger = ledger or Ledger()
+
+    async def load_rows(self, user_ids: Iterable[int]) -> Dict[int, Dict[str, Any]]:
+        """Записи кэша (dict по USER_FIELDS); промахи дочитываются пачками"""
+        rows: Dict[int, Dict[str, Any]] = {}
+        missing = []
+        for user_id in dict.fromkeys(user_ids):
+            row = self.user_cache.get(user_id) if self.user_cache else None
+            if row is not None:
+                rows[user_id] = row
+            else:
+                missing.append(user_id)
+
+        if not missing:
+            return rows
+
+        generation = self.user_cache.generation if self.user_cache else None
+        for chunk in chunks(missing, SELECT_CHUNK):
+            result = await self.db.fetchall(f'''
+                SELECT {', '.join(USER_FIELDS)}
+                FROM users WHERE user_id IN ({','.join('?' * len(chunk))})
+            ''', chunk)
+            for values in result:
+                row = dict(zip(USER_FIELDS, values))
+                rows[row['user_id']] = row
+                if self.user_cache:
+                    self.user_cache.put(row['user_id'], row, generation)
+
+        return rows
+
+    async def get_users(self, user_ids: Iterable[int]) -> Dict[int, User]:
+        """Пользователи по id; отсутствующих в базе нет в результате"""
+        rows = await self.load_rows(user_ids)
+        return {user_id: User(*(row[field] for field in USER_FIELDS)) for user_id, row in rows.items()}
+
+    async def get_user(self, user_id: int) -> Optional[User]:
+        return (await self.get_users([user_id])).get(user_id)
+
+    async def get_usernames(self, user_ids: Iterable[int]) -> Dict[int, Optional[str]]:
+        return {user_id: user.username for user_id, user in (await self.get_users(user_ids)).items()}
+
+    async def _update_from_values(self, conn, set_clause: str, rows: List[tuple]) -> Dict[int, int]:
+        """UPDATE users_hot по списку VALUES (user_id, ...); возвращает {user_id: balance}"""
+        balances: Dict[int, int] = {}
+        if not rows:
+            return balances
+
+        width = len(rows[0])
+        for chunk in chunks(rows, VALUES_CHUNK):
+            placeholders = ', '.join('(' + ', '.join('?' * width) + ')' for _ in chunk)
+            cursor = await conn.execute(f'''
+                UPDATE users_hot
+                SET {set_clause}
+                FROM (VALUES {placeholders}) AS v
+                WHERE users_hot.user_id = v.column1
+                RETURNING users_hot.user_id, users_hot.balance
+            ''', [value for row in chunk for value in row])
+            balances.update(await cursor.fetchall())
+
+        return balances
+
+    async def update_balances(self, conn, deltas: Iterable[Tuple[int, int]]) -> Dict[int, int]:
+        """Безусловное изменение балансов: [(user_id, дельта)] -> {user_id: баланс}.
+
+        Дельты одного пользователя складываются. Списания с проверкой
+        остатка идут через Ledger.debit.
+        """
+        totals: Dict[int, int] = {}
+        for user_id, delta in deltas:
+            totals[user_id] = totals.get(user_id, 0) + delta
+
+        return await self._update_from_values(
+            conn, 'balance = balance + v.column2', list(totals.items())
+        )
+
+    async def add_rewards_select(self, conn, select_sql: str, params: Iterable = ()) -> int:
+        """Начисление коинов и опыта по запросу одним UPDATE ... FROM; возвращает число строк.
+
+        Запрос возвращает колонки user_id, coins, xp, не больше одной
+        строки на пользователя - для наград множеству пользователей по
+        таблице (например, итоги сезона) без выборки строк в Python.
+        """
+        cursor = await conn.execute(f'''
+            UPDATE users_hot
+            SET balance = users_hot.balance + src.coins, xp = users_hot.xp + src.xp
+            FROM ({select_sql}) AS src
+            WHERE users_hot.user_id = src.user_id
+        ''', tuple(params))
+        return cursor.rowcount
+
+    async def insert_transactions(self, conn, rows: Iterable[Tuple[int, int, str, Optional[int], Optional[int], Optional[str]]],
+                                  now: Optional[str] = None):
+        """Строки журнала: (user_id, amount, type, counterparty_id, item_id, note)"""
+        await self.ledger.record(conn, rows, now)
@@ -0,0 +1,311 @@
+import asyncio
+import logging
+import random
+import time
+from typing import Awaitable, Callable, Dict, List, Tuple, Optional, Any
+
+# Ограничение на число параметров в одном запросе SQLite
+SELECT_CHUNK = 500
+
+
+class RewardFlusher:
+    """Фоновая запись наград за сообщения.
+
+    Непрерывно вычитывает очередь наград, объединяет записи одного
+    пользователя в одну дельту и пишет всю пачку одной единицей
+    записи Database.write.
+    Если передана таблица уровней, в той же транзакции пересчитываются
+    уровни, а после записи вызывается on_level_up со списком
+    (user_id, chat_id, новый уровень).
+    Если переданы доски лидеров, новые счёты пользователей пачки
+    читаются в той же транзакции и записываются на доски после неё.
+    Награды пачки, которую не удалось записать, не теряются: они
+    добавляются к следующей пачке, а повтор идёт с растущей паузой.
+    После max_attempts неудач подряд пачка отбрасывается с ошибкой в логе.
+    """
+
+    def __init__(self, db, seasonal_system, queue: asyncio.Queue,
+                 flush_interval: float = 0.5, max_batch: int = 1000,
+                 user_cache=None, level_table=None, leaderboards=None,
+                 max_attempts: int = 5, retry_delay: float = 1.0, max_retry_delay: float = 30.0,
+                 on_level_up: Optional[Callable[[List[Tuple[int, Optional[int], int]]], Awaitable[None]]] = None):
+        self.db = db
+        self.seasonal_system = seasonal_system
+        self.queue = queue
+        self.user_cache = user_cache
+        self.level_table = level_table
+        self.leaderboards = leaderboards
+        self.on_level_up = on_level_up
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self._task: Optional[asyncio.Task] = None
+        # Награды неудачной пачки ждут повтора вместе со следующей
+        self._retry: List[Tuple[int, dict]] = []
+        self._attempts = 0
+
+        # Метрики для настройки
+        self.stats = {
+            'batches': 0,
+            'items': 0,
+            'failed_batches': 0,
+            'dropped_items': 0,
+            'last_batch_size': 0,
+            'last_batch_users': 0,
+            'max_batch_size': 0,
+            'last_lag': 0.0,
+            'max_lag': 0.0,
+            'last_flush_ms': 0.0,
+            'level_ups': 0
+        }
+
+    def start(self):
+        """Запуск фоновой задачи"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Остановка с дозаписью оставшихся наград"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+        # Число попыток ограничено: при недоступной БД цикл завершится
+        while not self.queue.empty() or self._retry:
+            await self.flush(self._drain([]))
+
+    def retry_backoff(self) -> float:
+        """Пауза перед повтором после self._attempts неудач подряд"""
+        return min(self.retry_delay * 2 ** max(self._attempts - 1, 0), self.max_retry_delay)
+
+    async def _run(self):
+        while True:
+            try:
+                if self._retry:
+                    # Повтор неудачной пачки не ждёт новых наград
+                    await asyncio.sleep(self.retry_backoff())
+                    batch = []
+                else:
+                    # Ждём первую награду, затем даём очереди накопиться
+                    batch = [await self.queue.get()]
+                    await asyncio.sleep(self.flush_interval)
+                await self.flush(self._drain(batch))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.error(f"Ошибка фоновой записи наград: {e}")
+
+    def _drain(self, batch: List[Tuple[int, dict]]) -> List[Tuple[int, dict]]:
+        while len(batch) < self.max_batch:
+            try:
+                batch.append(self.queue.get_nowait())
+            except asyncio.QueueEmpty:
+                break
+        return batch
+
+    def coalesce(self, batch: List[Tuple[int, dict]], season=None) -> Dict[int, Dict[str, Any]]:
+        """Объединение наград пачки в одну дельту на пользователя"""
+        deltas: Dict[int, Dict[str, Any]] = {}
+
+        for user_id, message_data in batch:
+            xp = message_data.get('xp_gain', 1)
+            coins = message_data.get('coins_gain', random.randint(1, 3))
+
+            # Сезонные множители применяются к каждой награде отдельно
+            if season:
+                xp = int(xp * season.xp_multiplier)
+                coins = int(coins * season.coin_multiplier)
+
+            delta = deltas.setdefault(user_id, {
+                'xp': 0,
+                'coins': 0,
+                'messages': 0,
+                'last_message': None,
+                'chat_id': None,
+                'activity': {}
+            })
+            delta['xp'] += xp
+            delta['coins'] += coins
+            delta['messages'] += 1
+            if message_data.get('chat_id') is not None:
+                delta['chat_id'] = message_data['chat_id']
+
+            timestamp = message_data.get('timestamp')
+            if timestamp:
+                if not delta['last_message'] or timestamp > delta['last_message']:
+                    delta['last_message'] = timestamp
+                day = timestamp[:10]
+                delta['activity'][day] = delta['activity'].get(day, 0) + 1
+
+        return deltas
+
+    async def compute_levels(self, conn, deltas: Dict[int, Dict[str, Any]]) -> Dict[int, Tuple[int, int]]:
+        """Уровни пользователей пачки после начисления опыта: {user_id: (старый, новый)}"""
+        levels: Dict[int, Tuple[int, int]] = {}
+        user_ids = list(deltas)
+
+        for start in range(0, len(user_ids), SELECT_CHUNK):
+            chunk = user_ids[start:start + SELECT_CHUNK]
+            placeholders = ','.join('?' * len(chunk))
+            cursor = await conn.execute(
+                f'SELECT user_id, xp, level FROM users_hot WHERE user_id IN ({placeholders})',
+                chunk
+            )
+            for user_id, xp, level in await cursor.fetchall():
+                new_level = self.level_table.level_for_xp((xp or 0) + deltas[user_id]['xp'])
+                levels[user_id] = (level, max(level, new_level))
+
+        return levels
+
+    async def write_batch(self, conn, deltas: Dict[int, Dict[str, Any]], season=None
+                          ) -> Tuple[Dict[int, Tuple[int, int]], Dict[str, Dict[int, int]]]:
+        """Единица записи пачки: пользователи, активность, сезон; возвращает уровни и счёты досок"""
+        levels: Dict[int, Tuple[int, int]] = {}
+        if self.level_table:
+            levels = await self.compute_levels(conn, deltas)
+
+        # Уровень только растёт: MAX сохраняет уровень, выставленный вручную
+        # Только горячие поля: узкие строки users_hot без триггеров представления
+        await conn.executemany('''
+            UPDATE users_hot
+            SET xp = xp + ?, balance = balance + ?,
+                total_message_count = total_message_count + ?,
+                weekly_activity = weekly_activity + ?,
+                last_message = COALESCE(?, last_message),
+                level = MAX(level, ?)
+            WHERE user_id = ?
+        ''', [
+            (delta['xp'], delta['coins'], delta['messages'], delta['messages'],
+             delta['last_message'], levels.get(user_id, (0, 0))[1], user_id)
+            for user_id, delta in deltas.items()
+        ])
+
+        await conn.executemany('''
+            INSERT INTO user_activity (user_id, date, message_count)
+            VALUES (?, ?, ?)
+            ON CONFLICT(user_id, date)
+            DO UPDATE SET message_count = message_count + excluded.message_count
+        ''', [
+            (user_id, day, count)
+            for user_id, delta in deltas.items()
+            for day, count in delta['activity'].items()
+        ])
+
+        if season:
+            await self.seasonal_system.update_user_season_stats_many(conn, season.id, [
+                (user_id, delta['xp'], delta['coins'], delta['messages'])
+                for user_id, delta in deltas.items()
+            ])
+
+        scores: Dict[str, Dict[int, int]] = {}
+        if self.leaderboards:
+            scores = await self.leaderboards.read_scores(conn, deltas, season.id if season else None)
+
+        return levels, scores
+
+    async def flush(self, batch: List[Tuple[int, dict]]):
+        """Запись пачки наград одной транзакцией"""
+        batch, self._retry = self._retry + batch, []
+        if not batch:
+            return
+
+        started = time.monotonic()
+        oldest = min(
+            (message_data.get('queued_at', started) for _, message_data in batch),
+            default=started
+        )
+
+        deltas: Dict[int, Dict[str, Any]] = {}
+        levels: Dict[int, Tuple[int, int]] = {}
+        scores: Dict[str, Dict[int, int]] = {}
+        written = False
+
+        try:
+            season = await self.seasonal_system.get_current_season()
+            deltas = self.coalesce(batch, season)
+
+            # Пока идёт запись, загрузки этих пользователей не кэшируются
+            if self.user_cache:
+                self.user_cache.lock(deltas)
+
+            levels, scores = await self.db.write(self.write_batch, deltas, season)
+            written = True
+            self._attempts = 0
+
+        except Exception as e:
+            self.stats['failed_batches'] += 1
+            self._attempts += 1
+            if self._attempts < self.max_attempts:
+                self._retry = batch
+                logging.error(
+                    f"Ошибка записи пачки наград ({len(batch)} шт.), попытка {self._attempts}/"
+                    f"{self.max_attempts}, повтор через {self.retry_backoff():.1f}с: {e}"
+                )
+            else:
+                self._attempts = 0
+                self.stats['dropped_items'] += len(batch)
+                logging.critical(
+                    f"Пачка наград отброшена после {self.max_attempts} неудачных попыток: "
+                    f"{len(batch)} наград, {len({user_id for user_id, _ in batch})} пользователей "
+                    f"не получили опыт и коины: {e}"
+                )
+
+        finally:
+            if self.user_cache and deltas:
+                if written:
+                    for user_id, delta in deltas.items():
+                        self.user_cache.apply_delta(
+                            user_id, xp=delta['xp'], balance=delta['coins'],
+                            total_message_count=delta['messages']
+                        )
+                    for user_id, (_, new_level) in levels.items():
+                        self.user_cache.update(user_id, level=new_level)
+                self.user_cache.unlock(deltas)
+
+        if not written:
+            return
+
+        if scores:
+            try:
+                await self.leaderboards.apply(scores)
+            except Exception as e:
+                logging.error(f"Ошибка обновления досок лидеров: {e}")
+
+        finished = time.monotonic()
+        lag = finished - oldest
+
+        self.stats['batches'] += 1
+        self.stats['items'] += len(batch)
+        self.stats['last_batch_size'] = len(batch)
+        self.stats['last_batch_users'] = len(deltas)
+        self.stats['max_batch_size'] = max(self.stats['max_batch_size'], len(batch))
+        self.stats['last_lag'] = lag
+        self.stats['max_lag'] = max(self.stats['max_lag'], lag)
+        self.stats['last_flush_ms'] = (finished - started) * 1000
+
+        level_ups = [
+            (user_id, deltas[user_id]['chat_id'], new_level)
+            for user_id, (old_level, new_level) in levels.items()
+            if new_level > old_level
+        ]
+        if level_ups:
+            self.stats['level_ups'] += len(level_ups)
+            if self.on_level_up:
+                try:
+                    await self.on_level_up(level_ups)
+                except Exception as e:
+                    logging.error(f"Ошибка уведомления о новых уровнях: {e}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Текущие метрики очереди и записи"""
+        return {
+            'queue_depth': self.queue.qsize(),
+            'retry_items': len(self._retry),
+            **self.stats
+        }
@@ -2,12 +2,51 @@ import logging
 import json
 from datetime import datetime, timedelta
 from typing import Dict, List, Tuple, Optional, Any
+from database import to_epoch
+from leaderboards import season_board
 from models import Season, SeasonType
+from repository import UserRepository
+
+# Награды по итогам сезона по возрастанию мест: (до места включительно,
+# коины, опыт, предмет); None - до последнего места
+SEASON_REWARD_TIERS = [
+    (1, 5000, 1000, 'season_champion'),
+    (2, 3000, 700, 'season_runner_up'),
+    (3, 2000, 500, 'season_third_place'),
+    (10, 1000, 300, None),
+    (50, 500, 150, None),
+    (None, 100, 50, None)
+]
+# Больше участников - кэш пользователей сбрасывается целиком, а доски
+# лидеров строятся заново вместо обновления по одному
+BULK_REFRESH_LIMIT = 5000
+
+
+def reward_tier_case(field: int) -> Tuple[str, List[Any]]:
+    """CASE по final_rank для поля награды (1 - коины, 2 - опыт, 3 - предмет)"""
+    sql = 'CASE'
+    params: List[Any] = []
+    for max_rank, *reward in SEASON_REWARD_TIERS:
+        if max_rank is None:
+            sql += ' ELSE ?'
+            params.append(reward[field - 1])
+        else:
+            sql += ' WHEN final_rank <= ? THEN ?'
+            params += [max_rank, reward[field - 1]]
+    return sql + ' END', params
+
 
 class SeasonalSystem:
-    def __init__(self, db_connection):
-        self.conn = db_connection
+    def __init__(self, db, user_cache=None, users: Optional[UserRepository] = None, leaderboards=None):
+        self.db = db
+        self.user_cache = user_cache
+        self.users = users or UserRepository(db, user_cache)
+        self.leaderboards = leaderboards
         self.current_season: Optional[Season] = None
+        # Кэш активного сезона: (множитель опыта, множитель коинов) и срок действия
+        self.current_multipliers: Tuple[float, float] = (1.0, 1.0)
+        self.season_cache_expires: Optional[datetime] = None
+        self.season_recheck_interval = timedelta(minutes=5)
         self.seasonal_events = {}
         self.setup_seasonal_events()
     
@@ -48,72 +87,41 @@ class SeasonalSystem:
             }
         }
 
-    async def init_seasonal_tables(self):
-        """Инициализация таблиц для сезонов"""
-        await self.conn.execute('''
-            CREATE TABLE IF NOT EXISTS seasons (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name TEXT,
-                type TEXT,
-                start_date TEXT,
-                end_date TEXT,
-                xp_multiplier REAL DEFAULT 1.0,
-                coin_multiplier REAL DEFAULT 1.0,
-                special_items TEXT,
-                is_active INTEGER DEFAULT 0,
-                created_at TEXT
-            )
-        ''')
-        
-        await self.conn.execute('''
-            CREATE TABLE IF NOT EXISTS user_season_stats (
-                user_id INTEGER,
-                season_id INTEGER,
-                xp_earned INTEGER DEFAULT 0,
-                coins_earned INTEGER DEFAULT 0,
-                messages_sent INTEGER DEFAULT 0,
-                achievements_unlocked INTEGER DEFAULT 0,
-                final_rank INTEGER,
-                rewards_claimed INTEGER DEFAULT 0,
-                PRIMARY KEY (user_id, season_id)
-            )
-        ''')
+    async def get_current_season(self) -> Optional[Season]:
+        """Получение текущего активного сезона (из кэша, если он не истёк)"""
+        now = datetime.now()
+        if self.season_cache_expires and now < self.season_cache_expires:
+            return self.current_season
         
-        await self.conn.execute('''
-            CREATE TABLE IF NOT EXISTS season_leaderboard (
-                season_id INTEGER,
-                user_id INTEGER,
-                total_xp INTEGER DEFAULT 0,
-                rank INTEGER,
-                PRIMARY KEY (season_id, user_id)
-            )
-        ''')
+        season = await self.load_current_season()
         
-        await self.conn.execute('''
-            CREATE TABLE IF NOT EXISTS seasonal_shop_items (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                season_type TEXT,
-                name TEXT,
-                description TEXT,
-                price INTEGER,
-                item_type TEXT,
-                duration_days INTEGER,
-                limited_quantity INTEGER,
-                sold_count INTEGER DEFAULT 0
-            )
-        ''')
-        
-        await self.conn.commit()
+        self.current_season = season
+        if season:
+            self.current_multipliers = (season.xp_multiplier, season.coin_multiplier)
+            # Кэш действует до конца сезона
+            self.season_cache_expires = season.end_date
+        else:
+            self.current_multipliers = (1.0, 1.0)
+            # Без активного сезона периодически перепроверяем БД
+            self.season_cache_expires = now + self.season_recheck_interval
+        
+        return season
 
-    async def get_current_season(self) -> Optional[Season]:
-        """Получение текущего активного сезона"""
-        cursor = await self.conn.execute('''
+    def invalidate_season_cache(self):
+        """Сброс кэша активного сезона"""
+        self.current_season = None
+        self.current_multipliers = (1.0, 1.0)
+        self.season_cache_expires = None
+
+    async def load_current_season(self) -> Optional[Season]:
+        """Загрузка текущего активного сезона из БД"""
+        now_ts = to_epoch(datetime.now())
+        season_data = await self.db.fetchone('''
             SELECT * FROM seasons 
             WHERE is_active = 1 
-            AND datetime(start_date) <= datetime('now') 
-            AND datetime(end_date) >= datetime('now')
-        ''')
-        season_data = await cursor.fetchone()
+            AND start_ts <= ? 
+            AND end_ts >= ?
+        ''', (now_ts, now_ts))
         
         if season_data:
             return Season(
@@ -140,35 +148,37 @@ class SeasonalSystem:
 
     async def activate_seasonal_event(self, season_type: SeasonType, event_data: dict):
         """Активация сезонного события"""
-        # Деактивируем предыдущие сезоны
-        await self.conn.execute('UPDATE seasons SET is_active = 0')
-        
-        # Создаем новый сезон
-        await self.conn.execute('''
-            INSERT OR REPLACE INTO seasons 
-            (name, type, start_date, end_date, xp_multiplier, coin_multiplier, 
-             special_items, is_active, created_at)
-            VALUES (?, ?, ?, ?, ?, ?, ?, 1, ?)
-        ''', (
-            event_data['name'],
-            season_type.value,
-            event_data['start'].isoformat(),
-            event_data['end'].isoformat(),
-            event_data['xp_multiplier'],
-            event_data['coin_multiplier'],
-            json.dumps(event_data['shop_items']),
-            datetime.now().isoformat()
-        ))
-        
-        await self.conn.commit()
+        async def write_season(conn):
+            # Деактивируем предыдущие сезоны
+            await conn.execute('UPDATE seasons SET is_active = 0')
+            
+            # Создаем новый сезон
+            await conn.execute('''
+                INSERT OR REPLACE INTO seasons 
+                (name, type, start_date, end_date, xp_multiplier, coin_multiplier, 
+                 special_items, is_active, created_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, 1, ?)
+            ''', (
+                event_data['name'],
+                season_type.value,
+                event_data['start'].isoformat(),
+                event_data['end'].isoformat(),
+                event_data['xp_multiplier'],
+                event_data['coin_multiplier'],
+                json.dumps(event_data['shop_items']),
+                datetime.now().isoformat()
+            ))
+            
+            # Добавляем сезонные предметы в магазин
+            await self.add_seasonal_shop_items(conn, season_type, event_data)
         
-        # Добавляем сезонные предметы в магазин
-        await self.add_seasonal_shop_items(season_type, event_data)
+        await self.db.write(write_season)
+        self.invalidate_season_cache()
         
         # Уведомляем пользователей
         await self.announce_season_start(event_data)
 
-    async def add_seasonal_shop_items(self, season_type: SeasonType, event_data: dict):
+    async def add_seasonal_shop_items(self, conn, season_type: SeasonType, event_data: dict):
         """Добавление сезонных предметов в магазин"""
         seasonal_items = {
             SeasonType.HALLOWEEN: [
@@ -190,10 +200,17 @@ class SeasonalSystem:
         
         items = seasonal_items.get(season_type, [])
         for item in items:
-            await self.conn.execute('''
-                INSERT OR REPLACE INTO seasonal_shop_items 
+            # Повторная активация обновляет товар, сохраняя id и продажи
+            await conn.execute('''
+                INSERT INTO seasonal_shop_items 
                 (season_type, name, description, price, item_type, duration_days, limited_quantity)
                 VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(season_type, name) DO UPDATE SET
+                    description = excluded.description,
+                    price = excluded.price,
+                    item_type = excluded.item_type,
+                    duration_days = excluded.duration_days,
+                    limited_quantity = excluded.limited_quantity
             ''', (season_type.value, *item))
 
     async def announce_season_start(self, event_data: dict):
@@ -212,13 +229,9 @@ class SeasonalSystem:
 
     async def apply_seasonal_multipliers(self, base_xp: int, base_coins: int) -> Tuple[int, int]:
         """Применение сезонных множителей"""
-        season = await self.get_current_season()
-        if season:
-            return (
-                int(base_xp * season.xp_multiplier),
-                int(base_coins * season.coin_multiplier)
-            )
-        return base_xp, base_coins
+        await self.get_current_season()
+        xp_multiplier, coin_multiplier = self.current_multipliers
+        return int(base_xp * xp_multiplier), int(base_coins * coin_multiplier)
 
     async def update_user_season_stats(self, user_id: int, xp: int, coins: int):
         """Обновление сезонной статистики пользователя"""
@@ -226,7 +239,7 @@ class SeasonalSystem:
         if not season:
             return
             
-        await self.conn.execute('''
+        await self.db.execute_write('''
             INSERT INTO user_season_stats 
             (user_id, season_id, xp_earned, coins_earned, messages_sent)
             VALUES (?, ?, ?, ?, 1)
@@ -236,12 +249,48 @@ class SeasonalSystem:
                 coins_earned = coins_earned + ?,
                 messages_sent = messages_sent + 1
         ''', (user_id, season.id, xp, coins, xp, coins))
-        
-        await self.conn.commit()
+
+    async def update_user_season_stats_many(self, conn, season_id: int, rows: List[Tuple[int, int, int, int]]):
+        """Пакетное обновление сезонной статистики (user_id, xp, coins, messages).
+
+        Выполняется на переданном соединении внутри транзакции вызывающего кода.
+        """
+        await conn.executemany('''
+            INSERT INTO user_season_stats
+            (user_id, season_id, xp_earned, coins_earned, messages_sent)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(user_id, season_id)
+            DO UPDATE SET
+                xp_earned = xp_earned + excluded.xp_earned,
+                coins_earned = coins_earned + excluded.coins_earned,
+                messages_sent = messages_sent + excluded.messages_sent
+        ''', [
+            (user_id, season_id, xp, coins, messages)
+            for user_id, xp, coins, messages in rows
+        ])
 
     async def get_season_leaderboard(self, season_id: int, limit: int = 10):
-        """Получение таблицы лидеров сезона"""
-        cursor = await self.conn.execute('''
+        """Получение таблицы лидеров сезона.
+
+        Для сезона с доской лидеров первые места берутся с доски, а из
+        user_season_stats дочитываются только их строки.
+        """
+        board = season_board(season_id)
+        if self.leaderboards and self.leaderboards.has_board(board):
+            top = await self.leaderboards.top(board, limit)
+            if not top:
+                return []
+            user_ids = [user_id for user_id, _ in top]
+            rows = await self.db.fetchall(f'''
+                SELECT u.user_id, u.username, uss.xp_earned, uss.coins_earned, uss.final_rank
+                FROM user_season_stats uss
+                JOIN users u ON uss.user_id = u.user_id
+                WHERE uss.season_id = ? AND uss.user_id IN ({','.join('?' * len(user_ids))})
+            ''', (season_id, *user_ids))
+            by_user = {row[0]: row[1:] for row in rows}
+            return [by_user[user_id] for user_id in user_ids if user_id in by_user]
+
+        return await self.db.fetchall('''
             SELECT u.username, uss.xp_earned, uss.coins_earned, uss.final_rank
             FROM user_season_stats uss
             JOIN users u ON uss.user_id = u.user_id
@@ -249,7 +298,6 @@ class SeasonalSystem:
             ORDER BY uss.xp_earned DESC
             LIMIT ?
         ''', (season_id, limit))
-        return await cursor.fetchall()
 
     async def end_current_season(self):
         """Завершение текущего сезона"""
@@ -257,127 +305,132 @@ class SeasonalSystem:
         if not season:
             return
             
-        # Вычисляем финальные ранги
-        await self.calculate_final_ranks(season.id)
-        
-        # Выдаем награды
-        await self.distribute_season_rewards(season.id)
+        async def write_season_end(conn):
+            # Вычисляем финальные ранги
+            await self.calculate_final_ranks(conn, season.id)
+            
+            # Выдаем награды
+            participants = await self.distribute_season_rewards(conn, season.id)
+            
+            # Деактивируем сезон
+            await conn.execute(
+                'UPDATE seasons SET is_active = 0 WHERE id = ?',
+                (season.id,)
+            )
+            return participants
         
-        # Деактивируем сезон
-        await self.conn.execute(
-            'UPDATE seasons SET is_active = 0 WHERE id = ?',
-            (season.id,)
-        )
+        participants = await self.db.write(write_season_end)
+        self.invalidate_season_cache()
         
-        await self.conn.commit()
+        if self.user_cache:
+            if len(participants) > BULK_REFRESH_LIMIT:
+                self.user_cache.clear()
+            else:
+                self.user_cache.invalidate(*participants)
         
         # Анонсируем завершение
         await self.announce_season_end(season)
-
-    async def calculate_final_ranks(self, season_id: int):
-        """Вычисление финальных рангов"""
-        cursor = await self.conn.execute('''
-            SELECT user_id, xp_earned 
-            FROM user_season_stats 
-            WHERE season_id = ?
-            ORDER BY xp_earned DESC
-        ''', (season_id,))
-        
-        users = await cursor.fetchall()
-        
-        for rank, (user_id, xp_earned) in enumerate(users, 1):
-            await self.conn.execute('''
-                UPDATE user_season_stats 
-                SET final_rank = ? 
-                WHERE user_id = ? AND season_id = ?
-            ''', (rank, user_id, season_id))
         
-        await self.conn.commit()
+        if self.leaderboards:
+            if len(participants) > BULK_REFRESH_LIMIT:
+                await self.leaderboards.rebuild()
+            else:
+                await self.leaderboards.refresh_users(participants)
+                await self.leaderboards.clear(season_board(season.id))
 
-    async def distribute_season_rewards(self, season_id: int):
-        """Распределение наград по итогам сезона"""
-        rewards = {
-            1: {'coins': 5000, 'xp': 1000, 'item': 'season_champion'},
-            2: {'coins': 3000, 'xp': 700, 'item': 'season_runner_up'},
-            3: {'coins': 2000, 'xp': 500, 'item': 'season_third_place'},
-            'top10': {'coins': 1000, 'xp': 300},
-            'top50': {'coins': 500, 'xp': 150},
-            'participant': {'coins': 100, 'xp': 50}
-        }
+    async def calculate_final_ranks(self, conn, season_id: int):
+        """Вычисление финальных рангов одним UPDATE по RANK() OVER.
+
+        Равный опыт даёт равное место (1, 1, 3, ...), поэтому и награда
+        за место у таких участников одинаковая.
+        """
+        await conn.execute('''
+            UPDATE user_season_stats
+            SET final_rank = ranked.place
+            FROM (
+                SELECT user_id, RANK() OVER (ORDER BY xp_earned DESC) AS place
+                FROM user_season_stats
+                WHERE season_id = ?
+            ) AS ranked
+            WHERE user_season_stats.season_id = ?
+              AND user_season_stats.user_id = ranked.user_id
+        ''', (season_id, season_id))
+
+    async def distribute_season_rewards(self, conn, season_id: int) -> List[int]:
+        """Распределение наград по итогам сезона; возвращает id участников.
+
+        Награды по местам собираются во временную таблицу одним
+        проходом по участникам (CASE по SEASON_REWARD_TIERS), а начисление, журнал, предметы
+        и отметка rewards_claimed выполняются по ней set-based запросами
+        в транзакции вызывающего кода. Уже отмеченные участники не
+        получают награду повторно.
+        """
+        columns = [reward_tier_case(field) for field in (1, 2, 3)]
+        await conn.execute('DROP TABLE IF EXISTS temp.season_payouts')
+        await conn.execute(f'''
+            CREATE TEMP TABLE season_payouts AS
+            SELECT user_id, final_rank,
+                   {columns[0][0]} AS coins,
+                   {columns[1][0]} AS xp,
+                   {columns[2][0]} AS item
+            FROM user_season_stats
+            WHERE season_id = ? AND final_rank IS NOT NULL AND rewards_claimed = 0
+        ''', [value for _, params in columns for value in params] + [season_id])
+        
+        # Коины и опыт одним UPDATE ... FROM, операции журнала - INSERT ... SELECT
+        await self.users.add_rewards_select(conn, 'SELECT user_id, coins, xp FROM temp.season_payouts')
+        await self.users.ledger.record_select(conn, 'season_reward', '''
+            SELECT user_id, coins AS amount, NULL AS counterparty_id, NULL AS item_id,
+                   CAST(final_rank AS TEXT) AS note
+            FROM temp.season_payouts
+            ORDER BY final_rank, user_id
+        ''')
         
-        cursor = await self.conn.execute('''
-            SELECT user_id, final_rank 
-            FROM user_season_stats 
-            WHERE season_id = ? AND final_rank IS NOT NULL
+        # Особые предметы для топ-3
+        await conn.execute('''
+            INSERT INTO user_inventory (user_id, item_id, purchased_at, is_active)
+            SELECT user_id, (SELECT id FROM seasonal_shop_items WHERE item_type = p.item), ?, 1
+            FROM temp.season_payouts AS p
+            WHERE p.item IS NOT NULL
+        ''', (datetime.now().isoformat(),))
+        
+        # Отмечаем получение наград
+        cursor = await conn.execute('''
+            UPDATE user_season_stats 
+            SET rewards_claimed = 1 
+            WHERE season_id = ? AND final_rank IS NOT NULL AND rewards_claimed = 0
+            RETURNING user_id
         ''', (season_id,))
+        participants = [user_id for user_id, in await cursor.fetchall()]
         
-        participants = await cursor.fetchall()
-        
-        for user_id, rank in participants:
-            if rank == 1:
-                reward = rewards[1]
-            elif rank == 2:
-                reward = rewards[2] 
-            elif rank == 3:
-                reward = rewards[3]
-            elif rank <= 10:
-                reward = rewards['top10']
-            elif rank <= 50:
-                reward = rewards['top50']
-            else:
-                reward = rewards['participant']
-            
-            # Выдаем награды
-            await self.conn.execute('''
-                UPDATE users 
-                SET balance = balance + ?, xp = xp + ?
-                WHERE user_id = ?
-            ''', (reward['coins'], reward['xp'], user_id))
-            
-            # Отмечаем получение наград
-            await self.conn.execute('''
-                UPDATE user_season_stats 
-                SET rewards_claimed = 1 
-                WHERE user_id = ? AND season_id = ?
-            ''', (user_id, season_id))
-            
-            # Выдаем особые предметы для топ-3
-            if rank <= 3 and 'item' in reward:
-                await self.give_seasonal_item(user_id, reward['item'])
-        
-        await self.conn.commit()
-
-    async def give_seasonal_item(self, user_id: int, item_type: str):
-        """Выдача сезонного предмета"""
-        await self.conn.execute('''
-            INSERT INTO user_inventory (user_id, item_id, purchased_at, is_active)
-            VALUES (?, (SELECT id FROM seasonal_shop_items WHERE item_type = ?), ?, 1)
-        ''', (user_id, item_type, datetime.now().isoformat()))
+        await conn.execute('DROP TABLE temp.season_payouts')
+        return participants
 
     async def soft_season_reset(self):
         """Мягкий сброс статистики между сезонами"""
-        # Сохраняем достижения, инвентарь, баланс
-        # Сбрасываем только сезонную статистику
-        await self.conn.execute('''
-            UPDATE users 
-            SET weekly_activity = 0,
-                daily_streak = 0
-        ''')
-        
-        # Архивируем старые сезонные данные
-        await self.conn.execute('''
-            INSERT INTO season_archive 
-            SELECT * FROM user_season_stats 
-            WHERE season_id NOT IN (SELECT id FROM seasons WHERE is_active = 1)
-        ''')
-        
-        # Очищаем старые данные
-        await self.conn.execute('''
-            DELETE FROM user_season_stats 
-            WHERE season_id NOT IN (SELECT id FROM seasons WHERE is_active = 1)
-        ''')
+        async def write_reset(conn):
+            # Сохраняем достижения, инвентарь, баланс
+            # Сбрасываем только сезонную статистику
+            await conn.execute('''
+                UPDATE users 
+                SET weekly_activity = 0,
+                    daily_streak = 0
+            ''')
+            
+            # Архивируем старые сезонные данные
+            await conn.execute('''
+                INSERT INTO season_archive 
+                SELECT * FROM user_season_stats 
+                WHERE season_id NOT IN (SELECT id FROM seasons WHERE is_active = 1)
+            ''')
+            
+            # Очищаем старые данные
+            await conn.execute('''
+                DELETE FROM user_season_stats 
+                WHERE season_id NOT IN (SELECT id FROM seasons WHERE is_active = 1)
+            ''')
         
-        await self.conn.commit()
+        await self.db.write(write_reset)
 
     async def announce_season_end(self, season: Season):
         """Анонс завершения сезона"""
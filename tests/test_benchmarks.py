@@ -0,0 +1,34 @@
+"""Дымовой прогон всех замеров benchmarks.py на крошечных размерах.
+
+Каждый замер запускается отдельным процессом с таймаутом: упавший
+замер с незакрытым соединением aiosqlite не подвешивает тесты.
+"""
+import os
+import subprocess
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+for module in ('aiosqlite', 'matplotlib', 'numpy', 'PIL'):
+    pytest.importorskip(module)
+
+from benchmarks import BENCHMARKS  # noqa: E402
+
+TINY_ARGS = [
+    '--words', '50', '--messages', '50', '--users', '200', '--clients', '3',
+    '--actions', '200', '--readers', '1', '--reports', '1', '--rows', '500',
+    '--batch', '20', '--sizes', '200', '--repeats', '1',
+]
+
+
+@pytest.mark.parametrize('benchmark', sorted(BENCHMARKS))
+def test_benchmark_runs(benchmark, tmp_path):
+    result = subprocess.run(
+        [sys.executable, os.path.join(ROOT, 'benchmarks.py'), benchmark, *TINY_ARGS, '--dir', str(tmp_path)],
+        cwd=tmp_path, capture_output=True, text=True, timeout=120
+    )
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.strip()
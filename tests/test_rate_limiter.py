@@ -0,0 +1,130 @@
+"""Тесты RateLimiter на fakeredis (Lua-скрипты выполняются через lupa).
+
+Зависимости для запуска: pip install pytest "fakeredis[lua]"
+"""
+import asyncio
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+fakeredis = pytest.importorskip('fakeredis')
+pytest.importorskip('lupa')
+
+from rate_limiter import SLIDING_WINDOW_SCRIPT, RateLimiter  # noqa: E402
+
+
+def make_limiter(connected: bool = True):
+    server = fakeredis.FakeServer()
+    server.connected = connected
+    client = fakeredis.FakeAsyncRedis(server=server)
+    return RateLimiter(client, prefix='test'), client, server
+
+
+def test_sliding_window_script_caps_count():
+    async def scenario():
+        _, client, _ = make_limiter()
+        script = client.register_script(SLIDING_WINDOW_SCRIPT)
+        counts = []
+        for i in range(8):
+            counts.append(int(await script(keys=['window'], args=[1000 + i, 60000, f'event-{i}', 6])))
+        # Хранятся только limit + 1 последних событий, ключ живёт не дольше окна
+        assert await client.zcard('window') == 6
+        assert 0 < await client.pttl('window') <= 60000
+        return counts
+
+    assert asyncio.run(scenario()) == [1, 2, 3, 4, 5, 6, 6, 6]
+
+
+def test_sliding_window_script_drops_old_events():
+    async def scenario():
+        _, client, _ = make_limiter()
+        script = client.register_script(SLIDING_WINDOW_SCRIPT)
+        for i in range(3):
+            await script(keys=['window'], args=[1000 + i, 60000, f'event-{i}', 6])
+        return int(await script(keys=['window'], args=[70000, 60000, 'late', 6]))
+
+    assert asyncio.run(scenario()) == 1
+
+
+def test_hit_window_exceeds_limit():
+    async def scenario():
+        limiter, client, _ = make_limiter()
+        hits = [await limiter.hit_window('spam', 1, 60, 5) for _ in range(7)]
+        other = await limiter.hit_window('spam', 2, 60, 5)
+        assert await client.zcard('test:window:spam:1') == 6
+        assert not limiter.local_windows
+        return hits, other
+
+    hits, other = asyncio.run(scenario())
+    assert hits == [False] * 5 + [True, True]
+    assert other is False
+
+
+def test_acquire_cooldown_set_nx():
+    async def scenario():
+        limiter, client, _ = make_limiter()
+        first = await limiter.acquire_cooldown('reward', 1, 60)
+        second = await limiter.acquire_cooldown('reward', 1, 60)
+        other = await limiter.acquire_cooldown('reward', 2, 60)
+        ttl = await client.ttl('test:cooldown:reward:1')
+
+        # После истечения ключа кулдаун снова свободен
+        await client.delete('test:cooldown:reward:1')
+        again = await limiter.acquire_cooldown('reward', 1, 60)
+        assert not limiter.local_cooldowns
+        return first, second, other, ttl, again
+
+    first, second, other, ttl, again = asyncio.run(scenario())
+    assert (first, second, other, again) == (True, False, True, True)
+    assert 0 < ttl <= 60
+
+
+def test_add_warning_pipelined_incr():
+    async def scenario():
+        limiter, client, _ = make_limiter()
+        warnings = [await limiter.add_warning('spam', 1, 3600) for _ in range(3)]
+        ttl = await client.ttl('test:warnings:spam:1')
+
+        await limiter.reset('spam', 1)
+        after_reset = await limiter.add_warning('spam', 1, 3600)
+        return warnings, ttl, after_reset
+
+    warnings, ttl, after_reset = asyncio.run(scenario())
+    assert warnings == [1, 2, 3]
+    assert 0 < ttl <= 3600
+    assert after_reset == 1
+
+
+def test_fallback_to_memory_when_redis_is_down():
+    async def scenario():
+        limiter, _, _ = make_limiter(connected=False)
+        cooldown = [await limiter.acquire_cooldown('reward', 1, 60) for _ in range(2)]
+        hits = [await limiter.hit_window('spam', 1, 60, 5) for _ in range(7)]
+        warnings = [await limiter.add_warning('spam', 1, 3600) for _ in range(2)]
+        return limiter, cooldown, hits, warnings
+
+    limiter, cooldown, hits, warnings = asyncio.run(scenario())
+    assert cooldown == [True, False]
+    assert hits == [False] * 5 + [True, True]
+    assert warnings == [1, 2]
+    assert ('reward', 1) in limiter.local_cooldowns
+    assert ('spam', 1) in limiter.local_windows
+    assert limiter.memory_usage()[0] == 3
+
+
+def test_redis_retried_after_interval():
+    async def scenario():
+        limiter, client, server = make_limiter(connected=False)
+        assert await limiter.acquire_cooldown('reward', 1, 60) is True
+        assert not limiter._redis_ready()
+
+        # Redis вернулся: после retry_interval состояние снова общее
+        server.connected = True
+        limiter._retry_at = 0.0
+        assert await limiter.acquire_cooldown('reward', 2, 60) is True
+        return await client.exists('test:cooldown:reward:2')
+
+    assert asyncio.run(scenario()) == 1
@@ -0,0 +1,116 @@
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, Optional, Tuple, Any
+
+from models import User
+
+# Поля записи кэша: те же, что у models.User
+USER_FIELDS = User._fields
+
+
+class UserCache:
+    """Ограниченный LRU/TTL кэш горячих полей пользователей.
+
+    Запись сквозная: код, изменивший строку в БД, обновляет или
+    сбрасывает запись кэша. Загрузки, которые могли прочитать данные
+    до такого изменения, в кэш не попадают (см. generation).
+    """
+
+    def __init__(self, max_size: int = 10000, ttl: float = 300):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: "OrderedDict[int, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._locked: Dict[int, int] = {}
+        self._generation = 0
+
+        self.stats = {
+            'hits': 0,
+            'misses': 0,
+            'evictions': 0
+        }
+
+    @property
+    def generation(self) -> int:
+        """Номер поколения; запоминается перед загрузкой строки из БД"""
+        return self._generation
+
+    def get(self, user_id: int) -> Optional[Dict[str, Any]]:
+        entry = self._entries.get(user_id)
+        if entry is None:
+            self.stats['misses'] += 1
+            return None
+
+        expires_at, row = entry
+        if expires_at < time.monotonic():
+            del self._entries[user_id]
+            self.stats['misses'] += 1
+            return None
+
+        self._entries.move_to_end(user_id)
+        self.stats['hits'] += 1
+        return row
+
+    def put(self, user_id: int, row: Dict[str, Any], generation: Optional[int] = None):
+        """Сохранение загруженной строки.
+
+        Если с момента загрузки кэш менялся (generation устарел) или
+        по пользователю идёт запись, строка может быть неактуальной и
+        не сохраняется.
+        """
+        if generation is not None and generation != self._generation:
+            return
+        if user_id in self._locked:
+            return
+
+        self._entries[user_id] = (time.monotonic() + self.ttl, dict(row))
+        self._entries.move_to_end(user_id)
+
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.stats['evictions'] += 1
+
+    def update(self, user_id: int, **fields):
+        """Сквозное обновление полей уже закэшированного пользователя"""
+        entry = self._entries.get(user_id)
+        if entry:
+            entry[1].update(fields)
+
+    def apply_delta(self, user_id: int, **deltas):
+        """Прибавление дельт к числовым полям закэшированного пользователя"""
+        entry = self._entries.get(user_id)
+        if entry:
+            row = entry[1]
+            for field, delta in deltas.items():
+                row[field] = (row.get(field) or 0) + delta
+
+    def invalidate(self, *user_ids: int):
+        self._generation += 1
+        for user_id in user_ids:
+            self._entries.pop(user_id, None)
+
+    def lock(self, user_ids: Iterable[int]):
+        """Начало пакетной записи: загрузки этих пользователей не кэшируются"""
+        self._generation += 1
+        for user_id in user_ids:
+            self._locked[user_id] = self._locked.get(user_id, 0) + 1
+
+    def unlock(self, user_ids: Iterable[int]):
+        self._generation += 1
+        for user_id in user_ids:
+            count = self._locked.get(user_id, 0) - 1
+            if count > 0:
+                self._locked[user_id] = count
+            else:
+                self._locked.pop(user_id, None)
+
+    def clear(self):
+        self._generation += 1
+        self._entries.clear()
+
+    def get_stats(self) -> Dict[str, Any]:
+        total = self.stats['hits'] + self.stats['misses']
+        return {
+            'size': len(self._entries),
+            'hit_rate': self.stats['hits'] / total if total else 0.0,
+            **self.stats
+        }
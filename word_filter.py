@@ -0,0 +1,224 @@
+from collections import deque
+from typing import Dict, Iterable, List, Optional, Tuple
+
+
+class WordFilter:
+    """Фильтр запрещённых слов на автомате Ахо-Корасик.
+
+    Все вхождения всех слов находятся за один проход по тексту, поиск
+    автомат не перестраивает.
+    Добавление слова дописывает ветку в бор и пересчитывает суффиксные
+    ссылки только новой ветки и узлов, чей самый длинный суффикс теперь
+    в ней; удаление снимает отметку с узла и обновляет словарные ссылки
+    узлов, ссылающихся на него. Полностью автомат строится только при
+    загрузке, массовом импорте и чистке мёртвых веток.
+    """
+
+    def __init__(self):
+        self.actions: Dict[str, str] = {}
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._word: List[Optional[str]] = [None]
+        self._output_link: List[int] = [0]
+        self._depth: List[int] = [0]
+        # Обратные суффиксные ссылки; после перепривязки узла в старом
+        # списке остаётся устаревшая запись, её отсеивает проверка fail
+        self._fail_children: List[List[int]] = [[]]
+        # Суммарная длина слов: порог чистки мёртвых веток
+        self._chars = 0
+
+    def __len__(self) -> int:
+        return len(self.actions)
+
+    def __contains__(self, word: str) -> bool:
+        return word.lower() in self.actions
+
+    def _insert(self, word: str, action: str) -> Tuple[List[Tuple[int, str, int]], int]:
+        """Запись слова в бор; возвращает новые рёбра (родитель, символ, узел) и узел слова"""
+        branch = []
+        node = 0
+        for ch in word:
+            next_node = self._goto[node].get(ch)
+            if next_node is None:
+                next_node = len(self._goto)
+                self._goto[node][ch] = next_node
+                self._goto.append({})
+                self._fail.append(0)
+                self._word.append(None)
+                self._output_link.append(0)
+                self._depth.append(self._depth[node] + 1)
+                self._fail_children.append([])
+                branch.append((node, ch, next_node))
+            node = next_node
+
+        self._word[node] = word
+        self.actions[word] = action
+        self._chars += len(word)
+        return branch, node
+
+    def _link_branch(self, branch: List[Tuple[int, str, int]], word_node: int):
+        """Суффиксные ссылки новой ветки и узлов, для которых её узел - более длинный суффикс"""
+        goto = self._goto
+        fail = self._fail
+        children = self._fail_children
+
+        changed = []
+        for parent, ch, node in branch:
+            if parent:
+                state = fail[parent]
+                while state and ch not in goto[state]:
+                    state = fail[state]
+                fail[node] = goto[state].get(ch, 0)
+
+            # Переход по ch из узла v, у которого parent - суффикс, теперь
+            # имеет суффиксом node; ниже первого такого перехода ссылки
+            # уже длиннее node
+            stack = [v for v in children[parent] if fail[v] == parent]
+            while stack:
+                v = stack.pop()
+                child = goto[v].get(ch)
+                if child is None:
+                    stack.extend(u for u in children[v] if fail[u] == v)
+                else:
+                    fail[child] = node
+                    children[node].append(child)
+                    changed.append(child)
+
+            children[fail[node]].append(node)
+            changed.append(node)
+
+        changed.append(word_node)
+        self._update_output_links(changed)
+
+    def _update_output_links(self, roots: List[int]):
+        """Пересчёт словарных ссылок в поддеревьях суффиксных ссылок roots"""
+        fail = self._fail
+        word = self._word
+        output_link = self._output_link
+        children = self._fail_children
+        done = set()
+
+        # Сверху вниз: ссылка узла зависит от уже пересчитанной ссылки его суффикса
+        for root in sorted(roots, key=self._depth.__getitem__):
+            if root in done:
+                continue
+            queue = deque([root])
+            while queue:
+                node = queue.popleft()
+                done.add(node)
+                fail_node = fail[node]
+                output_link[node] = fail_node if word[fail_node] else output_link[fail_node]
+                queue.extend(u for u in children[node] if fail[u] == node and u not in done)
+
+    def add(self, word: str, action: str = 'warn'):
+        word = word.lower()
+        if not word:
+            return
+        if word in self.actions:
+            self.actions[word] = action
+            return
+
+        branch, node = self._insert(word, action)
+        self._link_branch(branch, node)
+
+    def bulk_add(self, items: Iterable[Tuple[str, str]]) -> int:
+        """Массовое добавление (слово, действие) с одним построением автомата; возвращает число новых слов"""
+        added = 0
+        for word, action in items:
+            word = word.strip().lower()
+            if word and word not in self.actions:
+                self._insert(word, action)
+                added += 1
+
+        if added:
+            self._build()
+        return added
+
+    def remove(self, word: str) -> bool:
+        word = word.lower()
+        if word not in self.actions:
+            return False
+
+        del self.actions[word]
+        self._chars -= len(word)
+
+        # Когда мёртвых веток становится много, перестраиваем бор
+        if len(self._goto) > 4 * (self._chars + 1):
+            self.load(list(self.actions.items()))
+            return True
+
+        node = 0
+        for ch in word:
+            node = self._goto[node][ch]
+        self._word[node] = None
+        self._update_output_links([node])
+        return True
+
+    def load(self, items: Iterable[Tuple[str, str]]):
+        """Полная загрузка словаря (например, из таблицы word_filters)"""
+        self.actions = {}
+        self._goto = [{}]
+        self._fail = [0]
+        self._word = [None]
+        self._output_link = [0]
+        self._depth = [0]
+        self._fail_children = [[]]
+        self._chars = 0
+        self.bulk_add(items)
+
+    def _build(self):
+        """Построение суффиксных ссылок обходом бора в ширину"""
+        fail = self._fail
+        output_link = self._output_link
+        word = self._word
+        children = self._fail_children = [[] for _ in self._goto]
+
+        fail[0] = 0
+        output_link[0] = 0
+        queue = deque()
+        for child in self._goto[0].values():
+            fail[child] = 0
+            output_link[child] = 0
+            children[0].append(child)
+            queue.append(child)
+
+        while queue:
+            node = queue.popleft()
+            for ch, child in self._goto[node].items():
+                state = fail[node]
+                while state and ch not in self._goto[state]:
+                    state = fail[state]
+                fail_node = self._goto[state].get(ch, 0)
+                fail[child] = fail_node
+                output_link[child] = fail_node if word[fail_node] else output_link[fail_node]
+                children[fail_node].append(child)
+                queue.append(child)
+
+    def find_all(self, text: str) -> List[Tuple[str, str]]:
+        """Все найденные слова (слово, действие) в порядке первого вхождения"""
+        if not self.actions:
+            return []
+
+        goto = self._goto
+        fail = self._fail
+        word = self._word
+        output_link = self._output_link
+
+        found: Dict[str, str] = {}
+        node = 0
+        for ch in text.lower():
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+
+            match = node if word[node] else output_link[node]
+            while match:
+                if word[match] not in found:
+                    found[word[match]] = self.actions[word[match]]
+                match = output_link[match]
+
+        return list(found.items())
+
+    def find_first(self, text: str) -> Optional[Tuple[str, str]]:
+        matches = self.find_all(text)
+        return matches[0] if matches else None